@@ -0,0 +1,79 @@
+# bench/bench_ping.py
+"""
+Compare the in-process ICMP engine against the fork-per-peer `ping` prober.
+
+Loopback test bed (default): every 127.0.0.0/8 address answers, so
+`--peers 300` probes 127.0.0.1..127.0.1.44 without any setup.
+
+netns test bed: create peers behind a veth pair and pass them with --targets, e.g.
+    ip netns add gwbench
+    ip link add gwb0 type veth peer name gwb1 netns gwbench
+    ip addr add 10.99.0.1/16 dev gwb0 && ip link set gwb0 up
+    ip -n gwbench link set gwb1 up && ip -n gwbench link set lo up
+    for i in $(seq 2 301); do ip -n gwbench addr add 10.99.$((i/250)).$((i%250+1))/16 dev gwb1; done
+    python3 -m bench.bench_ping --targets-file peers.txt
+
+Run from the repo root as root (raw socket) or with net.ipv4.ping_group_range covering your gid.
+"""
+import argparse, asyncio, ipaddress, resource, time
+
+from gre_watchdog.common.icmp import IcmpProber
+from gre_watchdog.common.ping import ping_stats_subprocess
+
+def loopback_targets(n: int) -> list[str]:
+    base = ipaddress.ip_address("127.0.0.1")
+    return [str(base + i) for i in range(n)]
+
+def usage() -> tuple[float, float]:
+    me = resource.getrusage(resource.RUSAGE_SELF)
+    ch = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return me.ru_utime + me.ru_stime + ch.ru_utime + ch.ru_stime, max(me.ru_maxrss, ch.ru_maxrss)
+
+async def run_socket(targets, count, timeout, interval):
+    p = IcmpProber()
+    if not p.open():
+        raise SystemExit("icmp socket not permitted")
+    try:
+        return await asyncio.gather(*(p.probe(ip, count, timeout, interval) for ip in targets))
+    finally:
+        p.close()
+
+async def run_subprocess(targets, count, timeout, _interval):
+    return await asyncio.gather(*(ping_stats_subprocess(ip, count, timeout) for ip in targets))
+
+def bench(name, fn, targets, args):
+    cpu0, _ = usage()
+    t0 = time.perf_counter()
+    res = asyncio.run(fn(targets, args.count, args.timeout, args.interval_ms / 1000.0))
+    wall = time.perf_counter() - t0
+    cpu1, rss = usage()
+    lost = sum(1 for r in res if r.loss_percent > 0)
+    rtts = [r.rtt_avg_ms for r in res if r.rtt_avg_ms is not None]
+    avg_rtt = sum(rtts) / len(rtts) if rtts else float("nan")
+    print(f"{name:<11} peers={len(targets):<5} wall={wall:7.2f}s cpu={cpu1 - cpu0:7.2f}s "
+          f"maxrss={rss / 1024:7.1f}MB peers_with_loss={lost:<4} avg_rtt={avg_rtt:.3f}ms")
+
+def main():
+    ap = argparse.ArgumentParser(prog="bench_ping")
+    ap.add_argument("--peers", type=int, default=200, help="loopback peers when no targets given")
+    ap.add_argument("--targets-file", help="one IP per line (netns test bed)")
+    ap.add_argument("--count", type=int, default=7)
+    ap.add_argument("--timeout", type=int, default=2)
+    ap.add_argument("--interval-ms", type=int, default=200)
+    ap.add_argument("--engine", choices=("both", "socket", "subprocess"), default="both")
+    args = ap.parse_args()
+
+    if args.targets_file:
+        with open(args.targets_file) as f:
+            targets = [l.strip() for l in f if l.strip()]
+    else:
+        targets = loopback_targets(args.peers)
+
+    # socket first: RUSAGE_CHILDREN is cumulative, so forks must come last
+    if args.engine in ("both", "socket"):
+        bench("socket", run_socket, targets, args)
+    if args.engine in ("both", "subprocess"):
+        bench("subprocess", run_subprocess, targets, args)
+
+if __name__ == "__main__":
+    main()
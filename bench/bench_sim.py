@@ -0,0 +1,153 @@
+# bench/bench_sim.py
+"""
+Load and behaviour benchmark of the coordinator on the simulator (bench/sim.py):
+monitor_loop, check_tunnel, the reset orchestrator and state persistence at
+10 / 100 / 1000 tunnels, with a virtual clock: 30 simulated minutes take a
+second or two at 10 tunnels and about two minutes at 1000.
+
+Scenarios:
+  steady       no faults, 1% background loss
+  gre_fault    5% of the tunnels get a stuck GRE session a reset cures
+  peer_outage  one peer unreachable (public and GRE) for 10 minutes; no reset expected
+  shared_fate  all GRE tunnels of one peer bad, public fine; held, no reset expected
+
+Reported per run: round duration (virtual), real time per round, event-loop
+lag (real time of one loop iteration), Python memory peak, state journal and
+history bytes, echoes and agent RPCs, time to detect / recover, resets.
+
+    python3 -m bench.bench_sim
+    python3 -m bench.bench_sim --sizes 1000 --scenarios gre_fault --json now.json
+    python3 -m bench.bench_sim --json now.json --compare before.json   # exit 1 on regression
+
+Run from the repo root; needs nothing but the coordinator's own dependencies.
+"""
+import argparse, json, logging, sys, tempfile
+
+from bench.sim import SimNet, Simulation
+
+SCENARIOS = ("steady", "gre_fault", "peer_outage", "shared_fate")
+FAULT_AT = 120.0
+
+# lower is better; checked by --compare
+WATCHED = ("round_p95_s", "cpu_ms_per_round", "lag_p99_ms", "lag_max_ms", "py_peak_mb", "state_kb",
+           "ttd_p95_s", "ttr_p95_s", "false_resets", "checks_skipped", "undetected", "unrecovered")
+
+def build(scenario: str, n: int, seed: int) -> SimNet:
+    net = SimNet(n, seed=seed)
+    peers = net.peers()
+    if scenario == "gre_fault":
+        hit = list(net.fleet)[:: 20] or [1]
+        for i, tid in enumerate(hit):
+            net.fault("gre", tid, FAULT_AT + i % 30, heal_on_reset=True)
+    elif scenario == "peer_outage":
+        net.fault("peer", peers[1], FAULT_AT, FAULT_AT + 600)
+    elif scenario == "shared_fate":
+        net.fault("peer_gre", peers[0], FAULT_AT)
+    return net
+
+def pct(xs: list, q: float):
+    if not xs:
+        return None
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+def run(scenario: str, n: int, args) -> dict:
+    net = build(scenario, n, args.seed)
+    overrides = {"check_interval_sec": args.interval} if args.interval else {}
+    with tempfile.TemporaryDirectory(prefix="gw-sim-") as d:
+        rep = Simulation(net, d, overrides).run(args.duration, trace_memory=not args.no_memory)
+    r = {
+        "scenario": scenario,
+        "tunnels": n,
+        "virtual_s": rep.virtual_sec,
+        "real_s": round(rep.real_sec, 2),
+        "rounds": rep.rounds,
+        "round_p50_s": pct(rep.round_sec, 0.5),
+        "round_p95_s": pct(rep.round_sec, 0.95),
+        "cpu_ms_per_round": round(rep.round_cpu_ms, 2),
+        "lag_p99_ms": pct(rep.loop_lag_ms, 0.99),
+        "lag_max_ms": max(rep.loop_lag_ms, default=None),
+        "py_peak_mb": rep.py_peak_mb,
+        "state_kb": rep.state_bytes / 1024,
+        "history_kb": rep.history_bytes / 1024,
+        "echoes": rep.echoes,
+        "rpc_calls": rep.rpc_calls,
+        "ttd_p50_s": pct(rep.detect_sec, 0.5),
+        "ttd_p95_s": pct(rep.detect_sec, 0.95),
+        "ttr_p50_s": pct(rep.recover_sec, 0.5),
+        "ttr_p95_s": pct(rep.recover_sec, 0.95),
+        "resets": rep.resets,
+        "false_resets": rep.false_resets,
+        "held": rep.held,
+        "checks_skipped": rep.checks_skipped,
+        "undetected": rep.undetected,
+        "unrecovered": rep.unrecovered,
+    }
+    return {k: round(v, 3) if isinstance(v, float) else v for k, v in r.items()}
+
+def fmt(v) -> str:
+    if v is None:
+        return "-"
+    return f"{v:.1f}" if isinstance(v, float) else str(v)
+
+def show(r: dict):
+    print(f"{r['scenario']:<11} n={r['tunnels']:<5} real={fmt(r['real_s'])}s rounds={r['rounds']} "
+          f"round p50/p95={fmt(r['round_p50_s'])}/{fmt(r['round_p95_s'])}s cpu/round={fmt(r['cpu_ms_per_round'])}ms "
+          f"lag p99/max={fmt(r['lag_p99_ms'])}/{fmt(r['lag_max_ms'])}ms mem={fmt(r['py_peak_mb'])}MB")
+    print(f"{'':<11} state={fmt(r['state_kb'])}KB history={fmt(r['history_kb'])}KB echoes={r['echoes']} "
+          f"rpc={r['rpc_calls']} ttd p50/p95={fmt(r['ttd_p50_s'])}/{fmt(r['ttd_p95_s'])}s "
+          f"ttr p50/p95={fmt(r['ttr_p50_s'])}/{fmt(r['ttr_p95_s'])}s resets={r['resets']} "
+          f"false={r['false_resets']} held={r['held']} skipped={r['checks_skipped']} "
+          f"undetected={r['undetected']} unrecovered={r['unrecovered']}")
+
+def compare(results: list, path: str, tolerance: float) -> int:
+    with open(path) as f:
+        base = {(r["scenario"], r["tunnels"]): r for r in json.load(f)}
+    bad = 0
+    for r in results:
+        b = base.get((r["scenario"], r["tunnels"]))
+        if b is None:
+            continue
+        for k in WATCHED:
+            old, new = b.get(k), r.get(k)
+            if old is None or new is None:
+                continue
+            # counts may go from 0 to 1; timings get a relative margin
+            limit = old * (1 + tolerance) if isinstance(old, float) else old
+            if new > limit and new - old > 1e-6:
+                print(f"REGRESSION {r['scenario']} n={r['tunnels']} {k}: {fmt(old)} -> {fmt(new)}")
+                bad += 1
+    return bad
+
+def main():
+    ap = argparse.ArgumentParser(prog="bench_sim")
+    ap.add_argument("--sizes", default="10,100,1000", help="tunnel counts, comma separated")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--duration", type=float, default=1800, help="virtual seconds per run")
+    ap.add_argument("--interval", type=float, default=0, help="override check_interval_sec")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--no-memory", action="store_true", help="skip tracemalloc (faster, no py_peak_mb)")
+    ap.add_argument("--json", help="write the results here")
+    ap.add_argument("--compare", help="results of an earlier --json run; exit 1 if something got worse")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="relative margin for --compare")
+    ap.add_argument("-v", "--verbose", action="store_true", help="show coordinator warnings")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.ERROR)
+
+    results = []
+    for scenario in args.scenarios.split(","):
+        if scenario not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {scenario}")
+        for n in (int(x) for x in args.sizes.split(",")):
+            r = run(scenario, n, args)
+            show(r)
+            results.append(r)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
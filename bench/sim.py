@@ -0,0 +1,471 @@
+# bench/sim.py
+"""
+Simulation harness for the coordinator: the real monitor_loop, check_tunnel,
+ResetOrchestrator, StateStore and AgentClient -> agent API path, driven by
+  - SimNet: a fake fleet (discovery source) with a scriptable loss model per
+    peer and per tunnel; local/remote link state follows the resets, and a
+    fault can be one that a reset cures;
+  - SimProber: stands in for the ICMP engine and answers from SimNet;
+  - SimOps: stands in for the agent's IfaceOps, so the real agent app (HMAC,
+    idempotency, batching) serves the coordinator in-process over httpx's
+    ASGI transport;
+  - VirtualLoop: an event loop whose clock jumps to the next timer whenever
+    nothing is runnable, so down_hold_sec, up_gap_sec, probe intervals and
+    RPC backoff cost no real time. time.time()/time.monotonic() follow the
+    virtual clock while a Simulation runs.
+
+Only coordinator code that talks to the kernel is replaced; everything else
+runs as in production, so a scenario measures the same code paths.
+"""
+from __future__ import annotations
+import asyncio, contextlib, ipaddress, logging, os, random, selectors, time
+from dataclasses import dataclass, field
+
+import httpx, yaml
+
+from gre_watchdog.agent.api import build_agent_app
+from gre_watchdog.agent.gre_ops import IfaceOps
+from gre_watchdog.common.models import ProbeStats
+from gre_watchdog.common.state import StateStore
+from gre_watchdog.common.tsdb import HistoryStore
+from gre_watchdog.common import ping
+from gre_watchdog.coordinator import actions, scheduler
+from gre_watchdog.coordinator.agents import AgentPool
+from gre_watchdog.coordinator.timers import Timers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EPOCH = 1_700_000_000.0
+
+def example_cfg(name: str) -> dict:
+    with open(os.path.join(ROOT, "config", f"{name}.yaml.example")) as f:
+        return yaml.safe_load(f)
+
+# --- virtual clock ---
+
+class VirtualClock:
+    def __init__(self, epoch: float = EPOCH):
+        self.epoch = epoch
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.epoch + self.now
+
+    @contextlib.contextmanager
+    def patched(self):
+        saved = time.time, time.monotonic
+        time.time, time.monotonic = self.time, self.monotonic
+        try:
+            yield self
+        finally:
+            time.time, time.monotonic = saved
+
+class _VirtualSelector:
+    """
+    Polls the real selector without blocking; when nothing is ready the wait
+    the loop asked for is added to the clock instead of slept. The real time
+    between two select() calls is one loop iteration: that is the event-loop
+    lag a timer would see.
+    """
+
+    def __init__(self, clock: VirtualClock):
+        self.real = selectors.DefaultSelector()
+        self.clock = clock
+        self.iterations: list[float] = []
+        self._mark = time.perf_counter()
+
+    def select(self, timeout=None):
+        now = time.perf_counter()
+        self.iterations.append(now - self._mark)
+        ready = self.real.select(0)
+        if not ready:
+            if timeout is None:
+                ready = self.real.select(None)  # only I/O (a worker thread) can wake the loop
+            elif timeout > 0:
+                self.clock.now += timeout
+        self._mark = time.perf_counter()
+        return ready
+
+    def __getattr__(self, name):
+        return getattr(self.real, name)
+
+class VirtualLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.vselector = _VirtualSelector(clock)
+        super().__init__(self.vselector)
+
+    def time(self) -> float:
+        return self.clock.monotonic()
+
+# --- fleet and loss model ---
+
+@dataclass
+class Fault:
+    """
+    Loss on `target` between start and end (virtual seconds). kind:
+      gre       one tunnel's GRE path (target = tunnel id)
+      peer      a peer's public address and all its tunnels (target = peer_public)
+      peer_gre  all GRE tunnels of a peer, public still fine (target = peer_public)
+    heal_on_reset: a remote down of the tunnel ends it (a stuck GRE session).
+    """
+    kind: str
+    target: object
+    start: float
+    end: float = float("inf")
+    loss: float = 1.0
+    heal_on_reset: bool = False
+
+    def active(self, now: float) -> bool:
+        return self.start <= now < self.end
+
+class SimNet:
+    """
+    n tunnels spread over peers of `per_peer` tunnels each, named like the
+    real ones (gre-ir-<id> here, gre-kh-<id> on the agent). Every echo is
+    lost with the highest loss of the faults that apply, else base_loss.
+    """
+
+    def __init__(self, n: int, per_peer: int = 4, base_loss: float = 0.01, rtt_ms: float = 40.0, seed: int = 1):
+        self.rng = random.Random(seed)
+        self.base_loss = base_loss
+        self.faults: list[Fault] = []
+        self.local_down: set[str] = set()
+        self.remote_down: set[str] = set()
+        self.remote_ops = 0
+        self.local_ops = 0
+        self.op_latency = 0.05
+        self.by_ip: dict[str, tuple[str, object]] = {}
+        self.rtt: dict[str, float] = {}
+        self.by_iface: dict[str, int] = {}
+        self.fleet: dict[int, dict] = {}
+        self.present: set[int] = set()
+        priv = ipaddress.ip_address("172.16.0.0")
+        for tid in range(1, n + 1):
+            p = (tid - 1) // per_peer
+            pub = f"198.18.{p // 250}.{p % 250 + 1}"
+            t = {
+                "id": tid,
+                "iface_local": f"gre-ir-{tid}",
+                "iface_remote": f"gre-kh-{tid}",
+                "peer_public": pub,
+                "local_private": str(priv + 4 * tid + 1),
+                "peer_private": str(priv + 4 * tid + 2),
+            }
+            self.fleet[tid] = t
+            self.by_ip[t["peer_private"]] = ("gre", tid)
+            self.by_ip[pub] = ("peer", pub)
+            self.rtt.setdefault(pub, rtt_ms * self.rng.uniform(0.5, 1.5))
+            self.rtt[t["peer_private"]] = self.rtt[pub]
+            self.by_iface[t["iface_local"]] = tid
+            self.by_iface[t["iface_remote"]] = tid
+        self.present = set(self.fleet)
+
+    # discovery
+    def tunnels(self) -> list[dict]:
+        return [dict(self.fleet[tid]) for tid in sorted(self.present)]
+
+    def peers(self) -> list[str]:
+        return sorted({t["peer_public"] for t in self.fleet.values()})
+
+    # scripting
+    def fault(self, kind: str, target, start: float, end: float = float("inf"), loss: float = 1.0,
+              heal_on_reset: bool = False) -> Fault:
+        f = Fault(kind, target, start, end, loss, heal_on_reset)
+        self.faults.append(f)
+        return f
+
+    def loss(self, ip: str, now: float) -> float:
+        kind, key = self.by_ip.get(ip, ("none", None))
+        if kind == "none":
+            return 1.0
+        worst = self.base_loss
+        if kind == "gre":
+            t = self.fleet[key]
+            if t["iface_local"] in self.local_down or t["iface_remote"] in self.remote_down:
+                return 1.0
+            for f in self.faults:
+                if f.active(now) and ((f.kind == "gre" and f.target == key)
+                                      or (f.kind in ("peer", "peer_gre") and f.target == t["peer_public"])):
+                    worst = max(worst, f.loss)
+        else:
+            for f in self.faults:
+                if f.active(now) and f.kind == "peer" and f.target == key:
+                    worst = max(worst, f.loss)
+        return worst
+
+    def bad_since(self, tid: int, now: float) -> float | None:
+        # start of the fault that makes the tunnel's GRE bad right now
+        t = self.fleet[tid]
+        starts = [f.start for f in self.faults if f.active(now) and f.loss > 0.2
+                  and ((f.kind == "gre" and f.target == tid) or (f.kind == "peer_gre" and f.target == t["peer_public"]))]
+        return min(starts) if starts else None
+
+    # link state
+    def set_remote(self, iface: str, up: bool, now: float):
+        self.remote_ops += 1
+        if up:
+            self.remote_down.discard(iface)
+            return
+        self.remote_down.add(iface)
+        tid = self.by_iface.get(iface)
+        for f in self.faults:
+            if f.heal_on_reset and f.kind == "gre" and f.target == tid and f.active(now):
+                f.end = now
+
+    async def set_local_many(self, ifaces: list[str], up: bool, use_netlink: bool = True) -> dict[str, str]:
+        # replaces actions.ip_link_set_many
+        self.local_ops += len(ifaces)
+        await asyncio.sleep(self.op_latency)
+        errors = {}
+        for i in ifaces:
+            if i not in self.by_iface:
+                errors[i] = f'Cannot find device "{i}"'
+            elif up:
+                self.local_down.discard(i)
+            else:
+                self.local_down.add(i)
+        return errors
+
+class SimProber:
+    """
+    Same interface as common.icmp.IcmpProber: echoes are sent interval_sec
+    apart, each one answered after the peer's RTT or lost at timeout_sec, and
+    decide() sees them in the order they resolve. One sleep per probe.
+    """
+
+    def __init__(self, net: SimNet):
+        self.net = net
+        self.echoes = 0
+
+    async def probe(self, ip: str, count: int, timeout_sec: float, interval_sec: float = 0.2,
+                    decide=None) -> ProbeStats:
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        p = self.net.loss(ip, t0)
+        rtt = self.net.rtt.get(ip, 40.0) / 1000.0
+        echoes = []
+        for i in range(count):
+            if self.net.rng.random() < p:
+                echoes.append((i * interval_sec + timeout_sec, None))
+            else:
+                r = rtt * self.net.rng.uniform(0.9, 1.3)
+                echoes.append((i * interval_sec + r, r * 1000.0))
+        echoes.sort(key=lambda e: e[0])
+        rtts, lost, verdict, elapsed = [], 0, None, 0.0
+        for at, r in echoes:
+            elapsed = at
+            if r is None:
+                lost += 1
+            else:
+                rtts.append(r)
+            if decide is not None:
+                verdict = decide(len(rtts), lost)
+                if verdict is not None:
+                    break
+        self.echoes += len(rtts) + lost
+        await asyncio.sleep(elapsed)
+        return ProbeStats.from_rtts(ip, len(rtts) + lost, rtts, verdict)
+
+    def close(self):
+        pass
+
+class SimOps(IfaceOps):
+    # the agent's interface ops, against SimNet instead of netlink
+    def __init__(self, net: SimNet):
+        super().__init__(workers=1, use_netlink=False)
+        self.net = net
+
+    async def _set(self, iface: str, up: bool) -> str:
+        await asyncio.sleep(self.net.op_latency)
+        if iface not in self.net.by_iface:
+            raise RuntimeError(f'Cannot find device "{iface}"')
+        self.net.set_remote(iface, up, asyncio.get_running_loop().time())
+        return ""
+
+def sim_agent(cfg: dict, net: SimNet, logger) -> AgentPool:
+    """
+    AgentPool whose clients talk to an in-process agent app (one per agent
+    spec) through httpx's ASGI transport.
+    """
+    agent_cfg = example_cfg("agent")
+    agent_cfg.update(shared_secret=cfg["shared_secret"], idempotency_db="", report_url="")
+    app = build_agent_app(agent_cfg, logger, SimOps(net))
+    pool = AgentPool(cfg, logger)
+    for c in pool.clients.values():
+        c._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), timeout=c.timeout)
+    return pool
+
+# --- run ---
+
+async def _cancel_all():
+    # checks, confirmations and resets still in flight when the run ends
+    me = asyncio.current_task()
+    pending = [t for t in asyncio.all_tasks() if t is not me]
+    for t in pending:
+        t.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+@dataclass
+class Report:
+    tunnels: int
+    virtual_sec: float
+    real_sec: float = 0.0
+    rounds: int = 0
+    round_sec: list = field(default_factory=list)        # virtual: round start -> last check of the round done
+    round_cpu_ms: float = 0.0                            # real time per round
+    loop_lag_ms: list = field(default_factory=list)      # real time of each loop iteration
+    echoes: int = 0
+    rpc_calls: int = 0
+    state_bytes: int = 0
+    history_bytes: int = 0
+    py_peak_mb: float | None = None
+    detect_sec: list = field(default_factory=list)      # fault start -> reset triggered
+    recover_sec: list = field(default_factory=list)     # fault start -> tunnel OK again
+    triggers: int = 0                                    # "reset triggered" events (repeat while a reset runs)
+    resets: int = 0                                      # resets actually started
+    false_resets: int = 0                                # resets of tunnels with no GRE fault
+    checks_skipped: int = 0                              # checks dropped because the previous one still ran
+    held: int = 0                                        # shared fate holds
+    undetected: int = 0
+    unrecovered: int = 0
+
+class Simulation:
+    """
+    Wires the coordinator the way coordinator/main.py does, against SimNet.
+    cfg starts from config/coordinator.yaml.example; pass overrides.
+    """
+
+    def __init__(self, net: SimNet, workdir: str, overrides: dict | None = None, logger=None):
+        self.net = net
+        self.workdir = workdir
+        self.cfg = example_cfg("coordinator")
+        self.cfg.update(
+            shared_secret="sim", agent_base_url="http://sim-agent", agents=None,
+            state_path=os.path.join(workdir, "state.json"), log_dir=workdir,
+            history_dir=os.path.join(workdir, "history"), icmp_engine="auto",
+        )
+        self.cfg.update(overrides or {})
+        self.logger = logger or logging.getLogger("gre-watchdog-sim")
+        self.clock = VirtualClock()
+
+    def run(self, duration: float, trace_memory: bool = False) -> Report:
+        loop = VirtualLoop(self.clock)
+        rep = Report(tunnels=len(self.net.fleet), virtual_sec=duration)
+        saved = actions.ip_link_set_many, ping._prober, ping._estimator, scheduler.check_tunnel
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        try:
+            with self.clock.patched():
+                actions.ip_link_set_many = self.net.set_local_many
+                ping._prober, ping._estimator = SimProber(self.net), None
+                loop.run_until_complete(self._main(duration, rep))
+                loop.run_until_complete(_cancel_all())
+        finally:
+            actions.ip_link_set_many, ping._prober, ping._estimator, scheduler.check_tunnel = saved
+            loop.close()
+        rep.real_sec = time.perf_counter() - t0
+        if trace_memory:
+            rep.py_peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+        rep.loop_lag_ms = [s * 1000.0 for s in loop.vselector.iterations[1:]]
+        rep.round_cpu_ms = rep.real_sec * 1000.0 / max(1, rep.rounds)
+        return rep
+
+    async def _main(self, duration: float, rep: Report):
+        cfg, net, logger = self.cfg, self.net, self.logger
+        store = StateStore(cfg["state_path"], cfg.get("state_flush_delay_ms", 1000) / 1000.0,
+                           cfg.get("state_compact_bytes", 4_000_000), cfg.get("state_fsync", False))
+        state = store.load()
+        history = HistoryStore(cfg["history_dir"], max_open=cfg.get("history_max_open", 4096)) \
+            if cfg.get("history_enabled", True) else None
+        locks: dict[int, asyncio.Lock] = {}
+        agent = sim_agent(cfg, net, logger)
+        timers = Timers(logger)
+        resets = actions.ResetOrchestrator(cfg, agent, logger, state, locks, store.save, timers)
+        loop = asyncio.get_running_loop()
+
+        rounds: list[float] = []
+        checks: list[tuple[float, float]] = []
+        real_check = scheduler.check_tunnel  # restored by run()
+
+        async def timed_check(*args, **kw):
+            start = loop.time()
+            try:
+                return await real_check(*args, **kw)
+            finally:
+                checks.append((start, loop.time()))
+        scheduler.check_tunnel = timed_check
+
+        async def discover_fn():
+            rounds.append(loop.time())
+            tunnels = net.tunnels()
+            for t in tunnels:
+                agent.annotate(t)
+                locks.setdefault(t["id"], asyncio.Lock())
+            return tunnels
+
+        async def reset_fn(tunnel, st, lock):
+            await resets.reset(tunnel, st)
+            store.save()
+
+        # detection / recovery, from the events and tunnel writes
+        detected: dict[int, float] = {}
+        open_faults: dict[int, float] = {}
+
+        def watch(kind, obj):
+            now = loop.time()
+            if kind == "event":
+                e = state.events.get(obj)
+                tid = e.get("tunnel_id") if e else None
+                if not e:
+                    return
+                if e["msg"] == "reset triggered (confirmed)":
+                    rep.triggers += 1
+                    since = net.bad_since(tid, now)
+                    if since is not None and tid not in detected:
+                        detected[tid] = now
+                        rep.detect_sec.append(now - since)
+                        open_faults[tid] = since
+                elif e["msg"] == "reset started":
+                    rep.resets += 1
+                    if net.bad_since(tid, now) is None:
+                        rep.false_resets += 1
+                elif e["msg"].startswith("shared fate:"):
+                    rep.held += 1
+            elif kind == "tunnel" and obj.id in open_faults and obj.status == "OK" and obj.last_action == "none":
+                rep.recover_sec.append(now - open_faults.pop(obj.id))
+
+        state.subscribe(watch)
+        await agent.start()
+        resets.resume()
+        skipped0 = scheduler.CHECKS_SKIPPED.value()
+        rpc0 = sum(c.metrics["calls"] for c in agent.clients.values())
+        task = loop.create_task(scheduler.monitor_loop(discover_fn, state, cfg, locks, reset_fn, store.save, state,
+                                                       logger, history))
+        await asyncio.sleep(duration)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+        faulted = {f.target for f in net.faults if f.kind == "gre" and f.loss > 0.2 and f.start < duration}
+        rep.undetected = len(faulted - set(detected))
+        rep.unrecovered = len(open_faults)
+        rep.rounds = len(rounds)
+        for i, r0 in enumerate(rounds[:-1]):
+            ends = [e for s, e in checks if r0 <= s < rounds[i + 1]]
+            if ends:
+                rep.round_sec.append(max(ends) - r0)
+        rep.checks_skipped = int(scheduler.CHECKS_SKIPPED.value() - skipped0)
+        rep.echoes = ping._prober.echoes
+        rep.rpc_calls = sum(c.metrics["calls"] for c in agent.clients.values()) - rpc0
+        store.close()
+        rep.state_bytes = store.bytes_written
+        if history is not None:
+            history.close()
+            rep.history_bytes = sum(e.stat().st_size for e in os.scandir(cfg["history_dir"]))
+        await agent.close()
@@ -1,20 +1,39 @@
 # gre_watchdog/agent/api.py
-import json, ipaddress
+import json, asyncio, time
 from fastapi import FastAPI, Request, HTTPException
-from gre_watchdog.common.security import hmac_verify
-from gre_watchdog.agent.gre_ops import iface_down, iface_up, iface_restart
+from fastapi.responses import PlainTextResponse
+from gre_watchdog.common.metrics import REGISTRY, CONTENT_TYPE, Counter, GaugeFunc, Histogram
+from gre_watchdog.common.security import cidr_allowed, hmac_verify
+from gre_watchdog.agent.gre_ops import IfaceOps
 from gre_watchdog.agent.idempotency import IdempotencyStore
+from gre_watchdog.agent.prober import AgentProber
 
-def cidr_allowed(client_ip: str, cidrs: list[str]) -> bool:
-    ip = ipaddress.ip_address(client_ip)
-    for c in cidrs:
-        if ip in ipaddress.ip_network(c, strict=False):
-            return True
-    return False
+OP_NAMES = ("down", "up", "restart")
 
-def build_agent_app(cfg: dict, logger):
+def _json_object(body: bytes) -> dict:
+    try:
+        data = json.loads(body.decode())
+    except ValueError:
+        raise HTTPException(400, "bad json")
+    if not isinstance(data, dict):
+        raise HTTPException(400, "json object required")
+    return data
+
+COMMANDS = Counter("gw_agent_commands", "Interface commands by outcome (cached = idempotent replay)", ["op", "result"])
+OP_SECONDS = Histogram("gw_agent_op_duration_seconds", "Interface operation time", ["op"])
+BATCH_ITEMS = Histogram("gw_agent_batch_items", "Items per /v1/iface/batch request",
+                        buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+IDEMPOTENCY_ENTRIES = GaugeFunc("gw_agent_idempotency_entries", "Cached command results")
+
+def build_agent_app(cfg: dict, logger, ops: IfaceOps | None = None):
     app = FastAPI()
-    store = IdempotencyStore(cfg["idempotency_ttl_sec"])
+    store = IdempotencyStore(cfg["idempotency_ttl_sec"], cfg.get("idempotency_max_entries", 100_000),
+                             cfg.get("idempotency_db", ""))
+    ops = ops or IfaceOps(cfg.get("ops_workers", 4), cfg.get("ops_netlink", True))
+    inflight: dict[str, asyncio.Future] = {}
+    IDEMPOTENCY_ENTRIES.set_function(lambda: (((), len(store)),))
+    # probe محلی GRE و ارسال گزارش به coordinator (اختیاری)
+    prober = AgentProber(cfg, logger) if cfg.get("report_url") else None
 
     def auth(req: Request, body: bytes):
         client_ip = req.client.host if req.client else "0.0.0.0"
@@ -27,46 +46,119 @@ def build_agent_app(cfg: dict, logger):
         if not ok:
             raise HTTPException(401, "unauthorized")
 
-    async def handle(req: Request, op):
+    async def run_op(cmd_id: str, op_name: str, iface: str, reply_id: str) -> dict:
+        cached = store.get(cmd_id)
+        if cached:
+            COMMANDS.labels(op_name, "cached").inc()
+            return cached["value"]  # همان پاسخ قبلی: idempotent
+        if cmd_id in inflight:
+            # retry رسید در حالی که اجرای اول هنوز تمام نشده
+            COMMANDS.labels(op_name, "cached").inc()
+            first = inflight[cmd_id]
+            try:
+                return await asyncio.shield(first)
+            except asyncio.CancelledError:
+                if not first.cancelled():
+                    raise
+                # اجرای اول وسط کار cancel شد؛ نتیجه‌ای ذخیره نشده، retry بعدی دوباره اجرا می‌کند
+                return {"ok": False, "command_id": reply_id, "iface": iface, "error": "interrupted, retry"}
+
+        fut = asyncio.get_running_loop().create_future()
+        inflight[cmd_id] = fut
+        t0 = time.monotonic()
+        fields = {"command_id": cmd_id, "op": op_name, "iface": iface}
+        try:
+            try:
+                with OP_SECONDS.labels(op_name).time():
+                    out = await getattr(ops, op_name)(iface)
+                res = {"ok": True, "command_id": reply_id, "iface": iface, "out": out}
+                fields["latency_ms"] = round((time.monotonic() - t0) * 1000.0, 2)
+                logger.info(f"cmd {cmd_id} ok op={op_name} iface={iface}", extra=fields)
+            except Exception as e:
+                res = {"ok": False, "command_id": reply_id, "iface": iface, "error": str(e)}
+                fields["latency_ms"] = round((time.monotonic() - t0) * 1000.0, 2)
+                logger.error(f"cmd {cmd_id} fail op={op_name} iface={iface} err={e}", extra=fields)
+            COMMANDS.labels(op_name, "ok" if res["ok"] else "error").inc()
+            store.set(cmd_id, res)
+            fut.set_result(res)
+            return res
+        finally:
+            # cancelled (client gone, shutdown): the retries waiting on us must not hang
+            inflight.pop(cmd_id, None)
+            if not fut.done():
+                fut.cancel()
+
+    async def handle(req: Request, op_name: str):
         body = await req.body()
         auth(req, body)
-        data = json.loads(body.decode())
+        data = _json_object(body)
         cmd_id = data.get("command_id")
         iface = data.get("iface")
 
         if not cmd_id or not iface:
             raise HTTPException(400, "command_id and iface required")
 
-        cached = store.get(cmd_id)
-        if cached:
-            return cached["value"]  # همان پاسخ قبلی: idempotent
+        return await run_op(cmd_id, op_name, iface, cmd_id)
 
-        try:
-            out = op(iface)
-            res = {"ok": True, "command_id": cmd_id, "iface": iface, "out": out}
-            store.set(cmd_id, res)
-            logger.info(f"cmd {cmd_id} ok iface={iface}")
-            return res
-        except Exception as e:
-            res = {"ok": False, "command_id": cmd_id, "iface": iface, "error": str(e)}
-            store.set(cmd_id, res)
-            logger.error(f"cmd {cmd_id} fail iface={iface} err={e}")
-            return res
+    @app.post("/v1/iface/batch")
+    async def batch(req: Request):
+        # چند عملیات با یک امضا؛ command_id هر آیتم زیر command_id کل batch است
+        body = await req.body()
+        auth(req, body)
+        data = _json_object(body)
+        batch_id = data.get("command_id")
+        items = data.get("items")
+        if not batch_id or not isinstance(items, list):
+            raise HTTPException(400, "command_id and items required")
+        if len(items) > cfg.get("batch_max_items", 500):
+            raise HTTPException(400, "too many items")
+        for it in items:
+            if (not isinstance(it, dict) or it.get("op") not in OP_NAMES
+                    or not it.get("command_id") or not isinstance(it["command_id"], str)
+                    or not it.get("iface") or not isinstance(it["iface"], str)):
+                raise HTTPException(400, "each item needs command_id, op (down/up/restart) and iface")
+
+        BATCH_ITEMS.observe(len(items))
+        jobs = []
+        for it in items:
+            item_id = it["command_id"]
+            jobs.append(run_op(f"{batch_id}/{item_id}", it["op"], it["iface"], item_id))
+        results = await asyncio.gather(*jobs)
+        return {"ok": all(r["ok"] for r in results), "command_id": batch_id, "results": results}
 
     @app.post("/v1/iface/down")
     async def down(req: Request):
-        return await handle(req, iface_down)
+        return await handle(req, "down")
 
     @app.post("/v1/iface/up")
     async def up(req: Request):
-        return await handle(req, iface_up)
+        return await handle(req, "up")
 
     @app.post("/v1/iface/restart")
     async def restart(req: Request):
-        return await handle(req, iface_restart)
+        return await handle(req, "restart")
 
     @app.get("/health")
     async def health():
         return {"ok": True}
 
+    @app.get("/metrics")
+    async def metrics(req: Request):
+        client_ip = req.client.host if req.client else "0.0.0.0"
+        if not cidr_allowed(client_ip, cfg.get("metrics_allow_cidrs", cfg.get("allow_cidrs", ["0.0.0.0/0"]))):
+            raise HTTPException(403, "forbidden")
+        return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    @app.on_event("startup")
+    async def startup():
+        if prober:
+            await prober.start()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        if prober:
+            await prober.close()
+        ops.close()
+        store.close()
+
     return app
@@ -1,18 +1,62 @@
 # gre_watchdog/agent/gre_ops.py
-import subprocess
+import asyncio, socket
+from concurrent.futures import ThreadPoolExecutor
+from gre_watchdog.common import netlink as nl
 
-def run(cmd: list[str]) -> str:
-    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+async def run(cmd: list[str]) -> str:
+    p = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    out, _ = await p.communicate()
+    out = out.decode(errors="ignore").strip()
     if p.returncode != 0:
-        raise RuntimeError(p.stdout.strip())
-    return p.stdout.strip()
+        raise RuntimeError(out)
+    return out
 
-def iface_down(iface: str) -> str:
-    return run(["ip", "link", "set", "dev", iface, "down"])
+def netlink_link_set(iface: str, up: bool) -> str:
+    try:
+        idx = socket.if_nametoindex(iface)
+    except OSError:
+        raise RuntimeError(f'Cannot find device "{iface}"')
+    s = nl.open_route_socket()
+    try:
+        nl.link_set_up(s, idx, up)
+    except nl.NetlinkError as e:
+        raise RuntimeError(f"netlink link set {iface}: {e.strerror}")
+    finally:
+        s.close()
+    return ""
 
-def iface_up(iface: str) -> str:
-    return run(["ip", "link", "set", "dev", iface, "up"])
+class IfaceOps:
+    """
+    Interface up/down without blocking the agent's event loop: netlink calls on
+    a bounded worker pool (no fork), or `ip` via asyncio subprocess. Commands on
+    the same iface run in order; different ifaces run in parallel.
+    """
 
-def iface_restart(iface: str) -> str:
-    iface_down(iface)
-    return iface_up(iface)
+    def __init__(self, workers: int = 4, use_netlink: bool = True):
+        self.netlink = use_netlink and hasattr(socket, "AF_NETLINK")
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="iface-ops")
+        self.locks: dict[str, asyncio.Lock] = {}
+
+    async def _set(self, iface: str, up: bool) -> str:
+        if self.netlink:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, netlink_link_set, iface, up)
+        return await run(["ip", "link", "set", "dev", iface, "up" if up else "down"])
+
+    def _lock(self, iface: str) -> asyncio.Lock:
+        return self.locks.setdefault(iface, asyncio.Lock())
+
+    async def down(self, iface: str) -> str:
+        async with self._lock(iface):
+            return await self._set(iface, False)
+
+    async def up(self, iface: str) -> str:
+        async with self._lock(iface):
+            return await self._set(iface, True)
+
+    async def restart(self, iface: str) -> str:
+        async with self._lock(iface):
+            await self._set(iface, False)
+            return await self._set(iface, True)
+
+    def close(self):
+        self.pool.shutdown(wait=False)
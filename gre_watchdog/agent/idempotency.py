@@ -1,21 +1,122 @@
-import time
-from typing import Dict
+import asyncio, json, os, sqlite3, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from gre_watchdog.common.metrics import Counter
+
+IDEMPOTENCY_EVICTED = Counter("gw_agent_idempotency_evicted", "Cached command results dropped", ["reason"])
 
 class IdempotencyStore:
-    def __init__(self, ttl_sec: int):
+    """
+    command_id -> result cache, LRU ordered: an entry lives ttl_sec since it was
+    last set or replayed, and at most max_entries are kept. Since every touch
+    moves an entry to the end, the oldest one is always first and expiry only
+    looks at the head (O(1) amortized).
+
+    With `path` the results are also written to a small sqlite file, so a
+    command retried after an agent restart is still answered from cache.
+    Writes are collected for commit_delay seconds and committed in one
+    transaction on a single writer thread, off the event loop; a crash loses
+    at most that window, and a retry of one of those commands runs it again.
+    """
+
+    def __init__(self, ttl_sec: int, max_entries: int = 100_000, path: str = "", commit_delay: float = 0.05):
         self.ttl = ttl_sec
-        self.db: Dict[str, dict] = {}
+        self.max_entries = max(1, int(max_entries))
+        self.db: "OrderedDict[str, dict]" = OrderedDict()
+        self.conn: sqlite3.Connection | None = None
+        self.commit_delay = commit_delay
+        self._writes = 0
+        self._pending: list[tuple] = []
+        self._handle: asyncio.TimerHandle | None = None
+        self._pool: ThreadPoolExecutor | None = None
+        if path:
+            self._open(path)
+
+    def __len__(self) -> int:
+        return len(self.db)
 
     def get(self, key: str):
         self._gc()
-        return self.db.get(key)
+        e = self.db.get(key)
+        if e is not None:
+            e["ts"] = time.time()  # replays keep it alive (not persisted: a restart only shortens the TTL)
+            self.db.move_to_end(key)
+        return e
 
     def set(self, key: str, value: dict):
         self._gc()
-        self.db[key] = {"ts": time.time(), "value": value}
+        e = {"ts": time.time(), "value": value}
+        self.db[key] = e
+        self.db.move_to_end(key)
+        while len(self.db) > self.max_entries:
+            self.db.popitem(last=False)
+            IDEMPOTENCY_EVICTED.labels("cap").inc()
+        if self.conn is not None:
+            self._pending.append((key, e["ts"], json.dumps(value)))
+            if self._handle is None:
+                try:
+                    self._handle = asyncio.get_running_loop().call_later(self.commit_delay, self._flush)
+                except RuntimeError:
+                    self._write(self._take())  # no loop (tools, shutdown): write through
+
+    def _take(self) -> list[tuple]:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        rows, self._pending = self._pending, []
+        return rows
+
+    def _flush(self):
+        self._handle = None
+        rows = self._take()
+        if rows and self._pool is not None:
+            self._pool.submit(self._write, rows)
+
+    def _write(self, rows: list[tuple]):
+        # writer thread only (or the caller once the pool is gone)
+        if not rows:
+            return
+        self.conn.executemany("INSERT OR REPLACE INTO results(key, ts, value) VALUES (?, ?, ?)", rows)
+        self.conn.commit()
+        before, self._writes = self._writes, self._writes + len(rows)
+        if self._writes // 1000 != before // 1000:
+            self._prune()
 
     def _gc(self):
-        now = time.time()
-        dead = [k for k, v in self.db.items() if now - v["ts"] > self.ttl]
-        for k in dead:
-            self.db.pop(k, None)
+        cut = time.time() - self.ttl
+        while self.db:
+            k, e = next(iter(self.db.items()))
+            if e["ts"] >= cut:
+                break
+            self.db.popitem(last=False)
+            IDEMPOTENCY_EVICTED.labels("expired").inc()
+
+    def _open(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # used by the writer thread after this; one thread, so never concurrently
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, ts REAL NOT NULL, value TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_ts ON results(ts)")
+        self._prune()
+        rows = self.conn.execute("SELECT key, ts, value FROM results ORDER BY ts DESC LIMIT ?", (self.max_entries,)).fetchall()
+        for key, ts, value in reversed(rows):
+            self.db[key] = {"ts": ts, "value": json.loads(value)}
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="idempotency-db")
+
+    def _prune(self):
+        # the file follows the same TTL and cap as memory
+        self.conn.execute("DELETE FROM results WHERE ts < ?", (time.time() - self.ttl,))
+        self.conn.execute("DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY ts DESC LIMIT ?)",
+                          (self.max_entries,))
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+            self._write(self._take())
+            self.conn.close()
+            self.conn = None
@@ -8,5 +8,7 @@ def load_cfg(path="config/agent.yaml"):
         return yaml.safe_load(f)
 
 CFG = load_cfg()
-logger = setup_logger("gre-watchdog-agent", CFG["log_dir"])
+logger = setup_logger("gre-watchdog-agent", CFG["log_dir"], json_format=CFG.get("log_json", False),
+                      queue_size=CFG.get("log_queue_size", 10_000), rate_burst=CFG.get("log_rate_burst", 20),
+                      rate_window_sec=CFG.get("log_rate_window_sec", 60))
 app = build_agent_app(CFG, logger)
@@ -0,0 +1,98 @@
+# gre_watchdog/agent/prober.py
+"""
+Agent-side GRE probing. The agent pings the coordinator-side private address
+of every local gre-kh-* tunnel on its own schedule and pushes one signed
+report per round to the coordinator (POST /v1/agent/report), which gives the
+coordinator the outside-to-inside direction without spending its own probes.
+"""
+from __future__ import annotations
+import asyncio, json, time
+import httpx
+from gre_watchdog.common.gre_discover import TunnelIndex
+from gre_watchdog.common.metrics import Counter, Histogram
+from gre_watchdog.common.ping import probe
+from gre_watchdog.common.security import hmac_sign
+
+REPORT_PATH = "/v1/agent/report"
+
+REPORTS = Counter("gw_agent_reports", "Probe reports pushed to the coordinator", ["result"])
+REPORT_ROUND_SECONDS = Histogram("gw_agent_report_round_seconds", "One agent probe round (all tunnels)")
+
+def report_row(tid: int, st) -> list:
+    # [id, sent, received, rtt_avg_ms]: کوچک نگه داشتن گزارش برای چند صد تونل
+    rtt = round(st.rtt_avg_ms, 2) if st.rtt_avg_ms is not None else None
+    return [tid, st.sent, st.received, rtt]
+
+class AgentProber:
+    def __init__(self, cfg: dict, logger):
+        self.url = cfg["report_url"].rstrip("/") + REPORT_PATH
+        self.secret = cfg["shared_secret"]
+        self.name = cfg.get("report_name") or cfg.get("role", "kh")
+        self.interval = float(cfg.get("report_interval_sec", 15))
+        self.inflight = asyncio.Semaphore(int(cfg.get("report_max_inflight", 64)))
+        self.logger = logger
+        # probe() reads the coordinator's key names
+        self.probe_cfg = {
+            "ping_count": int(cfg.get("report_ping_count", 5)),
+            "ping_timeout_sec": cfg.get("report_ping_timeout_sec", 2),
+            "icmp_engine": cfg.get("icmp_engine", "auto"),
+            "icmp_interval_ms": cfg.get("icmp_interval_ms", 200),
+        }
+        self.index = TunnelIndex(cfg["iface_regex"], logger, cfg.get("discovery_poll_sec", 30))
+        self.seq = 0
+        self._client: httpx.AsyncClient | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        await self.index.start()
+        self._client = httpx.AsyncClient(timeout=max(2.0, min(10.0, self.interval / 2)))
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self.index.close()
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    async def _probe(self, t: dict) -> list:
+        async with self.inflight:
+            st = await probe(t["peer_private"], self.probe_cfg, self.logger)
+        return report_row(t["id"], st)
+
+    async def round(self) -> dict:
+        await self.index.refresh()
+        rows = await asyncio.gather(*(self._probe(t) for t in self.index.tunnels()))
+        self.seq += 1
+        return {"agent": self.name, "seq": self.seq, "ts": time.time(), "interval": self.interval, "rows": rows}
+
+    async def push(self, report: dict):
+        body = json.dumps(report, separators=(",", ":")).encode()
+        ts = str(int(time.time()))
+        headers = {"x-ts": ts, "x-sig": hmac_sign(self.secret, body, ts), "content-type": "application/json"}
+        try:
+            r = await self._client.post(self.url, content=body, headers=headers)
+            r.raise_for_status()
+            REPORTS.labels("ok" if r.json().get("ok") else "rejected").inc()
+        except Exception as e:
+            # گزارش بعدی تازه‌تر است؛ retry لازم نیست
+            REPORTS.labels("error").inc()
+            self.logger.warning(f"report push failed err={e}")
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        next_round = loop.time()
+        while True:
+            try:
+                with REPORT_ROUND_SECONDS.time():
+                    report = await self.round()
+                await self.push(report)
+            except Exception as e:
+                self.logger.error(f"probe round failed err={e}")
+            next_round += self.interval
+            now = loop.time()
+            if next_round < now:
+                next_round = now
+            await asyncio.sleep(next_round - now)
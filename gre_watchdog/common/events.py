@@ -0,0 +1,139 @@
+# gre_watchdog/common/events.py
+from __future__ import annotations
+from bisect import bisect_right
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+class EventLog:
+    """
+    Fixed-capacity ring buffer of events, indexed by tunnel id and kind.
+    Every event gets a monotonically increasing seq; the indexes hold seqs and
+    drop the ones the ring has already overwritten.
+    """
+
+    def __init__(self, capacity: int = 2000):
+        self.capacity = capacity
+        self._buf: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self.next_seq = 0   # == number of events ever appended
+        self._by_tunnel: Dict[int, deque] = {}
+        self._by_kind: Dict[str, deque] = {}
+        self.on_append: Optional[Callable[[int, Dict[str, Any]], None]] = None
+
+    @property
+    def first_seq(self) -> int:
+        return max(0, self.next_seq - self.capacity)
+
+    def __len__(self) -> int:
+        return self.next_seq - self.first_seq
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for seq in range(self.first_seq, self.next_seq):
+            yield self._buf[seq % self.capacity]
+
+    def get(self, seq: int) -> Optional[Dict[str, Any]]:
+        if self.first_seq <= seq < self.next_seq:
+            return self._buf[seq % self.capacity]
+        return None
+
+    def append(self, e: Dict[str, Any]) -> int:
+        seq = self.next_seq
+        self._buf[seq % self.capacity] = e
+        self.next_seq += 1
+        tid = e.get("tunnel_id")
+        if tid is not None:
+            self._index(self._by_tunnel, tid, seq)
+        self._index(self._by_kind, e.get("kind", "-"), seq)
+        if self.next_seq % self.capacity == 0:
+            self._sweep()
+        if self.on_append is not None:
+            self.on_append(seq, e)
+        return seq
+
+    def extend(self, events) -> None:
+        for e in events:
+            self.append(e)
+
+    def _index(self, idx: Dict[Any, deque], key, seq: int):
+        dq = idx.get(key)
+        if dq is None:
+            dq = idx[key] = deque()
+        dq.append(seq)
+        first = self.first_seq
+        while dq[0] < first:
+            dq.popleft()
+
+    def _sweep(self):
+        # keys that went quiet still hold overwritten seqs; trim them once per lap of the ring
+        first = self.first_seq
+        for idx in (self._by_tunnel, self._by_kind):
+            for key in list(idx):
+                dq = idx[key]
+                while dq and dq[0] < first:
+                    dq.popleft()
+                if not dq:
+                    del idx[key]
+
+    def tail(self, n: int) -> List[Dict[str, Any]]:
+        start = max(self.first_seq, self.next_seq - n)
+        return [self._buf[s % self.capacity] for s in range(start, self.next_seq)]
+
+    def since_seq(self, seq: int) -> List[Dict[str, Any]]:
+        start = max(self.first_seq, seq)
+        return [self._buf[s % self.capacity] for s in range(start, self.next_seq)]
+
+    def query(self, tunnel_id: Optional[int] = None, kind: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              before: Optional[int] = None, limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Newest-first page of matching events (each with its "seq").
+        Pass the returned cursor as `before` to get the next page; None = no more.
+        """
+        first = self.first_seq
+        hi = self.next_seq if before is None else min(before, self.next_seq)
+
+        if tunnel_id is not None or kind is not None:
+            a = self._by_tunnel.get(tunnel_id, ()) if tunnel_id is not None else None
+            b = self._by_kind.get(kind, ()) if kind is not None else None
+            # walk the smaller index and filter on the other attribute
+            if a is not None and (b is None or len(a) <= len(b)):
+                seqs = reversed(a)
+            else:
+                seqs = reversed(b)
+        else:
+            if until is not None:
+                hi = min(hi, self._bisect_ts(until))
+            seqs = range(hi - 1, first - 1, -1)
+
+        out: List[Dict[str, Any]] = []
+        for seq in seqs:
+            if seq >= hi:
+                continue
+            if seq < first:
+                break
+            e = self._buf[seq % self.capacity]
+            ts = e.get("ts", 0)
+            if since is not None and ts < since:
+                break  # events are appended in time order
+            if until is not None and ts > until:
+                continue
+            if tunnel_id is not None and e.get("tunnel_id") != tunnel_id:
+                continue
+            if kind is not None and e.get("kind", "-") != kind:
+                continue
+            if len(out) == limit:
+                return out, out[-1]["seq"]
+            out.append(dict(e, seq=seq))
+        return out, None
+
+    def _bisect_ts(self, ts: float) -> int:
+        # first seq whose event is newer than ts
+        first = self.first_seq
+
+        class _View:
+            def __len__(_):
+                return self.next_seq - first
+
+            def __getitem__(_, i):
+                return self._buf[(first + i) % self.capacity].get("ts", 0)
+
+        return first + bisect_right(_View(), ts)
@@ -0,0 +1,220 @@
+import asyncio, re, ipaddress, time
+from gre_watchdog.common import netlink as nl
+
+IFACE_LINE = re.compile(r"^\d+:\s+([^\s:]+)@")
+PEER_LINE  = re.compile(r"link/gre\s+(\S+)\s+peer\s+(\S+)")
+INET_LINE  = re.compile(r"\s+inet\s+(\d+\.\d+\.\d+\.\d+)/(\d+)")
+
+async def sh(cmd: list[str]) -> str:
+    p = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    out = (await p.stdout.read()).decode(errors="ignore")
+    return out
+
+def other_host_in_30(cidr_ip: str, mask: int) -> str:
+    net = ipaddress.ip_network(f"{cidr_ip}/{mask}", strict=False)
+    hosts = list(net.hosts())
+    if len(hosts) == 2:
+        return str(hosts[1]) if str(hosts[0]) == cidr_ip else str(hosts[0])
+    # fallback
+    for h in hosts:
+        if str(h) != cidr_ip:
+            return str(h)
+    return cidr_ip
+
+async def discover_gre(iface_regex: str) -> list[dict]:
+    out = await sh(["ip", "-d", "addr", "show"])
+    blocks = out.split("\n\n")
+    r = re.compile(iface_regex)
+    tunnels = []
+
+    for b in blocks:
+        m1 = IFACE_LINE.search(b)
+        if not m1:
+            continue
+        iface = m1.group(1)
+        m_id = r.match(iface)
+        if not m_id:
+            continue
+
+        mpeer = PEER_LINE.search(b)
+        minet = INET_LINE.search(b)
+        if not (mpeer and minet):
+            continue
+
+        _, peer_pub = mpeer.group(1), mpeer.group(2)
+        local_priv, mask = minet.group(1), int(minet.group(2))
+        tunnels.append(tunnel_from(iface, int(m_id.group(1)), peer_pub, local_priv, mask))
+    return tunnels
+
+def tunnel_from(iface: str, tid: int, peer_pub: str, local_priv: str, mask: int) -> dict:
+    return {
+        "id": tid,
+        "iface_local": iface,
+        "iface_remote": f"gre-kh-{tid}",
+        "peer_public": peer_pub,
+        "local_private": local_priv,
+        "peer_private": other_host_in_30(local_priv, mask),
+    }
+
+class TunnelIndex:
+    """
+    In-memory GRE tunnel index keyed by tunnel id. Fed by one rtnetlink dump at
+    start, then kept current by link/address notifications, so rounds and
+    manual actions never re-read every interface. Falls back to polling
+    `ip -d addr show` every `poll_sec` when netlink is unavailable.
+    `annotate(tunnel)` may add to / adjust each tunnel dict as it is built
+    (the agent pool sets its agent and remote iface name).
+    """
+
+    def __init__(self, iface_regex: str, logger, poll_sec: int = 30, annotate=None):
+        self.regex = re.compile(iface_regex)
+        self.annotate = annotate
+        self.logger = logger
+        self.poll_sec = poll_sec
+        self.links: dict[int, dict] = {}               # ifindex -> link (gre only)
+        self.addrs: dict[int, dict[str, int]] = {}     # ifindex -> {ipv4: prefixlen}
+        self.by_id: dict[int, dict] = {}
+        self.id_of: dict[int, int] = {}                # ifindex -> tunnel id
+        self.version = 0
+        self.netlink = False
+        self._mon = None
+        self._sorted: list[dict] = []
+        self._sorted_version = -1
+        self._polled_at = 0.0
+        self._resync_task = None
+
+    async def start(self):
+        try:
+            # subscribe before dumping so no change falls between the two
+            self._mon = nl.open_route_socket(nl.RTMGRP_LINK | nl.RTMGRP_IPV4_IFADDR, nonblocking=True)
+            await self._resync()
+            asyncio.get_running_loop().add_reader(self._mon.fileno(), self._on_notify)
+            self.netlink = True
+        except OSError as e:
+            self.logger.warning(f"netlink unavailable, polling ip -d addr show: {e}")
+            if self._mon:
+                self._mon.close()
+                self._mon = None
+            await self.refresh(force=True)
+
+    def close(self):
+        if self._mon:
+            try:
+                asyncio.get_running_loop().remove_reader(self._mon.fileno())
+            except Exception:
+                pass
+            self._mon.close()
+            self._mon = None
+
+    async def refresh(self, force: bool = False):
+        """
+        No-op while netlink notifications are live; otherwise re-parse `ip`
+        output at most every poll_sec.
+        """
+        if self.netlink and not force:
+            return
+        now = time.monotonic()
+        if not force and now - self._polled_at < self.poll_sec:
+            return
+        self._polled_at = now
+        tunnels = await discover_gre(self.regex.pattern)
+        if self.annotate:
+            for t in tunnels:
+                self.annotate(t)
+        by_id = {t["id"]: t for t in tunnels}
+        if by_id != self.by_id:
+            self.by_id = by_id
+            self.version += 1
+
+    def tunnels(self) -> list[dict]:
+        if self._sorted_version != self.version:
+            self._sorted = [self.by_id[k] for k in sorted(self.by_id)]
+            self._sorted_version = self.version
+        return self._sorted
+
+    def get(self, tid: int) -> dict | None:
+        return self.by_id.get(tid)
+
+    async def _resync(self):
+        def dump():
+            s = nl.open_route_socket()
+            try:
+                return nl.dump_links(s), nl.dump_addrs(s)
+            finally:
+                s.close()
+
+        links, addrs = await asyncio.to_thread(dump)
+        self.links, self.addrs, self.by_id, self.id_of = {}, {}, {}, {}
+        for a in addrs:
+            self.addrs.setdefault(a["index"], {})[a["local"]] = a["prefixlen"]
+        for l in links:
+            self._apply_link(l)
+        self.version += 1
+
+    def _apply_link(self, link: dict) -> bool:
+        idx = link["index"]
+        if link["type"] != nl.ARPHRD_IPGRE or not self.regex.match(link["name"]):
+            if idx in self.links:
+                self.links.pop(idx)
+                return self._rebuild(idx)
+            return False
+        self.links[idx] = link
+        return self._rebuild(idx)
+
+    def _rebuild(self, idx: int) -> bool:
+        old_id = self.id_of.pop(idx, None)
+        old = self.by_id.pop(old_id, None) if old_id is not None else None
+        link = self.links.get(idx)
+        addrs = self.addrs.get(idx)
+        new = None
+        if link and addrs:
+            m = self.regex.match(link["name"])
+            local_priv, mask = next(iter(addrs.items()))
+            new = tunnel_from(link["name"], int(m.group(1)), link["gre_remote"], local_priv, mask)
+            if self.annotate:
+                self.annotate(new)
+            self.by_id[new["id"]] = new
+            self.id_of[idx] = new["id"]
+        return new != old
+
+    def _on_notify(self):
+        changed = False
+        while True:
+            try:
+                buf = self._mon.recv(1 << 20)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                # ENOBUFS: kernel dropped notifications, only a full dump is safe
+                self.logger.warning(f"netlink overrun, resyncing: {e}")
+                self._schedule_resync()
+                return
+            for typ, _flags, body in nl.iter_messages(buf):
+                changed |= self._apply(typ, body)
+        if changed:
+            self.version += 1
+
+    def _apply(self, typ: int, body: bytes) -> bool:
+        if typ == nl.RTM_NEWLINK:
+            return self._apply_link(nl.parse_link(body))
+        if typ == nl.RTM_DELLINK:
+            idx = nl.parse_link(body)["index"]
+            self.links.pop(idx, None)
+            self.addrs.pop(idx, None)
+            return self._rebuild(idx)
+        if typ in (nl.RTM_NEWADDR, nl.RTM_DELADDR):
+            a = nl.parse_addr(body)
+            if not a:
+                return False
+            cur = self.addrs.setdefault(a["index"], {})
+            if typ == nl.RTM_NEWADDR:
+                cur[a["local"]] = a["prefixlen"]
+            else:
+                cur.pop(a["local"], None)
+            return a["index"] in self.links and self._rebuild(a["index"])
+        return False
+
+    def _schedule_resync(self):
+        if self._resync_task and not self._resync_task.done():
+            return
+        self._resync_task = asyncio.get_running_loop().create_task(self._resync())
@@ -0,0 +1,162 @@
+# gre_watchdog/common/icmp.py
+from __future__ import annotations
+import asyncio, os, socket, struct, time
+from typing import Callable, Dict, Optional, Tuple
+
+from gre_watchdog.common.models import ProbeStats
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+RCVBUF_BYTES = 4 * 1024 * 1024
+
+def icmp_checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    s = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    s = (s >> 16) + (s & 0xFFFF)
+    s += s >> 16
+    return ~s & 0xFFFF
+
+def build_echo(ident: int, seq: int, payload: bytes) -> bytes:
+    hdr = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = icmp_checksum(hdr + payload)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, csum, ident, seq) + payload
+
+class IcmpProber:
+    """
+    Async ICMP echo engine: one shared socket on the event loop for all peers.
+    Replies are matched by (peer ip, seq); ident is checked on raw sockets only
+    (unprivileged ping sockets get their ident rewritten by the kernel).
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.sock: Optional[socket.socket] = None
+        self.raw = False
+        self.ident = os.getpid() & 0xFFFF
+        self._seq = 0
+        self._waiters: Dict[Tuple[str, int], asyncio.Future] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def open(self) -> bool:
+        """
+        Try a raw socket first (root / CAP_NET_RAW), then an unprivileged ping
+        socket (net.ipv4.ping_group_range). Returns False if neither is allowed.
+        """
+        if self.sock:
+            return True
+        for kind, raw in ((socket.SOCK_RAW, True), (socket.SOCK_DGRAM, False)):
+            try:
+                s = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+            except OSError:
+                continue
+            s.setblocking(False)
+            try:
+                # raw sockets also see our own echo requests; a full buffer looks like loss
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_BYTES)
+            except OSError:
+                pass
+            self.sock, self.raw = s, raw
+            self._loop = asyncio.get_running_loop()
+            self._loop.add_reader(s.fileno(), self._on_readable)
+            return True
+        return False
+
+    def close(self):
+        if not self.sock:
+            return
+        try:
+            self._loop.remove_reader(self.sock.fileno())
+        except Exception:
+            pass
+        self.sock.close()
+        self.sock = None
+        for fut in self._waiters.values():
+            if not fut.done():
+                fut.cancel()
+        self._waiters.clear()
+
+    def _next_seq(self) -> int:
+        # 16-bit wrap; with a 2s timeout we never have 65k echos in flight
+        self._seq = (self._seq + 1) & 0xFFFF
+        return self._seq
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if self.raw:
+                ihl = (data[0] & 0x0F) * 4
+                data = data[ihl:]
+            if len(data) < 8:
+                continue
+            typ, _code, _csum, ident, seq = struct.unpack("!BBHHH", data[:8])
+            if typ != ICMP_ECHO_REPLY:
+                continue
+            if self.raw and ident != self.ident:
+                continue
+            fut = self._waiters.pop((addr[0], seq), None)
+            if fut and not fut.done():
+                fut.set_result(time.monotonic())
+
+    async def echo(self, ip: str, timeout_sec: float) -> Optional[float]:
+        """
+        Send one echo request; return RTT in ms or None on timeout.
+        """
+        seq = self._next_seq()
+        key = (ip, seq)
+        fut = self._loop.create_future()
+        self._waiters[key] = fut
+        sent = time.monotonic()
+        try:
+            self.sock.sendto(build_echo(self.ident, seq, struct.pack("!d", sent)), (ip, 0))
+            got = await asyncio.wait_for(fut, timeout_sec)
+            return (got - sent) * 1000.0
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            self._waiters.pop(key, None)
+
+    async def probe(self, ip: str, count: int, timeout_sec: float, interval_sec: float = 0.2,
+                    decide: Optional[Callable[[int, int], Optional[bool]]] = None) -> ProbeStats:
+        """
+        Send `count` echos spaced by `interval_sec`, all in flight concurrently.
+        decide(received, lost) is called as replies/timeouts come in; once it
+        returns a verdict the remaining echos are abandoned and the stats
+        cover only the resolved ones.
+        """
+        loop = asyncio.get_running_loop()
+        pending: set = set()
+        rtts: list = []
+        lost = sent = 0
+        verdict = None
+        next_send = loop.time()
+        while True:
+            if sent < count and loop.time() >= next_send:
+                pending.add(asyncio.ensure_future(self.echo(ip, timeout_sec)))
+                sent += 1
+                next_send += interval_sec
+            if not pending and sent >= count:
+                break
+            wait = max(0.0, next_send - loop.time()) if sent < count else None
+            if not pending:
+                await asyncio.sleep(wait)
+                continue
+            done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                r = t.result()
+                if r is None:
+                    lost += 1
+                else:
+                    rtts.append(r)
+            if decide is not None and done:
+                verdict = decide(len(rtts), lost)
+                if verdict is not None:
+                    break
+        for t in pending:
+            t.cancel()
+        return ProbeStats.from_rtts(ip, len(rtts) + lost, rtts, verdict)
@@ -1,15 +1,116 @@
 # gre_watchdog/common/log.py
-import os, logging
-from logging.handlers import RotatingFileHandler
+"""
+Logging off the event loop. The logger only gets a QueueHandler that puts
+records on a bounded queue (a full queue drops and counts instead of
+blocking); a QueueListener thread does the file and console I/O. Repeated
+messages are rate limited per (tunnel, level, message shape) before they are
+queued. Structured fields passed with extra={...} (tunnel_id, command_id,
+phase, latency_ms, ...) become JSON keys with log_json.
+"""
+import atexit, json, os, logging, queue, re, threading, time
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from gre_watchdog.common.metrics import Counter, GaugeFunc
 
-def setup_logger(name: str, log_dir: str):
+LOG_DROPPED = Counter("gw_log_dropped", "Log records dropped because the log queue was full", ["level"])
+LOG_SUPPRESSED = Counter("gw_log_suppressed", "Repeated log records suppressed by the rate limit", ["level"])
+LOG_QUEUE = GaugeFunc("gw_log_queue_depth", "Log records waiting for the writer thread")
+
+# extra={...} keys that are copied into JSON lines
+FIELDS = ("tunnel_id", "command_id", "phase", "latency_ms", "iface", "op", "path", "attempt", "wave", "agent", "peer")
+
+# ids first (uuids, long hex), then any number left
+_SHAPE = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\b[0-9a-fA-F]{16,}\b|\d+")
+_listeners: list = []
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        d = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k in FIELDS:
+            v = record.__dict__.get(k)
+            if v is not None:
+                d[k] = v
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            d["exc"] = record.exc_text
+        return json.dumps(d, ensure_ascii=False, separators=(",", ":"), default=str)
+
+class RateLimitFilter(logging.Filter):
+    """
+    At most `burst` records per key per `window_sec`; the key is the
+    tunnel id (or iface, without one), the level and the message with its
+    numbers and ids blanked (so "attempt=2/6" and "attempt=3/6" count as the
+    same message, and "cmd <uuid> ok" lines share one key). The first
+    record after a quiet window reports how many were suppressed. With
+    max_keys reached, expired keys are dropped; if none are, records with
+    new keys pass unlimited rather than resetting the live ones.
+    """
+
+    def __init__(self, burst: int = 20, window_sec: float = 60.0, max_keys: int = 10_000):
+        super().__init__()
+        self.burst = burst
+        self.window = window_sec
+        self.max_keys = max_keys
+        self.seen: dict[tuple, list] = {}   # key -> [window start, count, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0:
+            return True
+        extra = record.__dict__
+        who = extra.get("tunnel_id", extra.get("iface"))
+        key = (who, record.levelno, _SHAPE.sub("#", str(record.msg)))
+        now = time.monotonic()
+        with self.lock:
+            e = self.seen.get(key)
+            if e is None or now - e[0] >= self.window:
+                if e is None and len(self.seen) >= self.max_keys:
+                    self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.window}
+                    if len(self.seen) >= self.max_keys:
+                        return True
+                suppressed = e[2] if e else 0
+                self.seen[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar suppressed)"
+                return True
+            e[1] += 1
+            if e[1] <= self.burst:
+                return True
+            e[2] += 1
+        LOG_SUPPRESSED.labels(record.levelname.lower()).inc()
+        return False
+
+class DropQueueHandler(QueueHandler):
+    # never blocks the caller: a full queue drops the record and counts it
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.labels(record.levelname.lower()).inc()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # keep the structured extras; only the message is rendered here
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logger(name: str, log_dir: str, json_format: bool = False, queue_size: int = 10_000,
+                 rate_burst: int = 20, rate_window_sec: float = 60.0):
     os.makedirs(log_dir, exist_ok=True)
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
     if logger.handlers:
         return logger
 
-    fmt = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    fmt = JsonFormatter() if json_format else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
 
     fh = RotatingFileHandler(os.path.join(log_dir, f"{name}.log"), maxBytes=5_000_000, backupCount=5)
     fh.setFormatter(fmt)
@@ -17,6 +118,20 @@ def setup_logger(name: str, log_dir: str):
     sh = logging.StreamHandler()
     sh.setFormatter(fmt)
 
-    logger.addHandler(fh)
-    logger.addHandler(sh)
+    q: queue.Queue = queue.Queue(maxsize=queue_size)
+    qh = DropQueueHandler(q)
+    qh.addFilter(RateLimitFilter(rate_burst, rate_window_sec))
+    listener = QueueListener(q, fh, sh, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    LOG_QUEUE.set_function(lambda: (((), q.qsize()),))
+
+    logger.addHandler(qh)
+    logger.propagate = False
     return logger
+
+@atexit.register
+def _flush():
+    # drain what is still queued before the process exits
+    while _listeners:
+        _listeners.pop().stop()
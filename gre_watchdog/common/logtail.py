@@ -0,0 +1,212 @@
+# gre_watchdog/common/logtail.py
+"""
+Tail and follow for the RotatingFileHandler logs. tail_lines() reads
+backwards from the end in fixed blocks (continuing into <path>.1, .2, ...
+when the current file is short), so its cost depends on the lines asked
+for, not on the file size. follow()/afollow() wait on inotify for appends
+and handle rotation; without inotify they poll.
+"""
+from __future__ import annotations
+import asyncio, ctypes, errno, os, select, struct, time
+from typing import AsyncIterator, Callable, Iterator, List
+
+BLOCK = 8192
+
+def _tail_bytes(path: str, n: int, end: int | None = None) -> List[bytes]:
+    # last n lines of one file (of its first `end` bytes), oldest first
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END) if end is None else end
+        buf = b""
+        while pos > 0 and buf.count(b"\n") <= n:
+            step = min(BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+    lines = buf.splitlines(keepends=True)
+    if pos > 0 and lines:
+        lines = lines[1:]  # first one is cut in the middle
+    return lines[-n:] if n > 0 else []
+
+def tail_lines(path: str, n: int = 400, backups: int = 5, end: int | None = None) -> List[str]:
+    """
+    Last n lines across path, path.1 .. path.<backups> (newest last).
+    `end` limits how much of the current file is read.
+    """
+    out: List[bytes] = []
+    for i in range(backups + 1):
+        p = path if i == 0 else f"{path}.{i}"
+        try:
+            lines = _tail_bytes(p, n - len(out), end if i == 0 else None)
+        except FileNotFoundError:
+            if i == 0:
+                continue
+            break
+        out = lines + out
+        if len(out) >= n:
+            break
+    return [l.decode("utf-8", errors="ignore") for l in out]
+
+# --- inotify (ctypes; Linux only) ---
+
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HDR = struct.Struct("iIII")
+
+class Inotify:
+    """
+    Watch one directory; drain() returns the file names that had events.
+    """
+
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    @classmethod
+    def open(cls, directory: str) -> "Inotify | None":
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = IN_MODIFY | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return None
+        return cls(fd)
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def drain(self) -> set[str]:
+        names = set()
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return names
+                raise
+            off = 0
+            while off + EVENT_HDR.size <= len(buf):
+                _wd, _mask, _cookie, ln = EVENT_HDR.unpack_from(buf, off)
+                off += EVENT_HDR.size
+                names.add(buf[off:off + ln].rstrip(b"\0").decode(errors="ignore"))
+                off += ln
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class LogFollower:
+    """
+    Reads what was appended to `path` since the last call. After a rotation
+    the rest of the old file is read first, then the new file from its start.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.f = None
+        self.ino = None
+        self.pos = 0
+        self._open(at_end=True)
+
+    def _open(self, at_end: bool):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            self.f = None
+            return
+        st = os.fstat(f.fileno())
+        self.f, self.ino = f, st.st_ino
+        self.pos = st.st_size if at_end else 0
+
+    def _drain(self) -> bytes:
+        self.f.seek(self.pos)
+        data = self.f.read()
+        self.pos += len(data)
+        return data
+
+    def read_new(self) -> str:
+        out = b""
+        if self.f is not None:
+            out += self._drain()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return out.decode("utf-8", errors="ignore")
+        if self.f is None or st.st_ino != self.ino:
+            self.close()
+            self._open(at_end=False)
+            if self.f is not None:
+                out += self._drain()
+        elif st.st_size < self.pos:
+            self.pos = 0  # truncated in place
+            out += self._drain()
+        return out.decode("utf-8", errors="ignore")
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+def follow(path: str, lines: int = 0, poll_sec: float = 5.0) -> Iterator[str]:
+    """
+    Blocking `tail -f`: the last `lines` lines, then appended text as it comes.
+    """
+    fl = LogFollower(path)
+    ino = Inotify.open(os.path.dirname(path) or ".")
+    name = os.path.basename(path)
+    try:
+        if lines:
+            yield "".join(tail_lines(path, lines, end=fl.pos if fl.f else None))
+        while True:
+            if ino is None:
+                time.sleep(1.0)
+            else:
+                r, _, _ = select.select([ino], [], [], poll_sec)
+                if r and name not in ino.drain():
+                    continue
+            data = fl.read_new()
+            if data:
+                yield data
+    finally:
+        fl.close()
+        if ino:
+            ino.close()
+
+async def afollow(path: str, lines: int = 0, alive: Callable[[], bool] = lambda: True,
+                  poll_sec: float = 5.0) -> AsyncIterator[str]:
+    """
+    follow() for the event loop; stops once alive() is false.
+    """
+    loop = asyncio.get_running_loop()
+    fl = LogFollower(path)
+    ino = Inotify.open(os.path.dirname(path) or ".")
+    name = os.path.basename(path)
+    wake = asyncio.Event()
+    if ino:
+        loop.add_reader(ino.fileno(), lambda: name in ino.drain() and wake.set())
+    try:
+        if lines:
+            yield "".join(tail_lines(path, lines, end=fl.pos if fl.f else None))
+        while alive():
+            try:
+                await asyncio.wait_for(wake.wait(), poll_sec if ino else 1.0)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+            data = fl.read_new()
+            if data:
+                yield data
+    finally:
+        fl.close()
+        if ino:
+            loop.remove_reader(ino.fileno())
+            ino.close()
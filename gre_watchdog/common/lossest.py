@@ -0,0 +1,100 @@
+# gre_watchdog/common/lossest.py
+"""
+Sequential loss estimator. Per-echo loss is modelled as Bernoulli(p) with a
+Beta(a, b) belief per peer. Each reply/timeout updates the belief and the
+probe stops as soon as P(p < threshold) or P(p >= threshold) reaches the
+configured confidence. The posterior is carried to the next round, decayed
+toward the flat prior so old rounds fade out (an EWMA over echo counts).
+"""
+from __future__ import annotations
+import math
+from typing import Dict, Optional, Tuple
+
+def _betacf(a: float, b: float, x: float) -> float:
+    # continued fraction for the incomplete beta function (modified Lentz)
+    tiny = 1e-30
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c, d = 1.0, 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 201):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-12:
+            break
+    return h
+
+def beta_cdf(x: float, a: float, b: float) -> float:
+    """
+    Regularized incomplete beta I_x(a, b) = P(X <= x) for X ~ Beta(a, b).
+    """
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    ln = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x)
+    front = math.exp(ln)
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+class LossSession:
+    """
+    One probe burst against one peer. update() after every reply or timeout;
+    it returns True (ok), False (bad) or None (keep probing).
+    """
+
+    def __init__(self, est: "LossEstimator", key: str, a: float, b: float):
+        self.est = est
+        self.key = key
+        self.a0, self.b0 = a, b
+        self.received = 0
+        self.lost = 0
+        self.verdict: Optional[bool] = None
+
+    def p_ok(self) -> float:
+        return beta_cdf(self.est.threshold, self.a0 + self.lost, self.b0 + self.received)
+
+    def update(self, received: int, lost: int) -> Optional[bool]:
+        self.received, self.lost = received, lost
+        if received + lost < self.est.min_samples:
+            return None
+        p = self.p_ok()
+        if p >= self.est.confidence:
+            self.verdict = True
+        elif 1.0 - p >= self.est.confidence:
+            self.verdict = False
+        return self.verdict
+
+    def finish(self):
+        self.est.state[self.key] = (self.a0 + self.lost, self.b0 + self.received)
+
+class LossEstimator:
+    def __init__(self, loss_ok_percent: float, confidence: float = 0.95, min_samples: int = 3,
+                 decay: float = 0.8, prior: Tuple[float, float] = (1.0, 1.0)):
+        self.threshold = loss_ok_percent / 100.0
+        self.confidence = confidence
+        self.min_samples = min_samples
+        self.decay = decay
+        self.prior = prior
+        self.state: Dict[str, Tuple[float, float]] = {}
+
+    def session(self, key: str) -> LossSession:
+        pa, pb = self.prior
+        a, b = self.state.get(key, self.prior)
+        return LossSession(self, key, pa + self.decay * (a - pa), pb + self.decay * (b - pb))
+
+    def forget(self, key: str):
+        self.state.pop(key, None)
@@ -0,0 +1,182 @@
+# gre_watchdog/common/metrics.py
+"""
+Tiny Prometheus text-format exporter (no client library needed).
+Metrics are module-level objects registered in REGISTRY; hot-path cost is a
+dict lookup plus an add (histograms: one bisect).
+"""
+from __future__ import annotations
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if v != v:
+        return "NaN"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Registry:
+    def __init__(self):
+        self.metrics: List["_Metric"] = []
+
+    def register(self, m: "_Metric"):
+        self.metrics.append(m)
+        return m
+
+    def render(self) -> str:
+        out: List[str] = []
+        for m in self.metrics:
+            out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} {m.kind}")
+            out.extend(m.samples())
+        return "\n".join(out) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), registry: Registry | None = REGISTRY):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple, object] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        c = self._children.get(key)
+        if c is None:
+            c = self._children[key] = self._new_child()
+        return c
+
+    def _default(self):
+        return self.labels()
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, v: float):
+        self.value = v
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def value(self, *values) -> float:
+        c = self._children.get(tuple(str(v) for v in values))
+        return c.value if c else 0.0
+
+    def samples(self):
+        for k, c in self._children.items():
+            yield f"{self.name}_total{_labels(self.label_names, k)} {_num(c.value)}"
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, v: float):
+        self._default().set(v)
+
+    def samples(self):
+        for k, c in self._children.items():
+            yield f"{self.name}{_labels(self.label_names, k)} {_num(c.value)}"
+
+class GaugeFunc(_Metric):
+    """
+    Gauge computed at scrape time: fn() yields (label values tuple, value).
+    Costs nothing between scrapes.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), registry: Registry | None = REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.fn: Callable[[], Iterable[Tuple[Tuple, float]]] | None = None
+
+    def set_function(self, fn: Callable[[], Iterable[Tuple[Tuple, float]]]):
+        self.fn = fn
+
+    def samples(self):
+        if self.fn is None:
+            return
+        for k, v in self.fn():
+            yield f"{self.name}{_labels(self.label_names, k)} {_num(v)}"
+
+class _HistChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - t0)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+                 registry: Registry | None = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels, registry)
+
+    def _new_child(self):
+        return _HistChild(self.buckets)
+
+    def observe(self, v: float):
+        self._default().observe(v)
+
+    def time(self):
+        return self._default().time()
+
+    def child(self, *values) -> _HistChild | None:
+        return self._children.get(tuple(str(v) for v in values))
+
+    def samples(self):
+        for k, c in self._children.items():
+            acc = 0
+            for b, n in zip(self.buckets, c.counts):
+                acc += n
+                le = 'le="%s"' % _num(float(b))
+                yield f"{self.name}_bucket{_labels(self.label_names, k, le)} {acc}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.label_names, k, le)} {c.count}"
+            yield f"{self.name}_sum{_labels(self.label_names, k)} {_num(c.sum)}"
+            yield f"{self.name}_count{_labels(self.label_names, k)} {c.count}"
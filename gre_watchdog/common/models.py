@@ -60,3 +60,31 @@ class PingResult:
     ip: str
     loss_percent: float
     ok: bool
+
+@dataclass(frozen=True)
+class ProbeStats:
+    """
+    Result of one probe burst against one peer.
+    """
+    ip: str
+    sent: int
+    received: int
+    loss_percent: float
+    rtt_min_ms: Optional[float] = None
+    rtt_avg_ms: Optional[float] = None
+    rtt_max_ms: Optional[float] = None
+    # verdict of the sequential loss estimator (None = not used / undecided)
+    ok: Optional[bool] = None
+
+    @staticmethod
+    def from_rtts(ip: str, sent: int, rtts: list, ok: Optional[bool] = None) -> "ProbeStats":
+        if sent <= 0:
+            return ProbeStats(ip=ip, sent=0, received=0, loss_percent=100.0, ok=ok)
+        recv = len(rtts)
+        loss = 100.0 * (sent - recv) / sent
+        if not rtts:
+            return ProbeStats(ip=ip, sent=sent, received=0, loss_percent=loss, ok=ok)
+        return ProbeStats(
+            ip=ip, sent=sent, received=recv, loss_percent=loss,
+            rtt_min_ms=min(rtts), rtt_avg_ms=sum(rtts) / recv, rtt_max_ms=max(rtts), ok=ok,
+        )
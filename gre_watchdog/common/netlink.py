@@ -0,0 +1,155 @@
+# gre_watchdog/common/netlink.py
+"""
+Minimal rtnetlink (NETLINK_ROUTE) codec: link/address dumps and change
+notifications without forking `ip`. Linux only.
+"""
+from __future__ import annotations
+import os, socket, struct
+from typing import Iterator, Tuple
+
+NLMSG_HDR = struct.Struct("=IHHII")     # len, type, flags, seq, pid
+IFINFOMSG = struct.Struct("=BxHiII")    # family, type, index, flags, change
+IFADDRMSG = struct.Struct("=BBBBI")     # family, prefixlen, flags, scope, index
+RTATTR = struct.Struct("=HH")           # len, type
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+IFLA_IFNAME = 3
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+IFLA_INFO_DATA = 2
+IFLA_GRE_LOCAL = 6
+IFLA_GRE_REMOTE = 7
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+ARPHRD_IPGRE = 778
+IFF_UP = 0x1
+NLA_TYPE_MASK = 0x3FFF
+
+def _align(n: int) -> int:
+    return (n + 3) & ~3
+
+def parse_attrs(data: bytes, off: int = 0) -> dict[int, bytes]:
+    attrs: dict[int, bytes] = {}
+    while off + RTATTR.size <= len(data):
+        ln, typ = RTATTR.unpack_from(data, off)
+        if ln < RTATTR.size:
+            break
+        attrs[typ & NLA_TYPE_MASK] = data[off + RTATTR.size: off + ln]
+        off += _align(ln)
+    return attrs
+
+def pack_attr(typ: int, value: bytes) -> bytes:
+    ln = RTATTR.size + len(value)
+    return RTATTR.pack(ln, typ) + value + b"\x00" * (_align(ln) - ln)
+
+def _cstr(b: bytes) -> str:
+    return b.split(b"\x00", 1)[0].decode(errors="ignore")
+
+def iter_messages(buf: bytes) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    Yield (type, flags, body) for every message in a netlink datagram.
+    """
+    off = 0
+    while off + NLMSG_HDR.size <= len(buf):
+        ln, typ, flags, _seq, _pid = NLMSG_HDR.unpack_from(buf, off)
+        if ln < NLMSG_HDR.size:
+            break
+        yield typ, flags, buf[off + NLMSG_HDR.size: off + ln]
+        off += _align(ln)
+
+def parse_link(body: bytes) -> dict:
+    _fam, typ, index, flags, _change = IFINFOMSG.unpack_from(body)
+    attrs = parse_attrs(body, IFINFOMSG.size)
+    d = {
+        "index": index,
+        "type": typ,
+        "flags": flags,
+        "name": _cstr(attrs.get(IFLA_IFNAME, b"")),
+        "kind": "",
+        "gre_local": "",
+        "gre_remote": "",
+    }
+    li = attrs.get(IFLA_LINKINFO)
+    if li:
+        info = parse_attrs(li)
+        d["kind"] = _cstr(info.get(IFLA_INFO_KIND, b""))
+        data = parse_attrs(info.get(IFLA_INFO_DATA, b""))
+        if len(data.get(IFLA_GRE_LOCAL, b"")) == 4:
+            d["gre_local"] = socket.inet_ntoa(data[IFLA_GRE_LOCAL])
+        if len(data.get(IFLA_GRE_REMOTE, b"")) == 4:
+            d["gre_remote"] = socket.inet_ntoa(data[IFLA_GRE_REMOTE])
+    return d
+
+def parse_addr(body: bytes) -> dict | None:
+    fam, prefixlen, _flags, _scope, index = IFADDRMSG.unpack_from(body)
+    if fam != socket.AF_INET:
+        return None
+    attrs = parse_attrs(body, IFADDRMSG.size)
+    raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+    if not raw or len(raw) != 4:
+        return None
+    return {"index": index, "local": socket.inet_ntoa(raw), "prefixlen": prefixlen}
+
+def open_route_socket(groups: int = 0, nonblocking: bool = False) -> socket.socket:
+    s = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    s.bind((0, groups))
+    if nonblocking:
+        s.setblocking(False)
+    return s
+
+class NetlinkError(OSError):
+    pass
+
+def request(s: socket.socket, msg_type: int, flags: int, payload: bytes, seq: int = 1) -> list[Tuple[int, bytes]]:
+    """
+    Blocking request/response: returns [(type, body)] until DONE/ACK.
+    """
+    s.send(NLMSG_HDR.pack(NLMSG_HDR.size + len(payload), msg_type, NLM_F_REQUEST | flags, seq, 0) + payload)
+    out = []
+    while True:
+        buf = s.recv(1 << 20)
+        for typ, mflags, body in iter_messages(buf):
+            if typ == NLMSG_DONE:
+                return out
+            if typ == NLMSG_ERROR:
+                err = struct.unpack_from("=i", body)[0]
+                if err:
+                    raise NetlinkError(-err, os.strerror(-err))
+                return out  # ACK
+            out.append((typ, body))
+            if not (mflags & NLM_F_MULTI) and not (flags & NLM_F_ACK):
+                return out
+
+def dump_links(s: socket.socket) -> list[dict]:
+    msgs = request(s, RTM_GETLINK, NLM_F_DUMP, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+    return [parse_link(b) for t, b in msgs if t == RTM_NEWLINK]
+
+def dump_addrs(s: socket.socket) -> list[dict]:
+    msgs = request(s, RTM_GETADDR, NLM_F_DUMP, IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0))
+    return [a for a in (parse_addr(b) for t, b in msgs if t == RTM_NEWADDR) if a]
+
+def link_set_up(s: socket.socket, ifindex: int, up: bool, seq: int = 1):
+    """
+    Equivalent of `ip link set dev X up|down` (RTM_NEWLINK, change mask IFF_UP).
+    """
+    payload = IFINFOMSG.pack(socket.AF_UNSPEC, 0, ifindex, IFF_UP if up else 0, IFF_UP)
+    request(s, RTM_NEWLINK, NLM_F_ACK, payload, seq)
@@ -0,0 +1,109 @@
+import asyncio, re
+from dataclasses import replace
+from gre_watchdog.common.icmp import IcmpProber
+from gre_watchdog.common.lossest import LossEstimator
+from gre_watchdog.common.metrics import Counter
+from gre_watchdog.common.models import ProbeStats
+
+PROBE_VERDICTS = Counter("gw_probe_verdicts", "Loss estimator outcome per probe burst (early = stopped before ping_count)",
+                         ["verdict", "early"])
+
+LOSS_RE = re.compile(r"(\d+(?:\.\d+)?)%\s*packet loss")
+RTT_RE = re.compile(r"=\s*([\d.]+)/([\d.]+)/([\d.]+)/[\d.]+\s*ms")
+
+async def ping_loss_percent(ip: str, count: int, timeout_sec: int) -> float:
+    return (await ping_stats_subprocess(ip, count, timeout_sec)).loss_percent
+
+async def ping_stats_subprocess(ip: str, count: int, timeout_sec: int) -> ProbeStats:
+    proc = await asyncio.create_subprocess_exec(
+        "ping", "-c", str(count), "-W", str(timeout_sec), ip,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    out = (await proc.stdout.read()).decode(errors="ignore")
+    await proc.wait()
+    m = LOSS_RE.search(out)
+    if not m:
+        return ProbeStats(ip=ip, sent=count, received=0, loss_percent=100.0)
+    loss = float(m.group(1))
+    recv = round(count * (100.0 - loss) / 100.0)
+    r = RTT_RE.search(out)
+    if not r:
+        return ProbeStats(ip=ip, sent=count, received=recv, loss_percent=loss)
+    return ProbeStats(
+        ip=ip, sent=count, received=recv, loss_percent=loss,
+        rtt_min_ms=float(r.group(1)), rtt_avg_ms=float(r.group(2)), rtt_max_ms=float(r.group(3)),
+    )
+
+# shared in-process engine (one socket per process: coordinator, shard or agent)
+_prober: IcmpProber | None = None
+_prober_failed = False
+
+def get_prober(mode: str = "auto", logger=None) -> IcmpProber | None:
+    """
+    mode: "auto" (socket, fall back to subprocess), "socket", "subprocess".
+    """
+    global _prober, _prober_failed
+    if mode == "subprocess" or _prober_failed:
+        return None
+    if _prober is None:
+        p = IcmpProber(logger)
+        if not p.open():
+            if mode == "socket":
+                raise RuntimeError("icmp socket not permitted (need CAP_NET_RAW or ping_group_range)")
+            _prober_failed = True
+            if logger:
+                logger.warning("icmp socket not permitted, falling back to ping subprocess")
+            return None
+        _prober = p
+    return _prober
+
+def close_prober():
+    global _prober
+    if _prober:
+        _prober.close()
+        _prober = None
+
+_estimator: LossEstimator | None = None
+
+def get_estimator(cfg: dict) -> LossEstimator | None:
+    """
+    Shared per-peer loss belief (loss_estimator: true), kept across rounds.
+    """
+    global _estimator
+    if not cfg.get("loss_estimator", False):
+        return None
+    if _estimator is None:
+        _estimator = LossEstimator(
+            cfg["loss_ok_percent"],
+            confidence=cfg.get("loss_confidence", 0.95),
+            min_samples=cfg.get("loss_min_samples", 3),
+            decay=cfg.get("loss_prior_decay", 0.8),
+        )
+    return _estimator
+
+def forget(*ips: str):
+    # the link was bounced (reset / manual down-up): loss seen before says nothing now
+    if _estimator is not None:
+        for ip in ips:
+            _estimator.forget(ip)
+
+async def probe(ip: str, cfg: dict, logger=None, count: int | None = None) -> ProbeStats:
+    count = count or cfg["ping_count"]
+    p = get_prober(cfg.get("icmp_engine", "auto"), logger)
+    est = get_estimator(cfg)
+    sess = est.session(ip) if est else None
+    if p is None:
+        st = await ping_stats_subprocess(ip, count, cfg["ping_timeout_sec"])
+        if sess is None:
+            return st
+        # no per-reply stream from ping(8): apply the estimator to the totals
+        ok = sess.update(st.received, st.sent - st.received)
+    else:
+        st = await p.probe(ip, count, cfg["ping_timeout_sec"], cfg.get("icmp_interval_ms", 200) / 1000.0,
+                           decide=sess.update if sess else None)
+        if sess is None:
+            return st
+        ok = st.ok
+    sess.finish()
+    PROBE_VERDICTS.labels({True: "ok", False: "bad", None: "undecided"}[ok], str(st.sent < count).lower()).inc()
+    return replace(st, ok=ok)
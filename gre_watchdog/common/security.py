@@ -1,5 +1,5 @@
 # gre_watchdog/common/security.py
-import hmac, hashlib, time, secrets
+import hmac, hashlib, ipaddress, time, secrets
 from dataclasses import dataclass
 
 def hmac_sign(secret: str, body: bytes, ts: str) -> str:
@@ -16,6 +16,16 @@ def hmac_verify(secret: str, body: bytes, ts: str, sig: str, max_skew_sec: int)
     good = hmac_sign(secret, body, ts)
     return hmac.compare_digest(good, sig)
 
+def cidr_allowed(client_ip: str, cidrs: list[str]) -> bool:
+    try:
+        ip = ipaddress.ip_address(client_ip)
+    except ValueError:
+        return False
+    for c in cidrs:
+        if ip in ipaddress.ip_network(c, strict=False):
+            return True
+    return False
+
 def new_token() -> str:
     return secrets.token_urlsafe(32)
 
@@ -1,7 +1,12 @@
 # gre_watchdog/common/state.py
-import os, json, time
+import asyncio, os, json, time
 from dataclasses import dataclass, asdict, field
-from typing import Dict, List, Any
+from typing import Callable, Dict, List, Any
+from gre_watchdog.common.events import EventLog
+from gre_watchdog.common.metrics import Counter, Histogram
+
+SAVE_SECONDS = Histogram("gw_state_save_duration_seconds", "State flush (journal append, compaction included)")
+STATE_BYTES = Counter("gw_state_bytes_written", "Bytes written by state persistence", ["kind"])
 
 @dataclass
 class TunnelState:
@@ -17,6 +22,8 @@ class TunnelState:
     last_seen: float = 0
     last_public_loss: float = 100.0
     last_gre_loss: float = 100.0
+    last_public_rtt_ms: float | None = None
+    last_gre_rtt_ms: float | None = None
     last_action: str = "-"
     paused_until: float = 0
     resets_window: List[float] = field(default_factory=list)
@@ -24,35 +31,298 @@ class TunnelState:
     last_error: str = ""
     last_reset_started_at: float = 0
     last_reset_finished_at: float = 0
+    # in-flight reset (see coordinator/actions.py); "" = none
+    reset_phase: str = ""
+    reset_deadline: float = 0
+    # GRE loss as seen by the agent (agent/prober.py), outside -> inside
+    remote_gre_loss: float | None = None
+    remote_gre_rtt_ms: float | None = None
+    remote_report_at: float = 0
+
+    def __setattr__(self, name, value):
+        d = self.__dict__
+        if name in d and d[name] == value:
+            return  # same value: nothing to persist, sync or re-render
+        object.__setattr__(self, name, value)
+        owner = d.get("_owner")
+        if owner is not None and owner.on_change is not None:
+            owner.on_change(self, name)
+
+class TunnelMap(dict):
+    """
+    dict of TunnelState that attaches itself to every tunnel stored in it, so
+    any later assignment that changes a field of that tunnel calls
+    on_change(tunnel, field); storing a tunnel calls on_change(tunnel, None).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.on_change: Callable[[TunnelState, str | None], None] | None = None
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def __setitem__(self, key: str, st: TunnelState):
+        super().__setitem__(key, st)
+        object.__setattr__(st, "_owner", self)
+        if self.on_change is not None:
+            self.on_change(st, None)
+
+MAX_EVENTS = 2000
 
 @dataclass
 class AppState:
-    tunnels: Dict[str, TunnelState] = field(default_factory=dict)   # key = str(id)
-    events: List[Dict[str, Any]] = field(default_factory=list)      # rolling events
+    tunnels: Dict[str, TunnelState] = field(default_factory=TunnelMap)   # key = str(id)
+    events: EventLog = field(default_factory=lambda: EventLog(MAX_EVENTS))   # ring buffer
 
-def load_state(path: str) -> AppState:
+    def __post_init__(self):
+        # change notification: version is bumped on every tunnel field change and
+        # every new event; tunnels_version (the /api/v1 list ETag) on tunnel
+        # changes other than last_seen, which moves on every check;
+        # subscribers get ("tunnel", TunnelState) / ("event", seq)
+        if not isinstance(self.tunnels, TunnelMap):
+            self.tunnels = TunnelMap(self.tunnels)
+        self.version = 0
+        self.tunnels_version = 0
+        self._listeners: List[Callable[[str, Any], None]] = []
+        self.tunnels.on_change = self._tunnel_changed
+        self.events.on_append = self._event_added
+
+    def subscribe(self, fn: Callable[[str, Any], None]):
+        self._listeners.append(fn)
+
+    def unsubscribe(self, fn: Callable[[str, Any], None]):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def notify(self, kind: str, obj: Any):
+        # for runtime-only state that is not persisted (e.g. reset progress)
+        for fn in self._listeners:
+            fn(kind, obj)
+
+    def _tunnel_changed(self, st: TunnelState, name: str | None = None):
+        self.version += 1
+        if name != "last_seen":
+            self.tunnels_version += 1
+        for fn in self._listeners:
+            fn("tunnel", st)
+
+    def _event_added(self, seq: int, e: Dict[str, Any]):
+        self.version += 1
+        for fn in self._listeners:
+            fn("event", seq)
+
+def _read_snapshot(path: str) -> tuple[AppState, int]:
+    st = AppState()
     try:
         with open(path, "r") as f:
             raw = json.load(f)
-        st = AppState()
-        for k, v in raw.get("tunnels", {}).items():
-            st.tunnels[k] = TunnelState(**v)
-        st.events = raw.get("events", [])[-2000:]
-        return st
     except:
-        return AppState()
+        return st, 0
+    for k, v in raw.get("tunnels", {}).items():
+        st.tunnels[k] = TunnelState(**v)
+    st.events.extend(raw.get("events", [])[-MAX_EVENTS:])
+    return st, int(raw.get("gen", 0))
+
+def _replay_journal(path: str, st: AppState, gen: int):
+    """
+    Apply journal lines written after snapshot `gen`. A torn last line (crash
+    mid-write) ends the replay; everything before it is intact.
+    """
+    try:
+        f = open(path, "r")
+    except OSError:
+        return
+    with f:
+        head = f.readline()
+        try:
+            if json.loads(head).get("gen") != gen:
+                return  # journal belongs to an older snapshot (crash during compaction)
+        except ValueError:
+            return
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                break
+            if "e" in rec:
+                st.events.append(rec["e"])
+            elif "t" in rec:
+                cur = st.tunnels.get(rec["t"])
+                if cur is None:
+                    st.tunnels[rec["t"]] = TunnelState(**rec["d"])
+                else:
+                    for k, v in rec["d"].items():
+                        setattr(cur, k, v)
 
-def save_state(path: str, state: AppState):
+def load_state(path: str) -> AppState:
+    st, gen = _read_snapshot(path)
+    _replay_journal(path + ".journal", st, gen)
+    return st
+
+def save_state(path: str, state: AppState, gen: int = 0):
     os.makedirs(os.path.dirname(path), exist_ok=True)
     raw = {
+        "gen": gen,
         "tunnels": {k: asdict(v) for k, v in state.tunnels.items()},
-        "events": state.events[-2000:],
+        "events": list(state.events),
     }
     tmp = path + ".tmp"
     with open(tmp, "w") as f:
         json.dump(raw, f)
     os.replace(tmp, path)
 
+class StateStore:
+    """
+    Append-only persistence for AppState. A flush appends one JSON line per
+    changed tunnel (changed fields only) and per new event to <path>.journal;
+    the full snapshot at <path> is only rewritten when the journal outgrows
+    compact_bytes. save() is debounced: a burst of calls costs one write;
+    save(sync=True) writes now, for state that must not lag reality.
+    Only tunnels that reported a change since the last flush are diffed.
+    """
+
+    def __init__(self, path: str, flush_delay_sec: float = 1.0, compact_bytes: int = 4_000_000,
+                 fsync: bool = False):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.flush_delay = flush_delay_sec
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self.state: AppState | None = None
+        self.gen = 0
+        self.bytes_written = 0
+        self._persisted: Dict[str, dict] = {}
+        self._dirty: set[str] = set()
+        self._events_seen = 0
+        self._journal = None
+        self._handle = None
+
+    def load(self) -> AppState:
+        st, self.gen = _read_snapshot(self.path)
+        _replay_journal(self.journal_path, st, self.gen)
+        self.state = st
+        self._persisted = {k: asdict(v) for k, v in st.tunnels.items()}
+        self._events_seen = st.events.next_seq
+        st.subscribe(self._changed)
+        return st
+
+    def _changed(self, kind: str, obj):
+        if kind == "tunnel":
+            self._dirty.add(str(obj.id))
+
+    def save(self, sync: bool = False):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.flush()
+        if sync:
+            return self.flush()
+        if self._handle is None:
+            self._handle = loop.call_later(self.flush_delay, self._flush_later)
+
+    def _flush_later(self):
+        self._handle = None
+        self.flush()
+
+    def _open_journal(self):
+        if self._journal is not None:
+            return
+        gen = None
+        try:
+            with open(self.journal_path, "r") as f:
+                gen = json.loads(f.readline()).get("gen")
+        except (OSError, ValueError):
+            pass
+        if gen != self.gen:
+            self._write_header()
+        else:
+            self._drop_torn_tail()
+        self._journal = open(self.journal_path, "a")
+
+    def _drop_torn_tail(self):
+        # a crash mid-write leaves a partial last line; appending after it would corrupt the next record
+        with open(self.journal_path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                chunk = f.read(step)
+                nl = chunk.rfind(b"\n")
+                if nl != -1:
+                    pos = pos - step + nl + 1
+                    break
+                pos -= step
+            if pos != end:
+                f.truncate(pos)
+
+    def _write_header(self):
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(json.dumps({"gen": self.gen}) + "\n")
+        os.replace(tmp, self.journal_path)
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        with SAVE_SECONDS.time():
+            self._flush()
+
+    def _flush(self):
+        st = self.state
+        lines = []
+        dirty, self._dirty = self._dirty, set()
+        for k in dirty:
+            t = st.tunnels.get(k)
+            if t is None:
+                continue
+            # whole-tunnel diff: in-place list edits (resets_window) ride along with the write that notified
+            cur = asdict(t)
+            old = self._persisted.get(k)
+            diff = cur if old is None else {f: v for f, v in cur.items() if old.get(f) != v}
+            if diff:
+                lines.append(json.dumps({"t": k, "d": diff}))
+                self._persisted[k] = cur
+        for e in st.events.since_seq(self._events_seen):
+            lines.append(json.dumps({"e": e}))
+        self._events_seen = st.events.next_seq
+        if not lines:
+            return
+
+        self._open_journal()
+        data = "\n".join(lines) + "\n"
+        self._journal.write(data)
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self.bytes_written += len(data)
+        STATE_BYTES.labels("journal").inc(len(data))
+        if self._journal.tell() > self.compact_bytes:
+            self.compact()
+
+    def compact(self):
+        """
+        New snapshot under gen+1, then a fresh journal for gen+1. A crash in
+        between leaves a gen-mismatched journal that load() ignores.
+        """
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self.gen += 1
+        save_state(self.path, self.state, self.gen)
+        self._write_header()
+        size = os.path.getsize(self.path)
+        self.bytes_written += size
+        STATE_BYTES.labels("snapshot").inc(size)
+
+    def close(self):
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
 def add_event(state: AppState, kind: str, msg: str, tid: int | None = None, extra: dict | None = None):
     e = {"ts": time.time(), "kind": kind, "msg": msg}
     if tid is not None:
@@ -60,4 +330,3 @@ def add_event(state: AppState, kind: str, msg: str, tid: int | None = None, extr
     if extra:
         e["extra"] = extra
     state.events.append(e)
-    state.events = state.events[-2000:]
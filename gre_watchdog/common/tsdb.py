@@ -0,0 +1,182 @@
+# gre_watchdog/common/tsdb.py
+"""
+Per-tunnel loss/RTT history in fixed-size mmap'd files (<dir>/<tid>.ts).
+Each file holds one ring of fixed-width records per tier: raw samples plus
+1m/1h/1d rollups. Rollups are updated in place while their bucket is open,
+so nothing is lost on restart and disk use per tunnel is constant.
+"""
+from __future__ import annotations
+import math, mmap, os, struct
+from collections import OrderedDict
+from typing import Optional
+
+MAGIC = b"GWTS0001"
+# ts, public_loss, gre_loss, public_rtt_ms, gre_rtt_ms, gre_loss_max, n
+RECORD = struct.Struct("<IfffffI")
+TIER_HDR = struct.Struct("<II")     # next slot, count
+# name, bucket seconds (0 = raw), capacity
+TIERS = (
+    ("raw", 0, 1440),
+    ("1m", 60, 1440),
+    ("1h", 3600, 720),
+    ("1d", 86400, 730),
+)
+NAN = float("nan")
+
+def _layout():
+    offs, off = [], len(MAGIC)
+    for _name, _bucket, cap in TIERS:
+        offs.append(off)
+        off += TIER_HDR.size + cap * RECORD.size
+    return offs, off
+
+TIER_OFFSETS, FILE_SIZE = _layout()
+
+def _nan(x: Optional[float]) -> float:
+    return NAN if x is None else float(x)
+
+def _avg(old: float, n: int, x: float) -> float:
+    if math.isnan(x):
+        return old
+    if math.isnan(old):
+        return x
+    return (old * n + x) / (n + 1)
+
+class SeriesFile:
+    def __init__(self, path: str):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fresh = os.fstat(fd).st_size != FILE_SIZE
+            if fresh:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, FILE_SIZE)
+            self.mm = mmap.mmap(fd, FILE_SIZE)
+        finally:
+            os.close(fd)
+        if fresh or self.mm[:len(MAGIC)] != MAGIC:
+            self.mm[:len(MAGIC)] = MAGIC
+
+    def _slot(self, tier: int, i: int) -> int:
+        return TIER_OFFSETS[tier] + TIER_HDR.size + i * RECORD.size
+
+    def add(self, ts: float, pub_loss: float, gre_loss: float, pub_rtt: float, gre_rtt: float):
+        its = int(ts)
+        for tier, (_name, bucket, cap) in enumerate(TIERS):
+            hoff = TIER_OFFSETS[tier]
+            nxt, count = TIER_HDR.unpack_from(self.mm, hoff)
+            start = its - its % bucket if bucket else its
+            if bucket and count:
+                last = (nxt - 1) % cap
+                r = RECORD.unpack_from(self.mm, self._slot(tier, last))
+                if r[0] == start:
+                    n = r[6]
+                    RECORD.pack_into(self.mm, self._slot(tier, last), start,
+                                     _avg(r[1], n, pub_loss), _avg(r[2], n, gre_loss),
+                                     _avg(r[3], n, pub_rtt), _avg(r[4], n, gre_rtt),
+                                     max(r[5], gre_loss), n + 1)
+                    continue
+            RECORD.pack_into(self.mm, self._slot(tier, nxt), start,
+                             pub_loss, gre_loss, pub_rtt, gre_rtt, gre_loss, 1)
+            TIER_HDR.pack_into(self.mm, hoff, (nxt + 1) % cap, min(count + 1, cap))
+
+    def oldest(self, tier: int) -> Optional[int]:
+        nxt, count = TIER_HDR.unpack_from(self.mm, TIER_OFFSETS[tier])
+        if not count:
+            return None
+        cap = TIERS[tier][2]
+        return RECORD.unpack_from(self.mm, self._slot(tier, (nxt - count) % cap))[0]
+
+    def full(self, tier: int) -> bool:
+        return TIER_HDR.unpack_from(self.mm, TIER_OFFSETS[tier])[1] == TIERS[tier][2]
+
+    def read(self, tier: int, since: float, until: float) -> list[tuple]:
+        nxt, count = TIER_HDR.unpack_from(self.mm, TIER_OFFSETS[tier])
+        _name, bucket, cap = TIERS[tier]
+        if bucket:
+            since -= since % bucket  # include the bucket `since` falls into
+        out = []
+        for k in range(count):
+            r = RECORD.unpack_from(self.mm, self._slot(tier, (nxt - count + k) % cap))
+            if r[0] < since:
+                continue
+            if r[0] > until:
+                break
+            out.append(r)
+        return out
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.close()
+
+class HistoryStore:
+    """
+    Directory of SeriesFile, one per tunnel. At most `max_open` files stay
+    mapped (LRU), which bounds address space; resident memory is only the
+    pages actually touched (about one per tier per tunnel).
+    """
+
+    def __init__(self, directory: str, max_open: int = 4096):
+        self.dir = directory
+        self.max_open = max_open
+        self._open: "OrderedDict[int, SeriesFile]" = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+    def _file(self, tid: int, create: bool = True) -> Optional[SeriesFile]:
+        f = self._open.get(tid)
+        if f is not None:
+            self._open.move_to_end(tid)
+            return f
+        path = os.path.join(self.dir, f"{tid}.ts")
+        if not create and not os.path.exists(path):
+            return None
+        f = self._open[tid] = SeriesFile(path)
+        while len(self._open) > self.max_open:
+            _, old = self._open.popitem(last=False)
+            old.close()
+        return f
+
+    def record(self, tid: int, ts: float, pub_loss: float, gre_loss: float,
+               pub_rtt_ms: Optional[float], gre_rtt_ms: Optional[float]):
+        self._file(tid).add(ts, pub_loss, gre_loss, _nan(pub_rtt_ms), _nan(gre_rtt_ms))
+
+    def query(self, tid: int, since: float, until: float, tier: str = "auto") -> dict:
+        """
+        tier="auto" picks the finest tier whose retention still reaches `since`.
+        """
+        f = self._file(tid, create=False)
+        if f is None:
+            return {"tier": tier, "points": []}
+        names = [t[0] for t in TIERS]
+        if tier == "auto":
+            idx = len(TIERS) - 1
+            for i in range(len(TIERS)):
+                # a tier that never wrapped still holds everything it was given
+                old = f.oldest(i)
+                if old is not None and (old <= since or not f.full(i)):
+                    idx = i
+                    break
+        else:
+            idx = names.index(tier)
+        pts = []
+        for r in f.read(idx, since, until):
+            pts.append({
+                "ts": r[0],
+                "public_loss": r[1],
+                "gre_loss": r[2],
+                "public_rtt_ms": None if math.isnan(r[3]) else r[3],
+                "gre_rtt_ms": None if math.isnan(r[4]) else r[4],
+                "gre_loss_max": r[5],
+                "n": r[6],
+            })
+        return {"tier": names[idx], "points": pts}
+
+    def flush(self):
+        for f in self._open.values():
+            f.flush()
+
+    def close(self):
+        for f in self._open.values():
+            f.close()
+        self._open.clear()
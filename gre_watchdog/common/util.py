@@ -11,14 +11,25 @@ def human_ts(ts: float) -> str:
 def clamp(n: float, lo: float, hi: float) -> float:
     return max(lo, min(hi, n))
 
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_duration(s: str) -> float:
+    """
+    "90s", "30m", "1h", "2d" -> seconds. A bare number is seconds.
+    """
+    s = s.strip().lower()
+    if s and s[-1] in DURATION_UNITS:
+        return float(s[:-1]) * DURATION_UNITS[s[-1]]
+    return float(s)
+
 def tail_file(path: str, lines: int = 400) -> str:
     """
-    Return last N lines of a file. Safe for small/medium logs.
+    Return last N lines of a log, continuing into its rotated backups.
+    Reads from the end, so the file size does not matter.
     """
+    from gre_watchdog.common.logtail import tail_lines
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            data = f.readlines()
-        return "".join(data[-lines:])
+        return "".join(tail_lines(path, lines))
     except Exception as e:
         return f"cannot read log {path}: {e}"
 
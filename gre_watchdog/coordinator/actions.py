@@ -1,95 +1,470 @@
-import asyncio, time
+import asyncio, itertools, re, socket, time
+from contextlib import AsyncExitStack
+from gre_watchdog.common import netlink as nl
 from gre_watchdog.common.state import add_event
+from gre_watchdog.common.metrics import Counter, GaugeFunc, Histogram
+from gre_watchdog.coordinator.timers import Timers
+
+RESET_PHASE_SECONDS = Histogram("gw_reset_phase_duration_seconds", "Coordinated reset phase timings", ["phase"])
+RESETS = Counter("gw_resets", "Coordinated reset outcomes", ["result"])
+RESET_WAVE_SIZE = Histogram("gw_reset_wave_size", "Tunnels per reset wave", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+RESETS_ACTIVE = GaugeFunc("gw_resets_active", "Tunnels in a running reset wave")
+RESETS_QUEUED = GaugeFunc("gw_resets_queued", "Tunnels waiting for a reset slot")
+
+PHASES = ("remote_down", "local_down", "hold", "local_up", "gap", "remote_up")
+RATE_WINDOW_SEC = 1800
+
+def tunnel_of(st) -> dict:
+    return {
+        "id": st.id,
+        "iface_local": st.iface_local,
+        "iface_remote": st.iface_remote,
+        "peer_public": st.peer_public,
+        "local_private": st.local_private,
+        "peer_private": st.peer_private,
+    }
 
 async def ip_link_set(iface: str, up: bool):
     proc = await asyncio.create_subprocess_exec(
         "ip", "link", "set", "dev", iface, "up" if up else "down",
         stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
     )
-    out = (await proc.stdout.read()).decode(errors="ignore").strip()
+    out, _ = await proc.communicate()
+    out = out.decode(errors="ignore").strip()
     if proc.returncode != 0:
         raise RuntimeError(out or "ip link failed")
     return out
 
-def prune_window(times: list[float], window_sec: int = 1800) -> list[float]:
+def _netlink_set_many(ifaces: list[str], up: bool) -> dict[str, str]:
+    errors = {}
+    s = nl.open_route_socket()
+    try:
+        for seq, iface in enumerate(ifaces, 1):
+            try:
+                nl.link_set_up(s, socket.if_nametoindex(iface), up, seq)
+            except OSError as e:
+                errors[iface] = f'Cannot find device "{iface}"' if not isinstance(e, nl.NetlinkError) else e.strerror
+    finally:
+        s.close()
+    return errors
+
+FAILED_LINE_RE = re.compile(r"Command failed -:(\d+)")
+
+async def _ip_batch_set_many(ifaces: list[str], up: bool) -> dict[str, str]:
+    # یک fork برای همه: ip -force -batch - ادامه می‌دهد و خط خراب را گزارش می‌کند
+    word = "up" if up else "down"
+    script = "".join(f"link set dev {i} {word}\n" for i in ifaces).encode()
+    proc = await asyncio.create_subprocess_exec(
+        "ip", "-force", "-batch", "-",
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    out, _ = await proc.communicate(script)
+    errors, msg = {}, []
+    for line in out.decode(errors="ignore").splitlines():
+        m = FAILED_LINE_RE.search(line)
+        if m and 0 < int(m.group(1)) <= len(ifaces):
+            errors[ifaces[int(m.group(1)) - 1]] = " ".join(msg) or "ip link failed"
+            msg = []
+        elif line.strip():
+            msg.append(line.strip())
+    if proc.returncode != 0 and not errors:
+        errors = {i: " ".join(msg) or "ip -batch failed" for i in ifaces}
+    return errors
+
+async def ip_link_set_many(ifaces: list[str], up: bool, use_netlink: bool = True) -> dict[str, str]:
+    """
+    Set many local links up/down in one go (one netlink socket, or one
+    `ip -batch`). Returns {iface: error} for the ones that failed.
+    """
+    if not ifaces:
+        return {}
+    if use_netlink and hasattr(socket, "AF_NETLINK"):
+        return await asyncio.to_thread(_netlink_set_many, ifaces, up)
+    return await _ip_batch_set_many(ifaces, up)
+
+def prune_window(times: list[float], window_sec: int = RATE_WINDOW_SEC) -> list[float]:
     cut = time.time() - window_sec
     return [t for t in times if t >= cut]
 
-async def coordinated_reset(tunnel, st, cfg, agent, logger, app_state, lock):
-    tid = tunnel["id"]
+class ResetWave:
+    __slots__ = ("id", "members", "phase", "started_at", "phase_until", "failed", "start", "resume_until")
 
-    async with lock:  # هر تونل فقط یک reset همزمان
-        if time.time() < st.paused_until:
-            add_event(app_state, "info", "reset skipped (paused)", tid)
-            return
+    def __init__(self, wid: int, members: list, start: str = "remote_down", resume_until: float = 0.0):
+        self.id = wid
+        self.members = members          # [(tunnel, st)]
+        self.start = start              # first phase to run (later than remote_down when resumed)
+        self.resume_until = resume_until
+        self.phase = "queued"
+        self.started_at = time.time()
+        self.phase_until = 0.0          # end of hold/gap
+        self.failed: dict[int, str] = {}
 
-        st.status = "RESETTING"
-        st.last_action = "reset_start"
-        st.last_reset_started_at = time.time()
-        add_event(app_state, "action", "reset started", tid)
+    def alive(self) -> list:
+        return [(t, st) for t, st in self.members if t["id"] not in self.failed]
 
-        # Rate limit window
-        st.resets_window = prune_window(st.resets_window)
-        if len(st.resets_window) >= cfg["max_resets_per_30min"]:
-            st.paused_until = time.time() + cfg["pause_after_limit_min"] * 60
-            st.status = "PAUSED"
-            st.last_action = "paused_due_to_rate_limit"
-            add_event(app_state, "warn", "paused due to reset rate limit", tid)
-            return
+    def progress(self) -> dict:
+        return {
+            "id": self.id,
+            "phase": self.phase,
+            "tunnels": [t["id"] for t, _ in self.members],
+            "failed": len(self.failed),
+            "started_at": self.started_at,
+            "phase_until": self.phase_until,
+        }
 
-        # 1) اول remote DOWN (اگر remote down fail شد، ادامه نده)
-        try:
-            await agent.call("/v1/iface/down", {"iface": tunnel["iface_remote"]}, must_ok=True)
-        except Exception as e:
-            st.status = "ERROR"
-            st.last_action = "remote_down_failed"
-            st.last_error = str(e)
-            add_event(app_state, "error", f"remote down failed: {e}", tid)
-            return
+class ResetOrchestrator:
+    """
+    Admission control for coordinated resets. At most reset_max_concurrent
+    tunnels are in the reset sequence at once; the rest wait in a queue.
+    With reset_wave, requests arriving within reset_wave_window_sec are run as
+    one wave: remote downs go out together (the agent client coalesces them
+    into /v1/iface/batch), local links flip in one batch, and the whole wave
+    shares a single hold and gap timer. Without it every tunnel is its own
+    wave of one.
 
-        # 2) سپس local DOWN (اگر local down fail شد، سعی کن remote up کنی)
-        try:
-            await ip_link_set(tunnel["iface_local"], up=False)
-        except Exception as e:
-            st.status = "ERROR"
-            st.last_action = "local_down_failed"
-            st.last_error = str(e)
-            add_event(app_state, "error", f"local down failed: {e}", tid)
-            # rollback remote up
-            try:
-                await agent.call("/v1/iface/up", {"iface": tunnel["iface_remote"]}, must_ok=False)
-            except:
-                pass
+    Each tunnel's current phase and its deadline are kept in TunnelState
+    (reset_phase / reset_deadline) and so persisted with the rest of the
+    state; resume() continues them after a restart.
+
+    Pause expiry, the per-tunnel reset-rate window and the hold/gap waits
+    run on the shared Timers, so a pause ends (and is published) exactly
+    when it runs out and nothing is pruned on the reset path.
+    """
+
+    def __init__(self, cfg: dict, agent, logger, app_state, locks: dict, save_fn=None, timers: Timers | None = None):
+        self.cfg = cfg
+        self.agent = agent
+        self.logger = logger
+        self.app_state = app_state
+        self.locks = locks
+        self.max_concurrent = max(1, int(cfg.get("reset_max_concurrent", 16)))
+        self.wave_mode = bool(cfg.get("reset_wave", True))
+        self.window = float(cfg.get("reset_wave_window_sec", 2)) if self.wave_mode else 0.0
+        self.netlink = bool(cfg.get("local_ops_netlink", True))
+        self.on_restart = cfg.get("reset_on_restart", "resume")
+        self.save_fn = save_fn
+        self.timers = timers if timers is not None else Timers(logger)
+        self.queue: list[tuple[dict, object, asyncio.Future]] = []
+        self.pending: dict[int, asyncio.Future] = {}
+        self.waves: dict[int, ResetWave] = {}
+        self.running = 0
+        self._ids = itertools.count(1)
+        self._timer: asyncio.TimerHandle | None = None
+        RESETS_ACTIVE.set_function(lambda: (((), self.running),))
+        RESETS_QUEUED.set_function(lambda: (((), len(self.queue)),))
+
+    async def reset(self, tunnel: dict, st):
+        """
+        Queue a reset and wait for it; a tunnel already queued or resetting
+        shares that reset instead of starting a second one.
+        """
+        tid = tunnel["id"]
+        fut = self.pending.get(tid)
+        if fut is None:
+            fut = asyncio.get_running_loop().create_future()
+            self.pending[tid] = fut
+            self.queue.append((tunnel, st, fut))
+            self._schedule()
+        await asyncio.shield(fut)
+
+    def progress(self) -> list[dict]:
+        return [w.progress() for w in self.waves.values()]
+
+    def _schedule(self):
+        if self._timer is not None:
             return
+        if self.window > 0:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._pump)
+        else:
+            self._pump()
 
-        # 3) hold 5min
-        await asyncio.sleep(cfg["down_hold_sec"])
+    def _pump(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        loop = asyncio.get_running_loop()
+        while self.queue and self.running < self.max_concurrent:
+            free = self.max_concurrent - self.running
+            size = free if self.wave_mode else 1
+            batch, self.queue = self.queue[:size], self.queue[size:]
+            self.running += len(batch)
+            loop.create_task(self._run_wave(batch))
+        self._publish()
 
-        # 4) local UP
+    async def _run_wave(self, batch, start: str = "remote_down", resume_until: float = 0.0):
+        w = ResetWave(next(self._ids), [(t, st) for t, st, _ in batch], start, resume_until)
+        self.waves[w.id] = w
+        RESET_WAVE_SIZE.observe(len(batch))
         try:
-            await ip_link_set(tunnel["iface_local"], up=True)
+            async with AsyncExitStack() as stack:
+                for t, _ in w.members:
+                    lock = self.locks.setdefault(t["id"], asyncio.Lock())
+                    await stack.enter_async_context(lock)  # هر تونل فقط یک reset همزمان
+                if start == "rollback":
+                    await self._rollback(w)
+                else:
+                    await self._sequence(w)
         except Exception as e:
-            st.status = "ERROR"
-            st.last_action = "local_up_failed"
-            st.last_error = str(e)
-            add_event(app_state, "error", f"local up failed: {e}", tid)
+            self.logger.error(f"reset wave {w.id} crashed err={e}", extra={"wave": w.id, "phase": w.phase})
+            for t, st in w.alive():
+                self._fail(w, t, st, "reset_crashed", str(e))
+        finally:
+            self.waves.pop(w.id, None)
+            self.running -= len(batch)
+            for t, _, fut in batch:
+                self.pending.pop(t["id"], None)
+                if not fut.done():
+                    fut.set_result(None)
+            if self.queue:
+                self._pump()
+            else:
+                self._publish()
+
+    def _publish(self):
+        self.app_state.notify("resets", self.progress())
+
+    def _save(self, sync: bool = False):
+        if self.save_fn is not None:
+            self.save_fn(sync=True) if sync else self.save_fn()
+
+    def _set_phase(self, w: ResetWave, phase: str, until: float = 0.0):
+        w.phase = phase
+        w.phase_until = until
+        for _, st in w.alive():
+            st.status = "RESETTING"
+            st.last_action = f"reset_{phase}"
+            st.reset_phase = phase
+            st.reset_deadline = until
+        # on disk before the link changes: a crash must not leave resume() a stale phase
+        self._save(sync=True)
+        self._publish()
+
+    def _fail(self, w: ResetWave, t: dict, st, action: str, err: str, msg: str = ""):
+        w.failed[t["id"]] = err
+        RESETS.labels(action).inc()
+        st.status = "ERROR"
+        st.last_action = action
+        st.last_error = err
+        st.reset_phase = ""
+        st.reset_deadline = 0
+        add_event(self.app_state, "error", msg or f"{action}: {err}", t["id"])
+
+    async def _remote(self, w: ResetWave, op: str, action: str, label: str):
+        members = w.alive()
+        results = await asyncio.gather(
+            *(self.agent.call(t, f"/v1/iface/{op}", {"iface": t["iface_remote"]}, must_ok=True) for t, _ in members),
+            return_exceptions=True,
+        )
+        for (t, st), r in zip(members, results):
+            if isinstance(r, Exception):
+                self._fail(w, t, st, action, str(r), f"{label} failed: {r}")
+
+    async def _local(self, w: ResetWave, up: bool) -> list:
+        members = w.alive()
+        errors = await ip_link_set_many([t["iface_local"] for t, _ in members], up, self.netlink)
+        failed = []
+        for t, st in members:
+            err = errors.get(t["iface_local"])
+            if err is not None:
+                action = "local_up_failed" if up else "local_down_failed"
+                self._fail(w, t, st, action, err, f"local {'up' if up else 'down'} failed: {err}")
+                failed.append(t)
+        return failed
+
+    async def _sleep(self, w: ResetWave, phase: str, seconds: float):
+        until = time.time() + max(0.0, seconds)
+        self._set_phase(w, phase, until)
+        with RESET_PHASE_SECONDS.labels(phase).time():
+            await self.timers.sleep_until(until)
+
+    def pause(self, st, until: float):
+        st.paused_until = until
+        self.timers.set(("pause", st.id), until, lambda: self._pause_expired(st))
+
+    def unpause(self, st):
+        st.paused_until = 0
+        self.timers.cancel(("pause", st.id))
+
+    def _pause_expired(self, st):
+        if not st.paused_until or st.paused_until > time.time():
             return
+        st.paused_until = 0
+        if st.status in ("PAUSED", "PAUSED_MANUAL"):
+            st.status = "INIT"  # next check sets the real status
+        st.last_action = "pause_expired"
+        add_event(self.app_state, "info", "pause expired", st.id)
+        self._save()
+
+    def _track_window(self, st):
+        # one timer per tunnel, at the moment its oldest reset leaves the window
+        if st.resets_window:
+            self.timers.set(("window", st.id), st.resets_window[0] + RATE_WINDOW_SEC, lambda: self._window_expired(st))
+        else:
+            self.timers.cancel(("window", st.id))
+
+    def _window_expired(self, st):
+        st.resets_window = prune_window(st.resets_window)
+        self._track_window(st)
+        self._save()
+
+    def arm(self, st):
+        """
+        Re-arm the timers of a tunnel loaded from disk. A pause that ran out
+        while the coordinator was down expires right away.
+        """
+        if st.paused_until:
+            self.pause(st, st.paused_until)
+        if st.resets_window:
+            self._track_window(st)
+
+    async def _sequence(self, w: ResetWave):
+        cfg, app_state = self.cfg, self.app_state
+        start = PHASES.index(w.start)
+        if start == 0:
+            self._admit(w)
+
+        # 1) اول remote DOWN (اگر remote down fail شد، آن تونل ادامه نمی‌دهد)
+        if start <= 0:
+            if not w.alive():
+                return
+            self._set_phase(w, "remote_down")
+            with RESET_PHASE_SECONDS.labels("remote_down").time():
+                await self._remote(w, "down", "remote_down_failed", "remote down")
+
+        # 2) سپس local DOWN، یکجا (اگر local down fail شد، سعی کن remote up کنی)
+        if start <= 1:
+            if not w.alive():
+                return
+            self._set_phase(w, "local_down")
+            with RESET_PHASE_SECONDS.labels("local_down").time():
+                failed = await self._local(w, up=False)
+            for t in failed:
+                try:
+                    await self.agent.call(t, "/v1/iface/up", {"iface": t["iface_remote"]}, must_ok=False)
+                except Exception:
+                    pass
+
+        # 3) یک hold مشترک برای کل wave (بعد از restart فقط باقی‌مانده‌اش)
+        if start <= 2:
+            if not w.alive():
+                return
+            await self._sleep(w, "hold", cfg["down_hold_sec"] if start < 2 else w.resume_until - time.time())
+
+        # 4) local UP، یکجا
+        if start <= 3:
+            if not w.alive():
+                return
+            self._set_phase(w, "local_up")
+            with RESET_PHASE_SECONDS.labels("local_up").time():
+                await self._local(w, up=True)
 
         # 5) gap then remote UP (اگر remote up fail شد، status خطا بزن و دیگه چیزی رو ok حساب نکن)
-        await asyncio.sleep(cfg["up_gap_sec"])
-        try:
-            await agent.call("/v1/iface/up", {"iface": tunnel["iface_remote"]}, must_ok=True)
-        except Exception as e:
-            st.status = "ERROR"
-            st.last_action = "remote_up_failed"
-            st.last_error = str(e)
-            add_event(app_state, "error", f"remote up failed: {e}", tid)
+        if start <= 4:
+            if not w.alive():
+                return
+            await self._sleep(w, "gap", cfg["up_gap_sec"] if start < 4 else w.resume_until - time.time())
+        if not w.alive():
             return
+        self._set_phase(w, "remote_up")
+        with RESET_PHASE_SECONDS.labels("remote_up").time():
+            await self._remote(w, "up", "remote_up_failed", "remote up")
+
+        for t, st in w.alive():
+            st.resets_window.append(time.time())
+            if len(st.resets_window) == 1:
+                self._track_window(st)
+            st.bad_rounds = 0
+            st.status = "OK"
+            st.last_action = "reset_done"
+            st.last_error = ""
+            st.last_reset_finished_at = time.time()
+            st.reset_phase = ""
+            st.reset_deadline = 0
+            add_event(app_state, "action", "reset done", t["id"])
+            RESETS.labels("done").inc()
+            RESET_PHASE_SECONDS.labels("total").observe(st.last_reset_finished_at - st.last_reset_started_at)
+        # the probers drop the loss belief they built while the link was held down
+        app_state.notify("link_reset", [t["id"] for t, st in w.alive()])
+        self._save(sync=True)
+
+    def _admit(self, w: ResetWave):
+        cfg, app_state = self.cfg, self.app_state
+        for t, st in w.members:
+            tid = t["id"]
+            if time.time() < st.paused_until:
+                w.failed[tid] = "paused"
+                add_event(app_state, "info", "reset skipped (paused)", tid)
+                RESETS.labels("skipped_paused").inc()
+                continue
+
+            st.status = "RESETTING"
+            st.last_action = "reset_start"
+            st.last_reset_started_at = time.time()
+            add_event(app_state, "action", "reset started", tid, extra={"wave": w.id, "wave_size": len(w.members)})
+
+            # Rate limit window (expired entries are dropped by their timer)
+            if len(st.resets_window) >= cfg["max_resets_per_30min"]:
+                w.failed[tid] = "rate_limited"
+                self.pause(st, time.time() + cfg["pause_after_limit_min"] * 60)
+                st.status = "PAUSED"
+                st.last_action = "paused_due_to_rate_limit"
+                add_event(app_state, "warn", "paused due to reset rate limit", tid)
+                RESETS.labels("rate_limited").inc()
+
+    def resume(self, tunnels: dict[int, dict] | None = None) -> int:
+        """
+        Pick up resets that were in flight when the coordinator stopped: every
+        tunnel with a persisted reset_phase continues from that phase (hold/gap
+        only wait out what is left of their deadline), or with
+        reset_on_restart: rollback is brought back up on both sides.
+        Also re-arms pause and rate-window timers of every tunnel.
+        Returns the number of tunnels picked up.
+        """
+        tunnels = tunnels or {}
+        groups: dict[tuple, list] = {}
+        for st in list(self.app_state.tunnels.values()):
+            self.arm(st)
+            if not st.reset_phase:
+                continue
+            t = tunnels.get(st.id) or tunnel_of(st)
+            if st.reset_phase not in PHASES and st.reset_phase != "rollback":
+                st.reset_phase = ""
+                continue
+            if self.on_restart == "rollback" or st.reset_phase == "rollback":
+                key = ("rollback", 0)
+            elif st.reset_phase in ("hold", "gap"):
+                key = (st.reset_phase, int(st.reset_deadline))
+            else:
+                key = (st.reset_phase, 0)
+            groups.setdefault(key, []).append((t, st))
+
+        loop = asyncio.get_running_loop()
+        n = 0
+        for (phase, deadline), members in groups.items():
+            batch = []
+            for t, st in members:
+                fut = loop.create_future()
+                self.pending[t["id"]] = fut
+                batch.append((t, st, fut))
+                add_event(self.app_state, "warn", f"reset interrupted by restart in phase {st.reset_phase}, "
+                          + ("rolling back" if phase == "rollback" else "resuming"), t["id"])
+            self.running += len(batch)
+            n += len(batch)
+            loop.create_task(self._run_wave(batch, phase, float(deadline)))
+        if n:
+            self.logger.warning(f"picked up {n} interrupted resets ({self.on_restart})")
+        return n
 
-        st.resets_window.append(time.time())
-        st.bad_rounds = 0
-        st.status = "OK"
-        st.last_action = "reset_done"
-        st.last_error = ""
-        st.last_reset_finished_at = time.time()
-        add_event(app_state, "action", "reset done", tid)
+    async def _rollback(self, w: ResetWave):
+        # هر دو طرف را بالا بیاور؛ اگر تونل هنوز خراب است monitor دوباره reset را شروع می‌کند
+        self._set_phase(w, "rollback")
+        await self._local(w, up=True)
+        await self._remote(w, "up", "remote_up_failed", "remote up")
+        for t, st in w.alive():
+            st.status = "INIT"
+            st.last_action = "reset_rolled_back"
+            st.reset_phase = ""
+            st.reset_deadline = 0
+            add_event(self.app_state, "action", "reset rolled back", t["id"])
+            RESETS.labels("rolled_back").inc()
+        self._save(sync=True)
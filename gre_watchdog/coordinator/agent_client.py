@@ -1,24 +1,215 @@
-import json, time, random, uuid
+import asyncio, json, time, random, uuid
 import httpx
 from gre_watchdog.common.security import hmac_sign
+from gre_watchdog.common.metrics import Counter, GaugeFunc, Histogram
+
+RPC_SECONDS = Histogram("gw_agent_rpc_duration_seconds", "Agent RPC latency including retries", ["agent", "path"])
+RPC_ATTEMPTS = Counter("gw_agent_rpc_attempts", "Agent RPC attempts", ["agent", "path", "result"])
+RPC_FAILED = Counter("gw_agent_rpc_failed", "Agent RPCs that failed after all retries", ["agent", "path"])
+RPC_BACKOFF_SECONDS = Counter("gw_agent_rpc_backoff_seconds", "Time spent sleeping between RPC retries", ["agent"])
+RPC_CONN = Counter("gw_agent_rpc_connections", "Requests by connection state (new or reused)", ["agent", "conn"])
+RPC_SHORT_CIRCUITED = Counter("gw_agent_rpc_short_circuited", "RPCs failed fast because the agent is marked down", ["agent"])
+AGENT_UP = GaugeFunc("gw_agent_up", "1 while the agent is healthy, 0 while marked down", ["agent"])
+RPC_BATCH_ITEMS = Histogram("gw_agent_rpc_batch_items", "Items per /v1/iface/batch call", ["agent"],
+                            buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+BATCH_PATH = "/v1/iface/batch"
+BATCHABLE = {"/v1/iface/down": "down", "/v1/iface/up": "up", "/v1/iface/restart": "restart"}
 
 class AgentClient:
+    """
+    Signed RPC to one agent over its own keep-alive pool. Health: after
+    down_after calls in a row failed all their retries the agent is marked
+    down, and calls fail fast for down_cooldown_sec; the first call after that
+    is a probe that either brings it back or marks it down again.
+    """
+
     def __init__(self, base_url: str, secret: str, timeout_sec: int, max_attempts: int,
-                 base_backoff_ms: int, max_backoff_ms: int, logger):
+                 base_backoff_ms: int, max_backoff_ms: int, logger,
+                 http2: bool = False, pool_size: int = 4, keepalive_sec: int = 60,
+                 batch_window_ms: int = 0, batch_max_items: int = 200,
+                 name: str | None = None, down_after: int = 3, down_cooldown_sec: float = 30):
         self.base = base_url.rstrip("/")
+        self.name = name or self.base
+        self.down_after = down_after
+        self.down_cooldown = down_cooldown_sec
+        self.fail_streak = 0
+        self.down_until = 0.0
+        self.last_ok_at = 0.0
+        self.last_error = ""
         self.secret = secret
         self.timeout = timeout_sec
         self.max_attempts = max_attempts
         self.base_backoff = base_backoff_ms
         self.max_backoff = max_backoff_ms
         self.logger = logger
+        self.http2 = http2
+        self.pool_size = pool_size
+        self.keepalive = keepalive_sec
+        self._client: httpx.AsyncClient | None = None
+        self.batch_window = batch_window_ms / 1000.0
+        self.batch_max = batch_max_items
+        self._batch_supported = True
+        self._pending: list[tuple[str, dict, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self.metrics = {
+            "batches": 0,
+            "batched_items": 0,
+            "calls": 0,
+            "calls_failed": 0,
+            "attempts": 0,
+            "conn_new": 0,
+            "conn_reused": 0,
+            "latency_ms_sum": 0.0,
+            "latency_ms_max": 0.0,
+            "last_latency_ms": 0.0,
+        }
 
     def _headers(self, body: bytes) -> dict:
         ts = str(int(time.time()))
         sig = hmac_sign(self.secret, body, ts)
         return {"x-ts": ts, "x-sig": sig}
 
+    def _http(self) -> httpx.AsyncClient:
+        # یک client ماندگار با keep-alive؛ اتصال‌ها بین RPCها دوباره استفاده می‌شوند
+        if self._client is None:
+            http2 = self.http2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    self.logger.warning("rpc_http2 enabled but h2 is not installed, using HTTP/1.1")
+                    http2 = False
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=self.keepalive,
+                ),
+            )
+        return self._client
+
+    async def start(self):
+        """
+        Warm up the pool (TCP/TLS handshake) before the first reset needs it.
+        """
+        try:
+            r = await self._send("GET", "/health")
+            r.raise_for_status()
+        except Exception as e:
+            self.logger.warning(f"agent warm-up failed err={e}")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _send(self, method: str, path: str, body: bytes | None = None) -> httpx.Response:
+        new_conn = False
+
+        async def trace(name: str, info: dict):
+            nonlocal new_conn
+            if name == "connection.connect_tcp.complete":
+                new_conn = True
+
+        headers = self._headers(body) if body is not None else None
+        r = await self._http().request(method, self.base + path, content=body, headers=headers,
+                                       extensions={"trace": trace})
+        self.metrics["conn_new" if new_conn else "conn_reused"] += 1
+        RPC_CONN.labels(self.name, "new" if new_conn else "reused").inc()
+        return r
+
     async def call(self, path: str, payload: dict, must_ok: bool = True) -> dict:
+        op = BATCHABLE.get(path)
+        if op and self.batch_window > 0 and self._batch_supported:
+            data = await self._enqueue(op, payload)
+            if must_ok and not data.get("ok", False):
+                raise RuntimeError(f"agent call failed: {data.get('error', 'agent error')}")
+            return data
+        return await self._call_one(path, payload, must_ok)
+
+    async def _enqueue(self, op: str, payload: dict) -> dict:
+        # callهای همزمان در یک پنجره کوتاه در یک batch جمع می‌شوند
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((op, dict(payload), fut))
+        if len(self._pending) >= self.batch_max:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._start_flush)
+        return await fut
+
+    def _start_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        if pending:
+            asyncio.get_running_loop().create_task(self._flush(pending))
+
+    async def _flush(self, pending: list[tuple[str, dict, asyncio.Future]]):
+        items = []
+        for op, payload, _ in pending:
+            payload.setdefault("command_id", str(uuid.uuid4()))
+            items.append({"op": op, **payload})
+        try:
+            data = await self._call_one(BATCH_PATH, {"items": items}, must_ok=False)
+            results = data.get("results", [])
+            self.metrics["batches"] += 1
+            self.metrics["batched_items"] += len(items)
+            RPC_BATCH_ITEMS.labels(self.name).observe(len(items))
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                return self._fail(pending, e)
+            # agent قدیمی: endpoint batch ندارد، تک‌تک بفرست
+            self.logger.warning("agent has no batch endpoint, falling back to single calls")
+            self._batch_supported = False
+            results = await asyncio.gather(
+                *(self._call_one(f"/v1/iface/{op}", payload, must_ok=False) for op, payload, _ in pending),
+                return_exceptions=True,
+            )
+        except Exception as e:
+            return self._fail(pending, e)
+
+        for i, (_, _, fut) in enumerate(pending):
+            if fut.done():
+                continue
+            r = results[i] if i < len(results) else RuntimeError("agent batch: missing result")
+            if isinstance(r, Exception):
+                fut.set_exception(r)
+            else:
+                fut.set_result(r)
+
+    def _fail(self, pending, err: Exception):
+        for _, _, fut in pending:
+            if not fut.done():
+                fut.set_exception(RuntimeError(f"agent call failed after retries: {err}"))
+
+    def healthy(self) -> bool:
+        return time.time() >= self.down_until
+
+    def _health(self, ok: bool, err: str = ""):
+        if ok:
+            if self.down_until:
+                self.logger.warning(f"agent {self.name} is back", extra={"agent": self.name})
+            self.fail_streak = 0
+            self.down_until = 0.0
+            self.last_ok_at = time.time()
+            return
+        self.fail_streak += 1
+        self.last_error = err
+        if self.down_after > 0 and self.fail_streak >= self.down_after:
+            self.down_until = time.time() + self.down_cooldown
+            self.logger.error(f"agent {self.name} marked down for {self.down_cooldown}s after "
+                              f"{self.fail_streak} failed calls err={err}", extra={"agent": self.name})
+
+    async def _call_one(self, path: str, payload: dict, must_ok: bool = True) -> dict:
+        if not self.healthy():
+            # agent down است؛ retry budget بقیه agentها را مصرف نکن
+            RPC_SHORT_CIRCUITED.labels(self.name).inc()
+            raise RuntimeError(f"agent {self.name} is down: {self.last_error}")
         # command_id برای idempotency
         payload = dict(payload)
         payload.setdefault("command_id", str(uuid.uuid4()))
@@ -26,27 +217,63 @@ class AgentClient:
 
         backoff = self.base_backoff / 1000.0
         last_err = None
+        answered = False  # an ok=false reply is not an unhealthy agent
+        t0 = time.monotonic()
+        self.metrics["calls"] += 1
 
-        for attempt in range(1, self.max_attempts + 1):
-            try:
-                async with httpx.AsyncClient(timeout=self.timeout) as c:
-                    r = await c.post(self.base + path, content=body, headers=self._headers(body))
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                self.metrics["attempts"] += 1
+                try:
+                    r = await self._send("POST", path, body)
                     r.raise_for_status()
+                    answered = True
                     data = r.json()
                     if must_ok and not data.get("ok", False):
                         raise RuntimeError(data.get("error", "agent error"))
+                    RPC_ATTEMPTS.labels(self.name, path, "ok").inc()
+                    self._health(True)
                     return data
-            except Exception as e:
-                last_err = e
-                self.logger.warning(f"agent call fail attempt={attempt}/{self.max_attempts} path={path} err={e}")
-                if attempt == self.max_attempts:
-                    break
-                # exponential backoff + jitter
-                await self._sleep(backoff)
-                backoff = min(backoff * 2, self.max_backoff / 1000.0)
-
-        raise RuntimeError(f"agent call failed after retries: {last_err}")
-
-    async def _sleep(self, seconds: float):
+                except Exception as e:
+                    last_err = e
+                    RPC_ATTEMPTS.labels(self.name, path, type(e).__name__).inc()
+                    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 404:
+                        # endpoint وجود ندارد؛ retry فایده ندارد
+                        self.metrics["calls_failed"] += 1
+                        RPC_FAILED.labels(self.name, path).inc()
+                        raise
+                    self.logger.warning(f"agent call fail attempt={attempt}/{self.max_attempts} path={path} err={e}",
+                                        extra={"agent": self.name, "path": path, "attempt": attempt,
+                                               "command_id": payload["command_id"], "iface": payload.get("iface")})
+                    if attempt == self.max_attempts:
+                        break
+                    # exponential backoff + jitter
+                    RPC_BACKOFF_SECONDS.labels(self.name).inc(await self._sleep(backoff))
+                    backoff = min(backoff * 2, self.max_backoff / 1000.0)
+
+            self.metrics["calls_failed"] += 1
+            RPC_FAILED.labels(self.name, path).inc()
+            self._health(answered, str(last_err))
+            raise RuntimeError(f"agent call failed after retries: {last_err}")
+        finally:
+            ms = (time.monotonic() - t0) * 1000.0
+            self.metrics["latency_ms_sum"] += ms
+            self.metrics["latency_ms_max"] = max(self.metrics["latency_ms_max"], ms)
+            self.metrics["last_latency_ms"] = ms
+            RPC_SECONDS.labels(self.name, path).observe(ms / 1000.0)
+
+    def stats(self) -> dict:
+        m = dict(self.metrics)
+        m["latency_ms_avg"] = m["latency_ms_sum"] / m["calls"] if m["calls"] else 0.0
+        conns = m["conn_new"] + m["conn_reused"]
+        m["conn_reuse_ratio"] = m["conn_reused"] / conns if conns else 0.0
+        m["healthy"] = self.healthy()
+        m["fail_streak"] = self.fail_streak
+        m["last_ok_at"] = self.last_ok_at
+        return m
+
+    async def _sleep(self, seconds: float) -> float:
         # jitter
-        await __import__("asyncio").sleep(seconds * (0.7 + random.random() * 0.6))
+        seconds *= 0.7 + random.random() * 0.6
+        await asyncio.sleep(seconds)
+        return seconds
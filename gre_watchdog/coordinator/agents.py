@@ -0,0 +1,96 @@
+# gre_watchdog/coordinator/agents.py
+"""
+Several agents (outside servers) behind one coordinator. Each agent gets its
+own AgentClient, so its own connection pool, retry budget and health; a
+tunnel is routed to its agent by peer_public (or by the agent's `default`
+flag), and calls for tunnels on different agents run in parallel.
+"""
+from __future__ import annotations
+import asyncio
+from gre_watchdog.coordinator.agent_client import AgentClient, AGENT_UP
+
+DEFAULT_REMOTE_IFACE = "gre-kh-{id}"
+
+def agent_specs(cfg: dict) -> list[dict]:
+    """
+    `agents:` from the config; without it the single agent_base_url, which
+    then serves every tunnel.
+    """
+    specs = cfg.get("agents")
+    if specs:
+        return specs
+    return [{"name": "default", "base_url": cfg["agent_base_url"], "default": True}]
+
+class AgentPool:
+    def __init__(self, cfg: dict, logger):
+        self.logger = logger
+        self.clients: dict[str, AgentClient] = {}
+        self.secrets: dict[str, str] = {}
+        self.by_peer: dict[str, str] = {}
+        self.remote_iface: dict[str, str] = {}
+        self.default: str | None = None
+        specs = agent_specs(cfg)
+        for spec in specs:
+            name = spec["name"]
+            opt = lambda k, d=None: spec.get(k, cfg.get(k, d))
+            self.secrets[name] = spec.get("shared_secret", cfg["shared_secret"])
+            self.clients[name] = AgentClient(
+                base_url=spec["base_url"],
+                secret=self.secrets[name],
+                timeout_sec=opt("rpc_timeout_sec"),
+                max_attempts=opt("rpc_max_attempts"),
+                base_backoff_ms=opt("rpc_base_backoff_ms"),
+                max_backoff_ms=opt("rpc_max_backoff_ms"),
+                logger=logger,
+                http2=opt("rpc_http2", False),
+                pool_size=opt("rpc_pool_size", 4),
+                keepalive_sec=opt("rpc_keepalive_sec", 60),
+                batch_window_ms=opt("rpc_batch_window_ms", 25),
+                batch_max_items=opt("rpc_batch_max_items", 200),
+                name=name,
+                down_after=opt("agent_down_after", 3),
+                down_cooldown_sec=opt("agent_down_cooldown_sec", 30),
+            )
+            self.remote_iface[name] = spec.get("remote_iface", DEFAULT_REMOTE_IFACE)
+            for ip in spec.get("peers", []):
+                self.by_peer[ip] = name
+            if spec.get("default") or len(specs) == 1:
+                self.default = name
+        AGENT_UP.set_function(lambda: (((n,), 1 if c.healthy() else 0) for n, c in self.clients.items()))
+
+    def name_for(self, tunnel: dict) -> str | None:
+        return self.by_peer.get(tunnel["peer_public"], self.default)
+
+    def annotate(self, tunnel: dict):
+        # TunnelIndex hook: which agent owns the tunnel and its iface name there
+        name = self.name_for(tunnel)
+        tunnel["agent"] = name or ""
+        if name:
+            tunnel["iface_remote"] = self.remote_iface[name].format(id=tunnel["id"])
+
+    def for_tunnel(self, tunnel: dict) -> AgentClient:
+        name = self.name_for(tunnel)
+        if name is None:
+            raise RuntimeError(f"no agent for peer {tunnel['peer_public']}")
+        return self.clients[name]
+
+    async def call(self, tunnel: dict, path: str, payload: dict, must_ok: bool = True) -> dict:
+        return await self.for_tunnel(tunnel).call(path, payload, must_ok)
+
+    def secret_for(self, name: str) -> str | None:
+        if name not in self.secrets and len(self.secrets) == 1:
+            return next(iter(self.secrets.values()))
+        return self.secrets.get(name)
+
+    def owns(self, name: str, tunnel: dict) -> bool:
+        # a single agent may report under any name (report_name / role)
+        return len(self.clients) == 1 or self.name_for(tunnel) == name
+
+    async def start(self):
+        await asyncio.gather(*(c.start() for c in self.clients.values()))
+
+    async def close(self):
+        await asyncio.gather(*(c.close() for c in self.clients.values()))
+
+    def stats(self) -> dict:
+        return {name: c.stats() for name, c in self.clients.items()}
@@ -0,0 +1,130 @@
+# gre_watchdog/coordinator/api.py
+"""
+Read-only JSON API (/api/v1). Responses are serialized once per state
+version and cached; every response carries an ETag and If-None-Match is
+answered with 304, so polling an unchanged coordinator costs a compare.
+"""
+from __future__ import annotations
+import hashlib, json, secrets
+from collections import OrderedDict
+from dataclasses import asdict
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import Response
+
+EVENTS_CACHE_MAX = 64
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+def _tag(prefix: str, body: bytes) -> str:
+    return f'"{prefix}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+def etag_matches(header: str, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    for t in header.split(","):
+        t = t.strip()
+        if t.startswith("W/"):
+            t = t[2:]
+        if t == etag:
+            return True
+    return False
+
+class TunnelSnapshot:
+    """
+    All tunnels serialized at one tunnels_version: the list body plus one body
+    per tunnel, each with its own content ETag (a tunnel's ETag only changes
+    when that tunnel does). A check that only moves last_seen does not
+    bump tunnels_version, so last_seen here is as of the last real change.
+    """
+
+    def __init__(self, state, boot: str):
+        self.version = state.tunnels_version
+        items = []
+        self.by_id: dict[int, tuple[bytes, str]] = {}
+        for t in sorted(state.tunnels.values(), key=lambda x: x.id):
+            d = asdict(t)
+            items.append(d)
+            body = _dumps(d)
+            self.by_id[t.id] = (body, _tag(f"{boot}-t{t.id}", body))
+        self.body = _dumps({"tunnels": items})
+        self.etag = f'"{boot}-v{self.version}"'
+
+class ApiCache:
+    def __init__(self, state):
+        self.state = state
+        # ETags must not collide with the ones a previous process handed out
+        self.boot = secrets.token_hex(4)
+        self._tunnels: TunnelSnapshot | None = None
+        self._events: "OrderedDict[tuple, tuple[int, bytes, str]]" = OrderedDict()
+
+    def tunnels(self) -> TunnelSnapshot:
+        snap = self._tunnels
+        if snap is None or snap.version != self.state.tunnels_version:
+            snap = self._tunnels = TunnelSnapshot(self.state, self.boot)
+        return snap
+
+    def events(self, key: tuple) -> tuple[bytes, str]:
+        # the ring is append-only, so a query's answer only changes with next_seq
+        seq = self.state.events.next_seq
+        hit = self._events.get(key)
+        if hit is not None and hit[0] == seq:
+            self._events.move_to_end(key)
+            return hit[1], hit[2]
+        tunnel_id, kind, since, until, before, limit = key
+        items, cursor = self.state.events.query(tunnel_id=tunnel_id, kind=kind, since=since, until=until,
+                                                before=before, limit=limit)
+        body = _dumps({"items": items, "next_before": cursor})
+        # seq is only the cache key: a query whose answer did not change keeps its tag
+        etag = _tag(f"{self.boot}-e", body)
+        self._events[key] = (seq, body, etag)
+        self._events.move_to_end(key)
+        while len(self._events) > EVENTS_CACHE_MAX:
+            self._events.popitem(last=False)
+        return body, etag
+
+def _respond(req: Request, body: bytes, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(req.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def build_api_router(state, cfg):
+    r = APIRouter(prefix="/api/v1")
+    cache = ApiCache(state)
+
+    def auth(req: Request):
+        # cli_token (x-cli-token or bearer) or a separate read-only api_token
+        tokens = {t for t in (cfg.get("cli_token", ""), cfg.get("api_token", "")) if t}
+        tok = req.headers.get("x-cli-token", "")
+        bearer = req.headers.get("authorization", "")
+        if bearer.startswith("Bearer "):
+            tok = tok or bearer[7:]
+        if not tok or tok not in tokens:
+            raise HTTPException(401, "unauthorized")
+
+    @r.get("/tunnels")
+    async def tunnels(req: Request):
+        auth(req)
+        snap = cache.tunnels()
+        return _respond(req, snap.body, snap.etag)
+
+    @r.get("/tunnels/{tid}")
+    async def tunnel(req: Request, tid: int):
+        auth(req)
+        hit = cache.tunnels().by_id.get(tid)
+        if hit is None:
+            raise HTTPException(404, "no such tunnel")
+        return _respond(req, *hit)
+
+    @r.get("/events")
+    async def events(req: Request, tunnel: int | None = None, kind: str | None = None,
+                     since: float | None = None, until: float | None = None,
+                     before: int | None = None, limit: int = 100):
+        auth(req)
+        key = (tunnel, kind, since, until, before, max(1, min(limit, 1000)))
+        return _respond(req, *cache.events(key))
+
+    return r
@@ -3,9 +3,10 @@ from __future__ import annotations
 import argparse, json, sys, time
 import httpx, yaml
 from rich.console import Console
+from rich.markup import escape
 from rich.table import Table
-from gre_watchdog.common.state import load_state
-from gre_watchdog.common.util import human_ts, tail_file
+from gre_watchdog.common.util import human_ts, tail_file, parse_duration
+from gre_watchdog.common.logtail import follow as follow_log
 
 console = Console()
 
@@ -22,43 +23,62 @@ def must_have_token(cfg: dict):
         console.print("[red]cli_token is missing in coordinator config[/red]")
         sys.exit(1)
 
-def show_status(st_path: str):
-    state = load_state(st_path)
+def api_base(cfg: dict) -> str:
+    return f"http://127.0.0.1:{cfg['listen_port']}"
+
+def api_get(cfg: dict, path: str, params: dict | None = None):
+    must_have_token(cfg)
+    r = httpx.get(api_base(cfg) + path, params=params, headers=api_headers(cfg), timeout=10)
+    r.raise_for_status()
+    return r.json()
+
+def show_status(cfg: dict):
+    # از API زنده می‌خوانیم، نه state.json روی دیسک
+    tunnels = api_get(cfg, "/api/v1/tunnels")["tunnels"]
     t = Table(title="GRE Watchdog Status")
     t.add_column("ID", justify="right")
     t.add_column("Status")
     t.add_column("Pub loss%")
     t.add_column("GRE loss%")
+    t.add_column("GRE rtt ms")
     t.add_column("Bad rounds", justify="right")
     t.add_column("Paused until")
     t.add_column("Last action")
     t.add_column("Last seen")
 
-    for k, v in sorted(state.tunnels.items(), key=lambda x: int(x[0])):
-        paused = "-" if v.paused_until <= time.time() else human_ts(v.paused_until)
+    for v in tunnels:
+        paused = human_ts(v["paused_until"]) if v["paused_until"] else "-"
         t.add_row(
-            str(v.id),
-            v.status,
-            f"{v.last_public_loss:.1f}",
-            f"{v.last_gre_loss:.1f}",
-            str(v.bad_rounds),
+            str(v["id"]),
+            v["status"],
+            f"{v['last_public_loss']:.1f}",
+            f"{v['last_gre_loss']:.1f}",
+            "-" if v["last_gre_rtt_ms"] is None else f"{v['last_gre_rtt_ms']:.1f}",
+            str(v["bad_rounds"]),
             paused,
-            v.last_action,
-            human_ts(v.last_seen),
+            v["last_action"],
+            human_ts(v["last_seen"]),
         )
     console.print(t)
 
-def show_events(st_path: str, n: int):
-    state = load_state(st_path)
-    evs = state.events[-n:]
-    for e in evs:
+def show_events(cfg: dict, n: int, tunnel: int | None = None, kind: str | None = None,
+                since: str | None = None):
+    params = {"limit": n}
+    if tunnel is not None:
+        params["tunnel"] = tunnel
+    if kind:
+        params["kind"] = kind
+    if since:
+        params["since"] = time.time() - parse_duration(since)
+    evs = api_get(cfg, "/api/v1/events", params)["items"]
+    for e in reversed(evs):
         ts = human_ts(e.get("ts", 0))
         tid = e.get("tunnel_id", "-")
-        console.print(f"{ts} [{e.get('kind','-')}] tid={tid} {e.get('msg','')}")
+        console.print(escape(f"{ts} [{e.get('kind','-')}] tid={tid} {e.get('msg','')}"))
 
 async def call_action(cfg: dict, action: str, tid: int | None):
     must_have_token(cfg)
-    base = f"http://127.0.0.1:{cfg['listen_port']}"
+    base = api_base(cfg)
     payload = {"action": action, "tunnel_id": tid}
     async with httpx.AsyncClient(timeout=10) as c:
         r = await c.post(base + "/cli/action", json=payload, headers=api_headers(cfg))
@@ -75,10 +95,42 @@ async def do_actions(cfg: dict, action: str, tid: int | None):
     except Exception as e:
         console.print(f"[red]error:[/red] {e}")
 
-def tail_coordinator_log(cfg: dict, lines: int):
-    # direct file read
+def show_agent_stats(cfg: dict):
+    by_agent = api_get(cfg, "/cli/agent-stats")
+    t = Table(title="Agent RPC")
+    t.add_column("Metric")
+    for name in by_agent:
+        t.add_column(name, justify="right")
+    keys = next(iter(by_agent.values()), {}).keys()
+    for k in keys:
+        vals = [by_agent[n].get(k) for n in by_agent]
+        t.add_row(k, *(f"{v:.2f}" if isinstance(v, float) else str(v) for v in vals))
+    console.print(t)
+
+def show_history(cfg: dict, tid: int, since: str, tier: str):
+    params = {"since": time.time() - parse_duration(since), "tier": tier}
+    q = api_get(cfg, f"/cli/history/{tid}", params)
+    t = Table(title=f"Tunnel {tid} history (last {since}, tier {q['tier']})")
+    for c in ("Time", "Pub loss%", "GRE loss%", "GRE max%", "Pub rtt ms", "GRE rtt ms", "Samples"):
+        t.add_column(c)
+    fmt = lambda v: "-" if v is None else f"{v:.1f}"
+    for p in q["points"]:
+        t.add_row(human_ts(p["ts"]), fmt(p["public_loss"]), fmt(p["gre_loss"]), fmt(p["gre_loss_max"]),
+                  fmt(p["public_rtt_ms"]), fmt(p["gre_rtt_ms"]), str(p["n"]))
+    console.print(t)
+
+def tail_coordinator_log(cfg: dict, lines: int, follow: bool = False):
+    # direct file read (reverse seek; -f waits on inotify)
     p = cfg["log_dir"].rstrip("/") + "/gre-watchdog-coordinator.log"
-    console.print(tail_file(p, lines))
+    if not follow:
+        sys.stdout.write(tail_file(p, lines))
+        return
+    try:
+        for chunk in follow_log(p, lines):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
 
 def main():
     ap = argparse.ArgumentParser(prog="gre-watchdog-cli")
@@ -88,30 +140,47 @@ def main():
     sub.add_parser("status")
     ev = sub.add_parser("events")
     ev.add_argument("-n", type=int, default=50)
+    ev.add_argument("--tunnel", type=int, help="only this tunnel id")
+    ev.add_argument("--kind", help="info / warn / action / error")
+    ev.add_argument("--since", help="e.g. 90s, 30m, 1h, 2d")
 
     for name in ("reset", "down", "up", "restart", "pause", "resume"):
         p = sub.add_parser(name)
         p.add_argument("id", type=int)
 
     sub.add_parser("reset-all")
+    sub.add_parser("agent-stats")
+
+    hi = sub.add_parser("history")
+    hi.add_argument("id", type=int)
+    hi.add_argument("--since", default="6h", help="e.g. 30m, 6h, 7d")
+    hi.add_argument("--tier", default="auto", choices=("auto", "raw", "1m", "1h", "1d"))
 
     tl = sub.add_parser("tail-log")
     tl.add_argument("-n", type=int, default=200)
+    tl.add_argument("-f", "--follow", action="store_true", help="keep printing new lines")
 
     args = ap.parse_args()
     cfg = load_cfg(args.config)
-    st_path = cfg["state_path"]
 
     if args.cmd == "status":
-        show_status(st_path)
+        show_status(cfg)
         return
 
     if args.cmd == "events":
-        show_events(st_path, args.n)
+        show_events(cfg, args.n, args.tunnel, args.kind, args.since)
+        return
+
+    if args.cmd == "history":
+        show_history(cfg, args.id, args.since, args.tier)
+        return
+
+    if args.cmd == "agent-stats":
+        show_agent_stats(cfg)
         return
 
     if args.cmd == "tail-log":
-        tail_coordinator_log(cfg, args.n)
+        tail_coordinator_log(cfg, args.n, args.follow)
         return
 
     # actions (need local api)
@@ -0,0 +1,152 @@
+# gre_watchdog/coordinator/live.py
+"""
+Server-sent events feed for the panel. The browser loads the page once, gets
+a snapshot, then only receives rows of tunnels that changed and new events.
+"""
+from __future__ import annotations
+import asyncio, json
+from typing import Any, Dict, List
+
+SNAPSHOT_EVENTS = 200
+
+def tunnel_row(st) -> Dict[str, Any]:
+    return {
+        "id": st.id,
+        "status": st.status,
+        "public_loss": st.last_public_loss,
+        "gre_loss": st.last_gre_loss,
+        "gre_rtt_ms": st.last_gre_rtt_ms,
+        "bad_rounds": st.bad_rounds,
+        "paused_until": st.paused_until,
+        "last_action": st.last_action,
+    }
+
+def event_item(seq: int, e: Dict[str, Any]) -> Dict[str, Any]:
+    return {"seq": seq, "ts": e["ts"], "kind": e["kind"], "tunnel_id": e.get("tunnel_id"), "msg": e["msg"]}
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+class LiveClient:
+    __slots__ = ("buf", "wake", "dropped", "owner")
+
+    def __init__(self, owner: str = ""):
+        self.buf: List[str] = []
+        self.wake = asyncio.Event()
+        self.dropped = False
+        self.owner = owner  # panel session token
+
+class LiveFeed:
+    """
+    Fan-out of AppState changes to connected viewers. Changes are coalesced
+    for `delay` seconds; each flush serializes every dirty tunnel once and
+    hands the same string to all clients. A client that falls `max_pending`
+    flushes behind is dropped; EventSource reconnects and gets a fresh snapshot.
+    """
+
+    def __init__(self, state, delay: float = 0.25, max_pending: int = 64):
+        self.state = state
+        self.delay = delay
+        self.max_pending = max_pending
+        self.clients: set[LiveClient] = set()
+        self.dirty: set[int] = set()
+        self.ev_seq = state.events.next_seq
+        self.resets: list = []
+        self.resets_dirty = False
+        self._handle: asyncio.TimerHandle | None = None
+        state.subscribe(self._changed)
+
+    def _changed(self, kind: str, obj):
+        if kind == "resets":
+            self.resets = obj
+            self.resets_dirty = True
+        if not self.clients:
+            return
+        if kind == "tunnel":
+            self.dirty.add(obj.id)
+        if self._handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._handle = loop.call_later(self.delay, self.flush)
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        out = []
+        if self.dirty:
+            rows = []
+            for tid in sorted(self.dirty):
+                st = self.state.tunnels.get(str(tid))
+                if st is not None:
+                    rows.append(tunnel_row(st))
+            self.dirty.clear()
+            out.append(sse("tunnels", rows))
+        if self.resets_dirty:
+            self.resets_dirty = False
+            out.append(sse("resets", self.resets))
+        ev = self.state.events
+        start = max(ev.first_seq, self.ev_seq)
+        if start < ev.next_seq:
+            out.append(sse("events", [event_item(s, ev.get(s)) for s in range(start, ev.next_seq)]))
+        self.ev_seq = ev.next_seq
+        if not out:
+            return
+        data = "".join(out)
+        for c in self.clients:
+            if len(c.buf) >= self.max_pending:
+                c.dropped = True
+            else:
+                c.buf.append(data)
+            c.wake.set()
+
+    def connect(self, owner: str = "") -> LiveClient:
+        if self.clients:
+            self.flush()  # existing viewers must not miss what the snapshot covers
+        else:
+            self.dirty.clear()
+            self.ev_seq = self.state.events.next_seq
+        c = LiveClient(owner)
+        self.clients.add(c)
+        return c
+
+    def disconnect(self, c: LiveClient):
+        self.clients.discard(c)
+
+    def close(self, owner: str):
+        # end the streams of a session that expired or logged out
+        for c in self.clients:
+            if c.owner == owner:
+                c.dropped = True
+                c.wake.set()
+
+    def snapshot(self) -> str:
+        ev = self.state.events
+        start = max(ev.first_seq, ev.next_seq - SNAPSHOT_EVENTS)
+        tunnels = sorted(self.state.tunnels.values(), key=lambda t: t.id)
+        return sse("snapshot", {
+            "tunnels": [tunnel_row(t) for t in tunnels],
+            "events": [event_item(s, ev.get(s)) for s in range(start, ev.next_seq)],
+            "resets": self.resets,
+        })
+
+    async def stream(self, c: LiveClient, alive, keepalive_sec: float = 15.0):
+        """
+        SSE body for one client; `alive()` is checked on every wake-up (session expiry).
+        """
+        try:
+            yield "retry: 3000\n\n" + self.snapshot()
+            while not c.dropped and alive():
+                try:
+                    await asyncio.wait_for(c.wake.wait(), keepalive_sec)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                c.wake.clear()
+                if c.buf:
+                    data, c.buf = "".join(c.buf), []
+                    yield data
+        finally:
+            self.disconnect(c)
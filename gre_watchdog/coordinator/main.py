@@ -1,22 +1,46 @@
 # gre_watchdog/coordinator/main.py
-import yaml, asyncio, time
+import yaml, asyncio, os, time
 from fastapi import FastAPI
 from gre_watchdog.common.log import setup_logger
-from gre_watchdog.common.state import load_state, save_state, add_event
-from gre_watchdog.coordinator.gre_discover import discover_gre
-from gre_watchdog.coordinator.agent_client import AgentClient
-from gre_watchdog.coordinator.actions import coordinated_reset, ip_link_set
+from gre_watchdog.common.metrics import REGISTRY, CONTENT_TYPE, GaugeFunc
+from gre_watchdog.common.security import cidr_allowed
+from gre_watchdog.common.state import StateStore, add_event
+from gre_watchdog.common.util import tail_file
+from gre_watchdog.common.tsdb import HistoryStore
+from gre_watchdog.common.gre_discover import TunnelIndex
+from gre_watchdog.coordinator.agents import AgentPool
+from gre_watchdog.coordinator.actions import ResetOrchestrator, ip_link_set
+from gre_watchdog.coordinator.timers import Timers
 from gre_watchdog.coordinator.scheduler import monitor_loop
+from gre_watchdog.common.ping import close_prober
 from gre_watchdog.coordinator.web import build_router
+from gre_watchdog.coordinator.api import build_api_router
+from gre_watchdog.coordinator.reports import build_report_router
+from gre_watchdog.coordinator.shards import ShardSupervisor
 
 def load_cfg(path="config/coordinator.yaml"):
     with open(path, "r") as f:
         return yaml.safe_load(f)
 
 CFG = load_cfg()
-logger = setup_logger("gre-watchdog-coordinator", CFG["log_dir"])
+logger = setup_logger("gre-watchdog-coordinator", CFG["log_dir"], json_format=CFG.get("log_json", False),
+                      queue_size=CFG.get("log_queue_size", 10_000), rate_burst=CFG.get("log_rate_burst", 20),
+                      rate_window_sec=CFG.get("log_rate_window_sec", 60))
 
-state = load_state(CFG["state_path"])
+store = StateStore(
+    CFG["state_path"],
+    flush_delay_sec=CFG.get("state_flush_delay_ms", 1000) / 1000.0,
+    compact_bytes=CFG.get("state_compact_bytes", 4_000_000),
+    fsync=CFG.get("state_fsync", False),
+)
+state = store.load()
+
+history = None
+if CFG.get("history_enabled", True):
+    history = HistoryStore(
+        CFG.get("history_dir") or os.path.join(os.path.dirname(CFG["state_path"]), "history"),
+        max_open=CFG.get("history_max_open", 4096),
+    )
 app_state = state  # same object
 
 app = FastAPI()
@@ -24,24 +48,31 @@ app = FastAPI()
 # per-tunnel locks
 locks: dict[int, asyncio.Lock] = {}
 
+# یک یا چند agent (سرور خارج)؛ هر تونل با peer_public به agent خودش می‌رسد
+agent = AgentPool(CFG, logger)
+
+index = TunnelIndex(CFG["iface_regex"], logger, CFG.get("discovery_poll_sec", 30), annotate=agent.annotate)
+
 async def discover_fn():
-    tunnels = await discover_gre(CFG["iface_regex"])
+    await index.refresh()
+    tunnels = index.tunnels()
     for t in tunnels:
         locks.setdefault(t["id"], asyncio.Lock())
     return tunnels
 
-agent = AgentClient(
-    base_url=CFG["agent_base_url"],
-    secret=CFG["shared_secret"],
-    timeout_sec=CFG["rpc_timeout_sec"],
-    max_attempts=CFG["rpc_max_attempts"],
-    base_backoff_ms=CFG["rpc_base_backoff_ms"],
-    max_backoff_ms=CFG["rpc_max_backoff_ms"],
-    logger=logger,
-)
+async def lookup(tid: int) -> dict | None:
+    await index.refresh()
+    t = index.get(tid)
+    if t:
+        locks.setdefault(tid, asyncio.Lock())
+    return t
 
-def save_fn():
-    save_state(CFG["state_path"], state)
+def save_fn(sync: bool = False):
+    # debounced (مگر sync): فقط تغییرات به journal اضافه می‌شود
+    store.save(sync)
+
+timers = Timers(logger)
+resets = ResetOrchestrator(CFG, agent, logger, state, locks, save_fn, timers)
 
 async def do_action(kind: str, tid: int | None):
     # manual actions from panel
@@ -50,74 +81,138 @@ async def do_action(kind: str, tid: int | None):
         if not st:
             return
         if kind == "pause":
-            st.paused_until = time.time() + 365*24*3600
+            resets.pause(st, time.time() + 365*24*3600)
             st.status = "PAUSED_MANUAL"
             add_event(state, "info", "paused manually", tid)
         else:
-            st.paused_until = 0
+            resets.unpause(st)
             add_event(state, "info", "resumed manually", tid)
         save_fn()
         return
 
-    tunnels = await discover_fn()
-    tmap = {t["id"]: t for t in tunnels}
-
     if kind == "reset_all":
-        for t in tunnels:
+        for t in await discover_fn():
             st = state.tunnels[str(t["id"])]
-            asyncio.create_task(coordinated_reset(t, st, CFG, agent, logger, state, locks[t["id"]]))
+            asyncio.create_task(resets.reset(t, st))
         add_event(state, "action", "reset all triggered")
         save_fn()
         return
 
     if tid is None:
         return
-    t = tmap.get(tid)
+    t = await lookup(tid)
     st = state.tunnels.get(str(tid))
     if not t or not st:
         return
 
     if kind == "reset":
-        asyncio.create_task(coordinated_reset(t, st, CFG, agent, logger, state, locks[tid]))
+        asyncio.create_task(resets.reset(t, st))
         add_event(state, "action", "manual reset triggered", tid)
         save_fn()
         return
 
-    # For down/up/restart: coordinator does local + remote with ack rules
+    # For down/up/restart: coordinator does local + remote with ack rules,
+    # under the tunnel's lock so it never interleaves with a reset wave
+    lock = locks.setdefault(tid, asyncio.Lock())
+    if lock.locked() or tid in resets.pending:
+        add_event(state, "warn", f"manual {kind} refused: reset in progress", tid)
+        save_fn()
+        return
+    async with lock:
+        await manual_link_op(kind, t, tid)
+
+async def manual_link_op(kind: str, t: dict, tid: int):
     try:
         if kind == "down":
-            await agent.call("/v1/iface/down", {"iface": t["iface_remote"]}, must_ok=True)
+            await agent.call(t, "/v1/iface/down", {"iface": t["iface_remote"]}, must_ok=True)
             await ip_link_set(t["iface_local"], up=False)
             add_event(state, "action", "manual down ok", tid)
         elif kind == "up":
             await ip_link_set(t["iface_local"], up=True)
-            await agent.call("/v1/iface/up", {"iface": t["iface_remote"]}, must_ok=True)
+            await agent.call(t, "/v1/iface/up", {"iface": t["iface_remote"]}, must_ok=True)
             add_event(state, "action", "manual up ok", tid)
         elif kind == "restart":
-            await agent.call("/v1/iface/restart", {"iface": t["iface_remote"]}, must_ok=True)
+            await agent.call(t, "/v1/iface/restart", {"iface": t["iface_remote"]}, must_ok=True)
             await ip_link_set(t["iface_local"], up=False)
             await ip_link_set(t["iface_local"], up=True)
             add_event(state, "action", "manual restart ok", tid)
+        state.notify("link_reset", [tid])
         save_fn()
     except Exception as e:
         add_event(state, "error", f"manual action failed: {e}", tid)
         save_fn()
 
+async def shard_reset(tid: int):
+    # a shard confirmed the tunnel bad; the reset itself runs here
+    t = await lookup(tid)
+    st = state.tunnels.get(str(tid))
+    if t and st:
+        await resets.reset(t, st)
+        save_fn()
+
+shards = ShardSupervisor(CFG, state, logger, shard_reset, save_fn, history) if CFG.get("shards", 0) > 1 else None
+
+LOG_PATH = os.path.join(CFG["log_dir"], "gre-watchdog-coordinator.log")
+
 def read_log():
-    # ساده: آخرین 400 خط
-    import os
-    p = os.path.join(CFG["log_dir"], "gre-watchdog-coordinator.log")
-    try:
-        with open(p, "r") as f:
-            lines = f.readlines()[-400:]
-        return "".join(lines)
-    except Exception as e:
-        return f"cannot read log: {e}"
+    # آخرین 400 خط (از انتهای فایل و backupها، بدون خواندن کل فایل)
+    return tail_file(LOG_PATH, 400)
 
-router = build_router(state, CFG, logger, do_action, read_log)
+router = build_router(state, CFG, logger, do_action, read_log, history, timers, LOG_PATH)
 app.include_router(router)
+app.include_router(build_api_router(state, CFG))
+app.include_router(build_report_router(state, CFG, logger, agent))
 
 from fastapi import Request, HTTPException
+from fastapi.responses import PlainTextResponse
+
+# per-tunnel gauges are read from state at scrape time
+TUNNEL_LOSS = GaugeFunc("gw_tunnel_loss_percent", "Last measured packet loss", ["tunnel", "path"])
+TUNNEL_RTT = GaugeFunc("gw_tunnel_rtt_ms", "Last measured average RTT", ["tunnel", "path"])
+TUNNEL_BAD_ROUNDS = GaugeFunc("gw_tunnel_bad_rounds", "Consecutive bad rounds", ["tunnel"])
+TUNNEL_STATUS = GaugeFunc("gw_tunnel_status", "1 for the tunnel's current status", ["tunnel", "status"])
+EVENTS_TOTAL = GaugeFunc("gw_events_appended", "Events appended since start (monotonic seq)")
+
+def _tunnel_samples(fn):
+    return lambda: ((k, v) for st in list(state.tunnels.values()) for k, v in fn(st))
+
+def _rtt(st):
+    if st.last_public_rtt_ms is not None:
+        yield (st.id, "public"), st.last_public_rtt_ms
+    if st.last_gre_rtt_ms is not None:
+        yield (st.id, "gre"), st.last_gre_rtt_ms
+    if st.remote_gre_rtt_ms is not None:
+        yield (st.id, "gre_remote"), st.remote_gre_rtt_ms
+
+def _loss(st):
+    yield (st.id, "public"), st.last_public_loss
+    yield (st.id, "gre"), st.last_gre_loss
+    if st.remote_gre_loss is not None:
+        yield (st.id, "gre_remote"), st.remote_gre_loss
+
+TUNNEL_LOSS.set_function(_tunnel_samples(_loss))
+TUNNEL_RTT.set_function(_tunnel_samples(_rtt))
+TUNNEL_BAD_ROUNDS.set_function(_tunnel_samples(lambda st: (((st.id,), st.bad_rounds),)))
+TUNNEL_STATUS.set_function(_tunnel_samples(lambda st: (((st.id, st.status), 1),)))
+EVENTS_TOTAL.set_function(lambda: (((), state.events.next_seq),))
+
+LOOPBACK = ("127.0.0.1", "::1")
+
+@app.get("/metrics")
+async def metrics(req: Request):
+    tok = CFG.get("metrics_token", "")
+    if tok:
+        if req.headers.get("authorization", "") != f"Bearer {tok}":
+            raise HTTPException(401, "unauthorized")
+    else:
+        # بدون token فقط از همین ماشین (یا metrics_allow_cidrs)؛ پشت nginx آدرس واقعی در X-Forwarded-For است
+        client_ip = req.client.host if req.client else "0.0.0.0"
+        fwd = req.headers.get("x-forwarded-for", "")
+        if fwd and client_ip in LOOPBACK:
+            client_ip = fwd.split(",")[0].strip()
+        if not cidr_allowed(client_ip, CFG.get("metrics_allow_cidrs", ["127.0.0.1/32", "::1/128"])):
+            raise HTTPException(403, "forbidden")
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
 
 @app.post("/cli/action")
 async def cli_action(req: Request):
@@ -133,11 +228,51 @@ async def cli_action(req: Request):
     await do_action(action, tid)
     return {"ok": True, "action": action, "tunnel_id": tid}
 
+@app.get("/cli/history/{tid}")
+async def cli_history(req: Request, tid: int, since: float, until: float | None = None, tier: str = "auto"):
+    tok = req.headers.get("x-cli-token", "")
+    if not tok or tok != CFG.get("cli_token", ""):
+        raise HTTPException(401, "unauthorized")
+    if history is None:
+        raise HTTPException(404, "history disabled")
+    return history.query(tid, since, until or time.time(), tier)
+
+@app.get("/cli/agent-stats")
+async def cli_agent_stats(req: Request):
+    tok = req.headers.get("x-cli-token", "")
+    if not tok or tok != CFG.get("cli_token", ""):
+        raise HTTPException(401, "unauthorized")
+    return agent.stats()
+
+_warmup: asyncio.Task | None = None
+
 @app.on_event("startup")
 async def startup():
+    global _warmup
+    await index.start()
+    # warm-up در background؛ agent در دسترس نبودن نباید resume و مانیتور را عقب بیندازد
+    _warmup = asyncio.create_task(agent.start())
     add_event(state, "info", "coordinator started")
+    resets.resume()  # resetهایی که وسط کار قطع شدند + timerهای pause/window
     save_fn()
+    if shards is not None:
+        # probing در workerها؛ این process فقط state، پنل و resetها را نگه می‌دارد
+        shards.start()
+        return
     async def reset_fn(tunnel, st, lock):
-        await coordinated_reset(tunnel, st, CFG, agent, logger, state, lock)
+        await resets.reset(tunnel, st)
         save_fn()
-    asyncio.create_task(monitor_loop(discover_fn, state, CFG, locks, reset_fn, save_fn, state, logger))
+    asyncio.create_task(monitor_loop(discover_fn, state, CFG, locks, reset_fn, save_fn, state, logger, history))
+
+@app.on_event("shutdown")
+async def shutdown():
+    if shards is not None:
+        shards.stop()
+    if _warmup is not None and not _warmup.done():
+        _warmup.cancel()
+    close_prober()
+    index.close()
+    await agent.close()
+    store.close()
+    if history is not None:
+        history.close()
@@ -0,0 +1,94 @@
+# gre_watchdog/coordinator/reports.py
+"""
+Receiver for the agents' probe reports (see agent/prober.py). Each report
+row is merged into its TunnelState as the remote (outside-to-inside) GRE
+loss/RTT; tunnels the agent saw as bad are announced with
+notify("report", ids) so the scheduler can confirm them right away.
+"""
+from __future__ import annotations
+import json, time
+from fastapi import APIRouter, Request, HTTPException
+from gre_watchdog.common.metrics import Counter
+from gre_watchdog.common.security import hmac_verify
+from gre_watchdog.coordinator.actions import tunnel_of
+
+REPORTS_RECEIVED = Counter("gw_agent_reports_received", "Agent probe reports by outcome", ["agent", "result"])
+REPORT_ROWS = Counter("gw_agent_report_rows", "Tunnel rows merged from agent reports", ["agent"])
+
+def _count(v) -> bool:
+    return isinstance(v, int) and not isinstance(v, bool) and v >= 0
+
+def check_rows(rows: list):
+    # ValueError on the first malformed row; nothing is merged then
+    for i, row in enumerate(rows):
+        if not isinstance(row, list) or len(row) != 4:
+            raise ValueError(f"row {i}: want [id, sent, received, rtt_avg_ms]")
+        tid, sent, received, rtt = row
+        if not _count(tid) or not _count(sent) or not _count(received) or received > sent:
+            raise ValueError(f"row {i}: id, sent, received must be ints with 0 <= received <= sent")
+        if rtt is not None and (isinstance(rtt, bool) or not isinstance(rtt, (int, float)) or rtt < 0):
+            raise ValueError(f"row {i}: rtt_avg_ms must be a number >= 0 or null")
+
+def merge_report(state, rows: list, ts: float, loss_ok_percent: float, owns=None) -> list[int]:
+    """
+    Apply [id, sent, received, rtt_avg_ms] rows; returns ids whose remote
+    loss is at or above loss_ok_percent. `owns(st)` filters out tunnels that
+    belong to another agent. Rows are checked (check_rows) before any is
+    applied.
+    """
+    check_rows(rows)
+    bad = []
+    for row in rows:
+        tid, sent, received, rtt = row
+        st = state.tunnels.get(str(tid))
+        if st is None or sent <= 0 or (owns is not None and not owns(st)):
+            continue
+        loss = 100.0 * (sent - received) / sent
+        st.remote_gre_loss = loss
+        st.remote_gre_rtt_ms = rtt
+        st.remote_report_at = ts
+        if loss >= loss_ok_percent:
+            bad.append(st.id)
+    return bad
+
+def build_report_router(state, cfg, logger, agents=None):
+    r = APIRouter()
+    last_ts: dict[str, float] = {}
+
+    @r.post("/v1/agent/report")
+    async def report(req: Request):
+        body = await req.body()
+        try:
+            data = json.loads(body.decode())
+            agent = str(data.get("agent", "-"))
+        except (ValueError, AttributeError):
+            raise HTTPException(400, "bad report")
+        # the agent name is inside the signed body; its own secret checks it
+        secret = agents.secret_for(agent) if agents is not None else cfg["shared_secret"]
+        if not secret or not hmac_verify(secret, body, req.headers.get("x-ts", ""), req.headers.get("x-sig", ""),
+                                         cfg.get("max_clock_skew_sec", 45)):
+            raise HTTPException(401, "unauthorized")
+        rows = data.get("rows")
+        try:
+            ts = float(data.get("ts", 0))
+            if not isinstance(rows, list):
+                raise ValueError("rows required")
+            check_rows(rows)
+        except (TypeError, ValueError) as e:
+            REPORTS_RECEIVED.labels(agent, "bad").inc()
+            raise HTTPException(400, f"bad report: {e}")
+        if ts <= last_ts.get(agent, 0.0):
+            # قدیمی‌تر از آخرین گزارش (replay یا ترتیب به هم خورده)
+            REPORTS_RECEIVED.labels(agent, "stale").inc()
+            return {"ok": False, "error": "stale"}
+        last_ts[agent] = ts
+        now = time.time()
+        owns = (lambda st: agents.owns(agent, tunnel_of(st))) if agents is not None else None
+        bad = merge_report(state, rows, min(ts, now), cfg["loss_ok_percent"], owns)
+        REPORTS_RECEIVED.labels(agent, "ok").inc()
+        REPORT_ROWS.labels(agent).inc(len(rows))
+        if bad:
+            state.notify("report", bad)
+        return {"ok": True, "rows": len(rows)}
+
+    return r
@@ -1,54 +1,289 @@
-import asyncio, time
-from gre_watchdog.coordinator.ping import ping_loss_percent
+import asyncio, time, zlib
+from gre_watchdog.common.ping import forget, probe
 from gre_watchdog.common.state import add_event
+from gre_watchdog.common.metrics import Counter, Histogram
+from gre_watchdog.coordinator.shared_fate import SharedFate
+
+ROUND_SECONDS = Histogram("gw_round_duration_seconds", "Round start until its last tunnel check finished")
+DISCOVERY_SECONDS = Histogram("gw_discovery_duration_seconds", "Tunnel discovery per round")
+CHECK_SECONDS = Histogram("gw_check_duration_seconds", "One tunnel check (public + GRE probe)")
+PING_SECONDS = Histogram("gw_ping_duration_seconds", "One probe burst", ["target"])
+CHECKS_SKIPPED = Counter("gw_checks_skipped", "Checks skipped because the previous one was still running")
+CHECKS = Counter("gw_checks", "Tunnel checks by probing mode", ["mode"])
+PROBE_ECHOES = Counter("gw_probe_echoes", "Echo requests sent by tunnel checks", ["mode"])
+PROBE_ECHOES_SAVED = Counter("gw_probe_echoes_saved", "Echo requests not sent to stable tunnels (vs ping_count every round)")
+DETECT_SECONDS = Histogram("gw_detect_duration_seconds", "First bad GRE round until the reset was triggered")
 
 def ok_loss(loss: float, cfg: dict) -> bool:
     return loss < cfg["loss_ok_percent"]
 
-async def check_tunnel(tunnel: dict, st, cfg, locks, reset_fn, app_state, logger):
+def probe_ok(stats, cfg: dict) -> bool:
+    # the loss estimator's verdict wins; without one, the hard threshold
+    return stats.ok if stats.ok is not None else ok_loss(stats.loss_percent, cfg)
+
+async def check_tunnel(tunnel: dict, st, cfg, locks, reset_fn, app_state, logger, history=None,
+                       count: int | None = None, fate: SharedFate | None = None):
     tid = tunnel["id"]
 
     st.last_seen = time.time()
 
-    pub_loss, gre_loss = await asyncio.gather(
-        ping_loss_percent(tunnel["peer_public"], cfg["ping_count"], cfg["ping_timeout_sec"]),
-        ping_loss_percent(tunnel["peer_private"], cfg["ping_count"], cfg["ping_timeout_sec"]),
+    async def timed(ip: str, target: str):
+        with PING_SECONDS.labels(target).time():
+            return await probe(ip, cfg, logger, count)
+
+    pub_ip = tunnel["peer_public"]
+    pub, gre = await asyncio.gather(
+        fate.public(pub_ip, lambda: timed(pub_ip, "public")) if fate else timed(pub_ip, "public"),
+        timed(tunnel["peer_private"], "gre"),
     )
+    pub_loss, gre_loss = pub.loss_percent, gre.loss_percent
     st.last_public_loss = pub_loss
     st.last_gre_loss = gre_loss
+    st.last_public_rtt_ms = pub.rtt_avg_ms
+    st.last_gre_rtt_ms = gre.rtt_avg_ms
+    if history is not None:
+        history.record(tid, st.last_seen, pub_loss, gre_loss, pub.rtt_avg_ms, gre.rtt_avg_ms)
 
-    pub_ok = ok_loss(pub_loss, cfg)
-    gre_ok = ok_loss(gre_loss, cfg)
+    pub_ok = probe_ok(pub, cfg)
+    gre_ok = probe_ok(gre, cfg)
 
     if pub_ok and gre_ok:
         st.status = "OK"
         st.bad_rounds = 0
         st.last_action = "none"
-        return
+        if fate:
+            fate.observe(tunnel, app_state)
+        return st
 
     if (not pub_ok) and (not gre_ok):
         st.status = "FILTERED_OR_DOWN"
         st.bad_rounds = 0
         st.last_action = "none"
-        return
+        if fate:
+            fate.observe(tunnel, app_state)
+        return st
 
     if pub_ok and (not gre_ok):
         st.status = "PUBLIC_OK_GRE_BAD"
         st.bad_rounds += 1
         st.last_action = f"bad_round_{st.bad_rounds}"
-        if st.bad_rounds >= cfg["confirm_bad_rounds"]:
+        if fate:
+            # the siblings may have recovered while this one stayed bad
+            fate.observe(tunnel, app_state)
+        if st.bad_rounds >= cfg["confirm_bad_rounds"] and fate and fate.hold(tunnel, app_state):
+            # کل peer با هم خراب است؛ یک رویداد peer به جای N reset جدا
+            st.last_action = "held_shared_fate"
+        elif st.bad_rounds >= cfg["confirm_bad_rounds"]:
             # reset در background ولی lock دارد که همزمان دوبار انجام نشود
             add_event(app_state, "warn", "reset triggered (confirmed)", tid)
             asyncio.create_task(reset_fn(tunnel, st, locks[tid]))
-        return
+        return st
 
     st.status = "WEIRD_PUBLIC_BAD_GRE_OK"
     st.bad_rounds = 0
     st.last_action = "none"
+    if fate:
+        fate.observe(tunnel, app_state)
+    return st
+
+class ProbeScheduler:
+    """
+    Spreads tunnel checks over the check interval instead of bursting them at
+    the top of every round. Each tunnel gets a stable phase offset (hash of its
+    id) within the interval minus one full check (ping_count echoes plus
+    ping_timeout_sec), and at most `probe_max_inflight` checks run at once.
+    A tunnel whose previous check is still running skips the round.
+
+    With probe_adaptive, a tunnel that was OK for probe_stable_after checks in
+    a row is only probed every probe_stable_every rounds with
+    probe_stable_count echoes. A GRE-bad result (bad_rounds below
+    confirm_bad_rounds) is re-checked with full ping_count right away,
+    probe_confirm_gap_sec apart, until it clears or the reset triggers, and
+    the other tunnels on the same peer get an immediate check so a shared
+    failure is seen before the first reset fires.
+
+    With agent reports (agent/prober.py), a stable tunnel whose latest report
+    is fresh and OK rests for probe_remote_every rounds instead, and one the
+    agent reports as bad gets an immediate full check.
+    """
+
+    def __init__(self, cfg: dict, logger, fate: SharedFate | None = None, states: dict | None = None):
+        self.interval = float(cfg["check_interval_sec"])
+        self.spread = bool(cfg.get("probe_spread", True))
+        # offsets stop one full check before the next round, so a check started
+        # late in the window is done when its tunnel comes up again
+        check_sec = int(cfg["ping_count"]) * cfg.get("icmp_interval_ms", 200) / 1000.0 + float(cfg["ping_timeout_sec"])
+        self.window = max(0.0, self.interval - check_sec)
+        self.budget = asyncio.Semaphore(int(cfg.get("probe_max_inflight", 64)))
+        self.logger = logger
+        self.inflight: dict[int, asyncio.Task] = {}
+        self.skipped = 0
+
+        self.ping_count = int(cfg["ping_count"])
+        self.confirm_rounds = int(cfg["confirm_bad_rounds"])
+        self.adaptive = bool(cfg.get("probe_adaptive", False))
+        self.stable_after = int(cfg.get("probe_stable_after", 4))
+        self.stable_every = max(1, int(cfg.get("probe_stable_every", 2)))
+        self.stable_count = max(1, min(int(cfg.get("probe_stable_count", 3)), self.ping_count))
+        self.confirm_gap = float(cfg.get("probe_confirm_gap_sec", 1))
+        self.round_no = 0
+        self.ok_streak: dict[int, int] = {}
+        self.suspect_since: dict[int, float] = {}
+        self.confirming: set[int] = set()
+        self.fate = fate
+        self.tunnels: dict[int, dict] = {}
+        self.check = None
+        self.states = states
+        self.loss_ok = float(cfg["loss_ok_percent"])
+        self.remote_every = max(self.stable_every, int(cfg.get("probe_remote_every", 4)))
+        self.remote_max_age = float(cfg.get("agent_report_max_age_sec", 3 * self.interval))
+
+    def offset(self, tid: int) -> float:
+        if not self.spread:
+            return 0.0
+        return (zlib.crc32(str(tid).encode()) % 1000) / 1000.0 * self.window
+
+    def plan(self, tid: int) -> tuple[str, int] | None:
+        """
+        (mode, echo count) for this round, or None to let a stable tunnel rest.
+        """
+        if not self.adaptive or self.ok_streak.get(tid, 0) < self.stable_after:
+            return "full", self.ping_count
+        every = self.remote_every if self._remote_ok(tid) else self.stable_every
+        if (self.round_no + tid) % every:
+            PROBE_ECHOES_SAVED.inc(2 * self.ping_count)
+            return None
+        PROBE_ECHOES_SAVED.inc(2 * (self.ping_count - self.stable_count))
+        return "light", self.stable_count
+
+    def dispatch(self, tunnels: list[dict], round_start: float, check) -> int:
+        loop = asyncio.get_running_loop()
+        seen = set()
+        tasks = []
+        self.tunnels = {t["id"]: t for t in tunnels}
+        self.check = check
+        for t in tunnels:
+            tid = t["id"]
+            seen.add(tid)
+            prev = self.inflight.get(tid)
+            if prev and not prev.done():
+                if tid in self.confirming:
+                    continue  # confirmation rounds already cover this round
+                self.skipped += 1
+                CHECKS_SKIPPED.inc()
+                self.logger.warning(f"check still running, skipping round tid={tid}", extra={"tunnel_id": tid})
+                continue
+            p = self.plan(tid)
+            if p is None:
+                continue
+            self.inflight[tid] = loop.create_task(self._run(t, round_start + self.offset(tid), check, *p))
+            tasks.append(self.inflight[tid])
+        for tid in [k for k, v in self.inflight.items() if k not in seen and v.done()]:
+            self.inflight.pop(tid, None)
+        for d in (self.ok_streak, self.suspect_since):
+            for tid in [k for k in d if k not in seen]:
+                d.pop(tid, None)
+        self.round_no += 1
+        if tasks:
+            loop.create_task(self._round_done(tasks, round_start))
+        return len(tasks)
+
+    async def _round_done(self, tasks: list, round_start: float):
+        await asyncio.gather(*tasks, return_exceptions=True)
+        ROUND_SECONDS.observe(asyncio.get_running_loop().time() - round_start)
+
+    async def _run(self, tunnel: dict, start_at: float, check, mode: str = "full", count: int | None = None):
+        delay = start_at - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tid = tunnel["id"]
+        st = await self._check(tunnel, check, mode, count or self.ping_count)
+        if not self.adaptive:
+            return
+        if st is not None and self._suspect(st) and st.bad_rounds == 1:
+            self._kick_siblings(tid)
+        try:
+            while st is not None and self._suspect(st):
+                self.confirming.add(tid)
+                await asyncio.sleep(self.confirm_gap)
+                st = await self._check(tunnel, check, "confirm", self.ping_count)
+        finally:
+            self.confirming.discard(tid)
+
+    async def _check(self, tunnel: dict, check, mode: str, count: int):
+        CHECKS.labels(mode).inc()
+        PROBE_ECHOES.labels(mode).inc(2 * count)
+        async with self.budget:
+            try:
+                with CHECK_SECONDS.time():
+                    st = await check(tunnel, count)
+            except Exception as e:
+                self.logger.error(f"check failed tid={tunnel['id']} err={e}", extra={"tunnel_id": tunnel["id"]})
+                return None
+        if st is not None:
+            self._observe(tunnel["id"], st)
+        return st
+
+    def _kick_siblings(self, tid: int):
+        if self.fate is None:
+            return
+        self._kick(self.fate.siblings(tid), "sibling")
+
+    def _kick(self, tids, mode: str):
+        loop = asyncio.get_running_loop()
+        for tid in tids:
+            t = self.tunnels.get(tid)
+            prev = self.inflight.get(tid)
+            if t is None or self.check is None or (prev is not None and not prev.done()):
+                continue
+            self.inflight[tid] = loop.create_task(self._run(t, 0.0, self.check, mode, self.ping_count))
+
+    def _remote_ok(self, tid: int) -> bool:
+        st = self.states.get(str(tid)) if self.states is not None else None
+        return (st is not None and st.remote_gre_loss is not None and st.remote_gre_loss < self.loss_ok
+                and time.time() - st.remote_report_at <= self.remote_max_age)
+
+    def on_state(self, kind: str, obj):
+        # AppState listener: the agent saw these tunnels bad, check them from here now;
+        # tunnels whose link was just bounced start from a fresh loss belief
+        if kind == "link_reset":
+            for tid in obj:
+                st = self.states.get(str(tid)) if self.states is not None else None
+                if st is not None:
+                    forget(st.peer_private, st.peer_public)
+            return
+        if kind != "report":
+            return
+        for tid in obj:
+            self.ok_streak[tid] = 0
+        self._kick(obj, "remote")
+
+    def _suspect(self, st) -> bool:
+        return st.status == "PUBLIC_OK_GRE_BAD" and 0 < st.bad_rounds < self.confirm_rounds
+
+    def _observe(self, tid: int, st):
+        self.ok_streak[tid] = self.ok_streak.get(tid, 0) + 1 if st.status == "OK" else 0
+        if st.status != "PUBLIC_OK_GRE_BAD":
+            self.suspect_since.pop(tid, None)
+            return
+        first = self.suspect_since.setdefault(tid, time.monotonic())
+        if st.bad_rounds == self.confirm_rounds:
+            DETECT_SECONDS.observe(time.monotonic() - first)
+
+async def monitor_loop(discover_fn, state, cfg, locks, reset_fn, save_fn, app_state, logger, history=None):
+    fate = SharedFate(cfg, logger) if cfg.get("shared_fate", True) else None
+    sched = ProbeScheduler(cfg, logger, fate, state.tunnels)
+    state.subscribe(sched.on_state)
+    loop = asyncio.get_running_loop()
+    next_round = loop.time()
+
+    async def check(t, count=None):
+        return await check_tunnel(t, state.tunnels[str(t["id"])], cfg, locks, reset_fn, app_state, logger,
+                                  history, count, fate)
 
-async def monitor_loop(discover_fn, state, cfg, locks, reset_fn, save_fn, app_state, logger):
     while True:
-        tunnels = await discover_fn()
+        with DISCOVERY_SECONDS.time():
+            tunnels = await discover_fn()
         # sync state list
         for t in tunnels:
             tid = str(t["id"])
@@ -64,16 +299,18 @@ async def monitor_loop(discover_fn, state, cfg, locks, reset_fn, save_fn, app_st
                 )
                 add_event(app_state, "info", "tunnel discovered", t["id"])
 
-        # run checks concurrently for all tunnels
-        tasks = []
-        for t in tunnels:
-            st = state.tunnels[str(t["id"])]
-            tasks.append(check_tunnel(t, st, cfg, locks, reset_fn, app_state, logger))
+        if fate:
+            fate.update(tunnels)
 
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        # checks run at round start + per-tunnel phase offset, within the in-flight budget
+        sched.dispatch(tunnels, next_round, check)
 
-        # persist state
+        # persist state (results of checks finished during the previous window)
         save_fn()
 
-        await asyncio.sleep(cfg["check_interval_sec"])
+        next_round += sched.interval
+        now = loop.time()
+        if next_round < now:
+            # fell behind (slow discovery): re-anchor instead of bursting to catch up
+            next_round = now
+        await asyncio.sleep(next_round - now)
@@ -0,0 +1,415 @@
+# gre_watchdog/coordinator/shards.py
+"""
+Sharded monitoring (shards: N > 1). The uvicorn process stays the single
+front: it owns the persisted AppState, the panel, /api/v1, agent reports and
+the reset orchestrator. Probing runs in N worker processes, each running
+monitor_loop for its shard only; results flow back as field-level patches
+and events, and the front sends its own changes (reset progress, pauses,
+remote loss) back to the owning worker the same way. Each TunnelState field
+has one owner (WORKER_FIELDS / FRONT_FIELDS); see StateSync.
+
+Partitioning: a tunnel belongs to shard_of(peer_public, N), a rendezvous
+(highest-random-weight) hash. Whole peers stay together, so shared fate and
+the one-public-probe-per-peer dedup keep working inside a worker.
+
+Rebalancing: there is no coordinator-side assignment table. Every worker
+discovers all GRE interfaces through its own netlink TunnelIndex and keeps
+the ones that hash to it, so
+  - a tunnel (or peer) that appears is picked up by exactly one worker on
+    its next round, with nothing moved elsewhere;
+  - a tunnel that disappears just drops out of its worker's list; the other
+    shards are untouched;
+  - changing N (a restart) moves only the peers whose top-weight shard
+    changed, about 1/N of them; the front reseeds each worker with the
+    current state of its tunnels, so bad_rounds, pauses and reset windows
+    carry over.
+A crashed worker is restarted and reseeded the same way. Balance is per
+peer, not per tunnel: a peer with many tunnels weighs on one worker.
+"""
+from __future__ import annotations
+import asyncio, hashlib, multiprocessing as mp, signal
+from dataclasses import asdict, fields
+from gre_watchdog.common.metrics import Counter, GaugeFunc
+from gre_watchdog.common.state import AppState, TunnelState, add_event
+
+SHARD_TUNNELS = GaugeFunc("gw_shard_tunnels", "Tunnels owned by each monitor shard", ["shard"])
+SHARD_RESTARTS = Counter("gw_shard_restarts", "Monitor shard worker restarts", ["shard"])
+SHARD_MESSAGES = Counter("gw_shard_messages", "Messages received from monitor shards", ["kind"])
+
+def shard_of(peer_public: str, n: int) -> int:
+    if n <= 1:
+        return 0
+    def weight(k: int) -> bytes:
+        return hashlib.blake2b(f"{k}/{peer_public}".encode(), digest_size=8).digest()
+    return max(range(n), key=weight)
+
+# every field has one writer of record: the worker probes (and discovers), the
+# front resets, pauses and merges agent reports
+WORKER_FIELDS = frozenset({
+    "id", "iface_local", "iface_remote", "peer_public", "local_private", "peer_private",
+    "status", "bad_rounds", "last_seen", "last_public_loss", "last_gre_loss",
+    "last_public_rtt_ms", "last_gre_rtt_ms", "last_action",
+})
+FRONT_FIELDS = frozenset(f.name for f in fields(TunnelState)) - WORKER_FIELDS
+
+class StateSync:
+    """
+    Field-level sync of TunnelStates between two processes, each side owning
+    the fields in `owned`. Local writes to owned fields are sent as
+    ("patch", [(key, {field: value})]) and the other side applies them as
+    is. A local write to a field the other side owns (the front clearing
+    bad_rounds after a reset) goes out as ("set", ...): the owner applies it
+    as its own write and sends the result back in its next patch, so
+    concurrent writes settle on the owner's value on both sides. Patch
+    fields the receiver owns are dropped, and so are patch fields with a
+    local write still on its way to the owner.
+    """
+
+    def __init__(self, state: AppState, send, owned: frozenset, delay: float = 0.1, listen: bool = True):
+        self.state = state
+        self.send = send
+        self.owned = owned
+        self.delay = delay
+        self.synced: dict[str, dict] = {}   # owned fields as last sent
+        self.seen: dict[str, dict] = {}     # the other side's fields as last received
+        self.dirty: set[str] = set()
+        self.applying = False
+        self._handle: asyncio.TimerHandle | None = None
+        if listen:
+            state.subscribe(self._changed)
+
+    def _changed(self, kind: str, obj):
+        if kind != "tunnel" or self.applying:
+            return
+        self.dirty.add(str(obj.id))
+        if self._handle is None:
+            try:
+                self._handle = asyncio.get_running_loop().call_later(self.delay, self.flush)
+            except RuntimeError:
+                pass
+
+    def diff(self, keys) -> tuple[list, list]:
+        """
+        (patches of owned fields, sets of the other side's fields) for `keys`.
+        """
+        patches, sets = [], []
+        for key in keys:
+            st = self.state.tunnels.get(key)
+            if st is None:
+                continue
+            sent = self.synced.setdefault(key, {})
+            seen = self.seen.setdefault(key, {})
+            own, other = {}, {}
+            for k, v in asdict(st).items():
+                if k in self.owned:
+                    if k not in sent or sent[k] != v:
+                        own[k] = sent[k] = v
+                elif k in seen and seen[k] != v:
+                    other[k] = seen[k] = v
+            if own:
+                patches.append((key, own))
+            if other:
+                sets.append((key, other))
+        return patches, sets
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        keys, self.dirty = self.dirty, set()
+        self.send_diff(keys)
+
+    def send_diff(self, keys):
+        patches, sets = self.diff(keys)
+        if patches:
+            self.send(("patch", patches))
+        if sets:
+            self.send(("set", sets))
+
+    def apply(self, patches: list):
+        self.applying = True
+        try:
+            for key, d in patches:
+                d = {k: v for k, v in d.items() if k not in self.owned}
+                seen = self.seen.setdefault(key, {})
+                st = self.state.tunnels.get(key)
+                if st is None:
+                    self.state.tunnels[key] = TunnelState(**d)
+                    seen.update(d)
+                    continue
+                for k, v in d.items():
+                    # written here and not sent yet: the owner gets it as a "set"
+                    if k in seen and getattr(st, k) != seen[k]:
+                        continue
+                    setattr(st, k, v)
+                    seen[k] = v
+        finally:
+            self.applying = False
+
+    def apply_set(self, sets: list):
+        # the other side wrote one of our fields: take it as our own write
+        for key, d in sets:
+            st = self.state.tunnels.get(key)
+            if st is None:
+                continue
+            for k, v in d.items():
+                if k in self.owned:
+                    setattr(st, k, v)
+
+    def seed(self, tunnels: list[dict]):
+        # full state of the tunnels, both sides' fields, as the baseline
+        self.applying = True
+        try:
+            for d in tunnels:
+                key = str(d["id"])
+                st = self.state.tunnels.get(key)
+                if st is None:
+                    self.state.tunnels[key] = TunnelState(**d)
+                else:
+                    for k, v in d.items():
+                        setattr(st, k, v)
+                self.mark(key, d)
+        finally:
+            self.applying = False
+
+    def mark(self, key: str, d: dict):
+        self.synced[key] = {k: v for k, v in d.items() if k in self.owned}
+        self.seen[key] = {k: v for k, v in d.items() if k not in self.owned}
+
+# --- worker process ---
+
+class _HistoryProxy:
+    # check_tunnel records history through this; the front owns the files
+    def __init__(self, send):
+        self.send = send
+
+    def record(self, *args):
+        self.send(("hist", args))
+
+def worker_main(cfg: dict, k: int, n: int, conn):
+    # Ctrl-C goes to the whole process group; the front decides when we stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker(cfg, k, n, conn))
+
+async def _worker(cfg: dict, k: int, n: int, conn):
+    from gre_watchdog.common.log import setup_logger
+    from gre_watchdog.coordinator.agents import AgentPool
+    from gre_watchdog.common.gre_discover import TunnelIndex
+    from gre_watchdog.coordinator.scheduler import monitor_loop
+    from gre_watchdog.common.ping import close_prober
+
+    logger = setup_logger(f"gre-watchdog-coordinator-shard{k}", cfg["log_dir"], json_format=cfg.get("log_json", False))
+    loop = asyncio.get_running_loop()
+    state = AppState()
+    sync = StateSync(state, conn.send, WORKER_FIELDS)
+    locks: dict[int, asyncio.Lock] = {}
+    # only for routing tunnels to agents (agent, iface_remote), like the front's
+    # index does; never started, the worker makes no RPCs
+    agents = AgentPool(cfg, logger)
+    index = TunnelIndex(cfg["iface_regex"], logger, cfg.get("discovery_poll_sec", 30), annotate=agents.annotate)
+    mine: list[dict] = []
+    mine_version = -1
+    stop = loop.create_future()
+
+    def on_event(kind, obj):
+        if kind == "event":
+            conn.send(("event", state.events.get(obj)))
+
+    def on_message():
+        try:
+            while conn.poll():
+                kind, body = conn.recv()
+                if kind == "patch":
+                    sync.apply(body)
+                elif kind == "set":
+                    sync.apply_set(body)
+                elif kind == "seed":
+                    sync.seed(body)
+                elif kind == "notify":
+                    state.notify(*body)  # report kicks, link resets
+        except (EOFError, OSError):
+            if not stop.done():
+                stop.set_result(None)  # front went away
+
+    async def discover_fn():
+        nonlocal mine, mine_version
+        await index.refresh()
+        if index.version != mine_version:
+            mine = [t for t in index.tunnels() if shard_of(t["peer_public"], n) == k]
+            mine_version = index.version
+            conn.send(("owned", len(mine)))
+        for t in mine:
+            locks.setdefault(t["id"], asyncio.Lock())
+        return mine
+
+    async def reset_fn(tunnel, st, lock):
+        sync.flush()  # the front must see bad_rounds before it resets
+        conn.send(("reset", tunnel["id"]))
+
+    state.subscribe(on_event)
+    loop.add_reader(conn.fileno(), on_message)
+    on_message()
+    await index.start()
+    logger.info(f"shard {k}/{n} started")
+    task = loop.create_task(monitor_loop(discover_fn, state, cfg, locks, reset_fn, sync.flush, state, logger,
+                                         _HistoryProxy(conn.send)))
+    await stop
+    task.cancel()
+    loop.remove_reader(conn.fileno())
+    index.close()
+    close_prober()
+
+# --- front ---
+
+class ShardSupervisor:
+    """
+    Runs the N monitor workers for the front process and merges what they
+    send into the front's AppState. reset_tid(tid) is awaited for confirmed
+    resets; save_fn persists after every batch of patches.
+    """
+
+    def __init__(self, cfg: dict, state: AppState, logger, reset_tid, save_fn, history=None):
+        self.cfg = cfg
+        self.n = int(cfg["shards"])
+        self.state = state
+        self.logger = logger
+        self.reset_tid = reset_tid
+        self.save_fn = save_fn
+        self.history = history
+        self.ctx = mp.get_context("spawn")
+        self.procs: list = [None] * self.n
+        self.conns: list = [None] * self.n
+        self.syncs: list[StateSync | None] = [None] * self.n
+        self.owned = [0] * self.n
+        self.stopping = False
+        SHARD_TUNNELS.set_function(lambda: (((str(k),), v) for k, v in enumerate(self.owned)))
+
+    def start(self):
+        self.router = _FrontRouter(self)
+        self.state.subscribe(self.router.changed)
+        for k in range(self.n):
+            self._spawn(k)
+
+    def _spawn(self, k: int):
+        parent, child = self.ctx.Pipe()
+        p = self.ctx.Process(target=worker_main, args=(self.cfg, k, self.n, child), name=f"gw-shard{k}", daemon=True)
+        p.start()
+        child.close()
+        self.procs[k], self.conns[k] = p, parent
+        # one sync per worker: the front's changes are diffed against what that worker has seen
+        sync = StateSync(self.state, parent.send, FRONT_FIELDS, listen=False)
+        self.syncs[k] = sync
+        seed = [asdict(st) for st in self.state.tunnels.values() if shard_of(st.peer_public, self.n) == k]
+        for d in seed:
+            sync.mark(str(d["id"]), d)
+        parent.send(("seed", seed))
+        asyncio.get_running_loop().add_reader(parent.fileno(), lambda: self._on_message(k))
+
+    def _on_message(self, k: int):
+        conn = self.conns[k]
+        patched = False
+        try:
+            while conn.poll():
+                kind, body = conn.recv()
+                SHARD_MESSAGES.labels(kind).inc()
+                if kind == "patch":
+                    self.router.apply(k, body)
+                    patched = True
+                elif kind == "set":
+                    # a worker wrote a front field: a local write, routed back as usual
+                    self.syncs[k].apply_set(body)
+                elif kind == "event":
+                    self.state.events.append(body)
+                elif kind == "hist" and self.history is not None:
+                    self.history.record(*body)
+                elif kind == "reset":
+                    asyncio.get_running_loop().create_task(self.reset_tid(body))
+                elif kind == "owned":
+                    self.owned[k] = body
+        except (EOFError, OSError):
+            self._lost(k)
+        if patched:
+            self.save_fn()
+
+    def _lost(self, k: int):
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self.conns[k].fileno())
+        self.conns[k].close()
+        if self.stopping:
+            return
+        SHARD_RESTARTS.labels(str(k)).inc()
+        self.procs[k].join(timeout=0.5)  # reap it so exitcode is known
+        self.logger.error(f"monitor shard {k} exited (code {self.procs[k].exitcode}), restarting")
+        add_event(self.state, "error", f"monitor shard {k} died, restarting")
+        loop.call_later(1.0, self._spawn, k)
+
+    def send(self, k: int, msg):
+        conn = self.conns[k]
+        if conn is not None and not conn.closed:
+            try:
+                conn.send(msg)
+            except (BrokenPipeError, OSError):
+                pass
+
+    def stop(self):
+        self.stopping = True
+        loop = asyncio.get_running_loop()
+        for k, conn in enumerate(self.conns):
+            if conn is not None and not conn.closed:
+                loop.remove_reader(conn.fileno())
+                conn.close()
+        for p in self.procs:
+            if p is not None:
+                p.join(timeout=3)
+                if p.is_alive():
+                    p.terminate()
+
+class _FrontRouter:
+    """
+    Front side of the sync: writes to a tunnel that did not come from its
+    worker are diffed per shard and sent down; "report" kicks and
+    "link_reset" notices go to the shards owning those tunnels.
+    """
+
+    def __init__(self, sup: ShardSupervisor):
+        self.sup = sup
+        self.applying = False
+        self.dirty: dict[int, set[str]] = {}
+        self._handle: asyncio.TimerHandle | None = None
+
+    def apply(self, k: int, patches: list):
+        self.applying = True
+        try:
+            self.sup.syncs[k].apply(patches)
+        finally:
+            self.applying = False
+
+    def changed(self, kind: str, obj):
+        sup = self.sup
+        if kind in ("report", "link_reset"):
+            by_shard: dict[int, list] = {}
+            for tid in obj:
+                st = sup.state.tunnels.get(str(tid))
+                if st is not None:
+                    by_shard.setdefault(shard_of(st.peer_public, sup.n), []).append(tid)
+            for k, ids in by_shard.items():
+                sup.send(k, ("notify", (kind, ids)))
+            return
+        if kind != "tunnel" or self.applying:
+            return
+        self.dirty.setdefault(shard_of(obj.peer_public, sup.n), set()).add(str(obj.id))
+        if self._handle is None:
+            self._handle = asyncio.get_running_loop().call_later(0.05, self.flush)
+
+    def flush(self):
+        self._handle = None
+        dirty, self.dirty = self.dirty, {}
+        for k, keys in dirty.items():
+            sync = self.sup.syncs[k]
+            if sync is None:
+                continue
+            patches, sets = sync.diff(keys)
+            if patches:
+                self.sup.send(k, ("patch", patches))
+            if sets:
+                self.sup.send(k, ("set", sets))
@@ -0,0 +1,130 @@
+# gre_watchdog/coordinator/shared_fate.py
+"""
+Tunnels grouped by peer_public. Many tunnels usually end on the same outside
+server, so the public probe of a peer is run once per check interval and
+shared by all of its tunnels, and GRE failing on many of them at once is
+handled as one peer-level event instead of N independent resets.
+
+A hold lasts at most shared_fate_hold_sec (0 = until the peer recovers).
+After that the peer's tunnels are let through to the reset orchestrator for
+one round, which runs them as one wave, and a later correlated failure
+starts a new hold.
+"""
+from __future__ import annotations
+import asyncio, time
+from gre_watchdog.common.state import add_event
+from gre_watchdog.common.metrics import Counter
+
+PUBLIC_PROBES = Counter("gw_public_probes", "Public peer probes by source (sent = real probe, shared = reused)", ["source"])
+SHARED_FATE_HOLDS = Counter("gw_shared_fate_holds", "Per-tunnel resets held back because the whole peer is GRE-bad")
+
+BAD = "PUBLIC_OK_GRE_BAD"
+
+class SharedFate:
+    def __init__(self, cfg: dict, logger):
+        self.ttl = float(cfg["check_interval_sec"])
+        self.min_tunnels = int(cfg.get("shared_fate_min_tunnels", 3))
+        self.ratio = float(cfg.get("shared_fate_ratio", 0.5))
+        self.hold_sec = float(cfg.get("shared_fate_hold_sec", 600))
+        self.logger = logger
+        self.groups: dict[str, set[int]] = {}
+        self.peer_of: dict[int, str] = {}
+        self.held: dict[str, float] = {}       # peer -> held since (monotonic)
+        self.released: dict[str, float] = {}   # peer -> hold expired at
+        self._probes: dict[str, tuple[float, asyncio.Future]] = {}
+
+    def update(self, tunnels: list[dict]):
+        groups: dict[str, set[int]] = {}
+        for t in tunnels:
+            groups.setdefault(t["peer_public"], set()).add(t["id"])
+        self.groups = groups
+        self.peer_of = {tid: ip for ip, ids in groups.items() for tid in ids}
+        for ip in [k for k in self._probes if k not in groups]:
+            self._probes.pop(ip, None)
+        for ip in [k for k in self.held if k not in groups]:
+            self.held.pop(ip, None)
+        for ip in [k for k in self.released if k not in groups]:
+            self.released.pop(ip, None)
+
+    def siblings(self, tid: int) -> set[int]:
+        return self.groups.get(self.peer_of.get(tid, ""), set()) - {tid}
+
+    async def public(self, ip: str, probe_fn):
+        """
+        Single-flight probe of a public peer: a result (or the probe still in
+        flight) younger than check_interval_sec is shared.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        hit = self._probes.get(ip)
+        if hit is not None and now - hit[0] < self.ttl:
+            PUBLIC_PROBES.labels("shared").inc()
+            return await asyncio.shield(hit[1])
+        PUBLIC_PROBES.labels("sent").inc()
+        fut = asyncio.ensure_future(probe_fn())
+        self._probes[ip] = (now, fut)
+
+        def drop_failed(f: asyncio.Future):
+            if (f.cancelled() or f.exception() is not None) and self._probes.get(ip, (0, None))[1] is f:
+                self._probes.pop(ip, None)
+
+        fut.add_done_callback(drop_failed)
+        return await asyncio.shield(fut)
+
+    def _bad(self, ip: str, tunnels: dict) -> tuple[list[int], int]:
+        ids = self.groups.get(ip, set())
+        bad = []
+        for tid in ids:
+            st = tunnels.get(str(tid))
+            if st is not None and st.status == BAD:
+                bad.append(tid)
+        return sorted(bad), len(ids)
+
+    def _correlated(self, bad: list[int], n: int) -> bool:
+        return self.min_tunnels > 0 and len(bad) >= self.min_tunnels and len(bad) >= self.ratio * n
+
+    def hold(self, tunnel: dict, app_state) -> bool:
+        """
+        Called when a tunnel reached confirm_bad_rounds. True = do not reset
+        it on its own, its peer is failing as a whole.
+        """
+        ip = tunnel["peer_public"]
+        now = time.monotonic()
+        since = self.released.get(ip)
+        if since is not None:
+            # every held tunnel gets one check to reach the orchestrator's wave
+            if now - since < 2 * self.ttl:
+                return False
+            self.released.pop(ip, None)
+        bad, n = self._bad(ip, app_state.tunnels)
+        if not self._correlated(bad, n):
+            self._clear(ip, bad, n, app_state)
+            return False
+        if ip not in self.held:
+            self.held[ip] = now
+            add_event(app_state, "warn", f"shared fate: {len(bad)}/{n} tunnels to {ip} GRE-bad, holding per-tunnel resets",
+                      extra={"peer_public": ip, "tunnels": bad})
+            self.logger.warning(f"shared fate peer={ip} bad={len(bad)}/{n}", extra={"peer": ip})
+        elif self.hold_sec > 0 and now - self.held[ip] >= self.hold_sec:
+            self.held.pop(ip)
+            self.released[ip] = now
+            add_event(app_state, "warn", f"shared fate hold expired after {self.hold_sec:.0f}s: resetting {len(bad)}/{n} tunnels to {ip}",
+                      extra={"peer_public": ip, "tunnels": bad})
+            self.logger.warning(f"shared fate hold expired peer={ip} bad={len(bad)}/{n}", extra={"peer": ip})
+            return False
+        SHARED_FATE_HOLDS.inc()
+        return True
+
+    def observe(self, tunnel: dict, app_state):
+        # release the peer once its failure is no longer correlated
+        ip = tunnel["peer_public"]
+        if ip not in self.held:
+            return
+        bad, n = self._bad(ip, app_state.tunnels)
+        if not self._correlated(bad, n):
+            self._clear(ip, bad, n, app_state)
+
+    def _clear(self, ip: str, bad: list[int], n: int, app_state):
+        if self.held.pop(ip, None) is not None:
+            add_event(app_state, "info", f"shared fate cleared: {len(bad)}/{n} tunnels to {ip} GRE-bad",
+                      extra={"peer_public": ip, "tunnels": bad})
@@ -0,0 +1,102 @@
+# gre_watchdog/coordinator/timers.py
+"""
+Central deadline keeper for the coordinator: pause expiry, reset-rate
+windows, reset hold/gap deadlines and panel sessions. All of them sit in one
+heap behind a single loop timer, so nothing has to be rescanned per round and
+every expiry is acted on (and published) the moment it happens.
+"""
+from __future__ import annotations
+import asyncio, heapq, itertools, math, time
+from typing import Callable, Hashable
+from gre_watchdog.common.metrics import Counter, GaugeFunc
+
+TIMERS_FIRED = Counter("gw_timers_fired", "Expired coordinator timers by kind", ["kind"])
+TIMERS_PENDING = GaugeFunc("gw_timers_pending", "Armed coordinator timers")
+
+def _kind(key) -> str:
+    return str(key[0] if isinstance(key, tuple) else key)
+
+class Timers:
+    """
+    Keyed wall-clock timers (deadlines are persisted as time.time() values).
+    set() on a key that is already armed replaces it; cancel() drops it.
+    Replaced/cancelled heap entries are skipped when they reach the top.
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self._heap: list[tuple[float, int, Hashable, Callable[[], None]]] = []
+        self._entries: dict[Hashable, tuple] = {}
+        self._seq = itertools.count()
+        self._handle: asyncio.TimerHandle | None = None
+        self._armed_at = math.inf
+        TIMERS_PENDING.set_function(lambda: (((), len(self._entries)),))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def when(self, key) -> float | None:
+        e = self._entries.get(key)
+        return e[0] if e else None
+
+    def set(self, key: Hashable, when: float, fn: Callable[[], None]):
+        e = (when, next(self._seq), key, fn)
+        self._entries[key] = e
+        heapq.heappush(self._heap, e)
+        if when < self._armed_at:
+            self._arm()
+
+    def cancel(self, key: Hashable):
+        if self._entries.pop(key, None) is None:
+            return
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+    async def sleep_until(self, when: float):
+        fut = asyncio.get_running_loop().create_future()
+        key = ("sleep", next(self._seq))
+        self.set(key, when, lambda: fut.done() or fut.set_result(None))
+        try:
+            await fut
+        finally:
+            self.cancel(key)
+
+    def _arm(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        heap = self._heap
+        while heap and self._entries.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+        self._armed_at = math.inf
+        if not heap:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # armed by the next set() made inside the loop
+        self._armed_at = heap[0][0]
+        self._handle = loop.call_later(max(0.0, self._armed_at - time.time()), self._fire)
+
+    def _fire(self):
+        self._handle = None
+        self._armed_at = math.inf
+        now = time.time()
+        heap = self._heap
+        # the loop clock is monotonic; a wall-clock step just re-arms
+        while heap and heap[0][0] <= now:
+            e = heapq.heappop(heap)
+            if self._entries.get(e[2]) is not e:
+                continue
+            del self._entries[e[2]]
+            TIMERS_FIRED.labels(_kind(e[2])).inc()
+            try:
+                e[3]()
+            except Exception as ex:
+                if self.logger:
+                    self.logger.error(f"timer {e[2]} failed err={ex}")
+        self._arm()
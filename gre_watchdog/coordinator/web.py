@@ -1,52 +1,186 @@
 import time
 from fastapi import APIRouter, Request, HTTPException, Form
-from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse, StreamingResponse
 from jinja2 import Template
 from gre_watchdog.common.security import new_token, Session
+from gre_watchdog.common.util import parse_duration
+from gre_watchdog.common.logtail import afollow
+from gre_watchdog.coordinator.live import LiveFeed
+from gre_watchdog.coordinator.timers import Timers
 
 TEMPLATE = Template("""
 <html>
 <head><meta charset="utf-8"><title>GRE Watchdog</title></head>
 <body style="font-family:sans-serif;max-width:1100px;margin:20px auto">
   <h2>GRE Watchdog</h2>
-  <p>Logged in as: {{user}}</p>
+  <p>Logged in as: {{user}} <span id="live" style="color:#888">(connecting...)</span></p>
   <form method="post" action="/logout"><button>Logout</button></form>
 
   <h3>Tunnels</h3>
   <table border="1" cellpadding="6" cellspacing="0" style="width:100%">
-    <tr>
-      <th>ID</th><th>Status</th><th>Public loss%</th><th>GRE loss%</th><th>Bad rounds</th>
+    <thead><tr>
+      <th>ID</th><th>Status</th><th>Public loss%</th><th>GRE loss%</th><th>GRE rtt ms</th><th>Bad rounds</th>
       <th>Paused until</th><th>Last action</th><th>Actions</th>
-    </tr>
-    {% for t in tunnels %}
-    <tr>
-      <td>{{t.id}}</td>
-      <td>{{t.status}}</td>
-      <td>{{"%.1f"|format(t.last_public_loss)}}</td>
-      <td>{{"%.1f"|format(t.last_gre_loss)}}</td>
-      <td>{{t.bad_rounds}}</td>
-      <td>{{t.paused_until_h}}</td>
-      <td>{{t.last_action}}</td>
-      <td>
-        <form method="post" action="/action/reset/{{t.id}}" style="display:inline"><button>Reset</button></form>
-        <form method="post" action="/action/down/{{t.id}}"  style="display:inline"><button>Down</button></form>
-        <form method="post" action="/action/up/{{t.id}}"    style="display:inline"><button>Up</button></form>
-        <form method="post" action="/action/restart/{{t.id}}" style="display:inline"><button>Restart</button></form>
-        <form method="post" action="/action/pause/{{t.id}}" style="display:inline"><button>Pause</button></form>
-        <form method="post" action="/action/resume/{{t.id}}" style="display:inline"><button>Resume</button></form>
-      </td>
-    </tr>
-    {% endfor %}
+    </tr></thead>
+    <tbody id="tunnels"></tbody>
   </table>
 
   <h3>Global actions</h3>
   <form method="post" action="/action/reset_all"><button>Reset ALL</button></form>
 
+  <h3>Resets in progress</h3>
+  <table border="1" cellpadding="4" cellspacing="0" style="width:100%">
+    <thead><tr><th>Wave</th><th>Phase</th><th>Tunnels</th><th>Failed</th><th>Started</th><th>Phase ends</th></tr></thead>
+    <tbody id="resets"><tr><td colspan="6">-</td></tr></tbody>
+  </table>
+
   <h3>Recent events</h3>
-  <pre style="background:#f4f4f4;padding:10px;height:260px;overflow:auto">{{events}}</pre>
+  <pre id="events" style="background:#f4f4f4;padding:10px;height:260px;overflow:auto"></pre>
 
   <h3>Logs</h3>
-  <p><a href="/logs/coordinator">Open coordinator log</a></p>
+  <p><a href="/logs/coordinator">Open coordinator log</a> · <a href="/logs/coordinator/stream">follow</a></p>
+
+<script>
+// snapshot once, then only changed rows / new events (see coordinator/live.py)
+const ACTIONS = ["reset", "down", "up", "restart", "pause", "resume"];
+const MAX_EVENTS = 200;
+const body = document.getElementById("tunnels");
+const evbox = document.getElementById("events");
+const rows = new Map();
+let maxId = -1;
+let lastSeq = -1;
+
+function pad(n) { return String(n).padStart(2, "0"); }
+function fmtTime(ts) {
+  const d = new Date(ts * 1000);
+  return d.getFullYear() + "-" + pad(d.getMonth() + 1) + "-" + pad(d.getDate()) + " " +
+         pad(d.getHours()) + ":" + pad(d.getMinutes()) + ":" + pad(d.getSeconds());
+}
+function num(v) { return v === null || v === undefined ? "-" : v.toFixed(1); }
+
+function newRow(id) {
+  const tr = document.createElement("tr");
+  for (let i = 0; i < 8; i++) tr.appendChild(document.createElement("td"));
+  const a = document.createElement("a");
+  a.href = "/history/" + id;
+  a.textContent = id;
+  tr.cells[0].appendChild(a);
+  const td = document.createElement("td");
+  for (const act of ACTIONS) {
+    const f = document.createElement("form");
+    f.method = "post";
+    f.action = "/action/" + act + "/" + id;
+    f.style.display = "inline";
+    const b = document.createElement("button");
+    b.textContent = act[0].toUpperCase() + act.slice(1);
+    f.appendChild(b);
+    td.appendChild(f);
+  }
+  tr.appendChild(td);
+  // keep rows ordered by id (snapshot arrives sorted, so that is the append path)
+  let before = null;
+  if (id < maxId) for (const [k, r] of rows) if (k > id && (before === null || k < before[0])) before = [k, r];
+  body.insertBefore(tr, before ? before[1] : null);
+  rows.set(id, tr);
+  maxId = Math.max(maxId, id);
+  return tr;
+}
+
+function applyRow(t) {
+  const tr = rows.get(t.id) || newRow(t.id);
+  const c = tr.cells;
+  c[1].textContent = t.status;
+  c[2].textContent = num(t.public_loss);
+  c[3].textContent = num(t.gre_loss);
+  c[4].textContent = num(t.gre_rtt_ms);
+  c[5].textContent = t.bad_rounds;
+  c[6].textContent = t.paused_until ? fmtTime(t.paused_until) : "-";
+  c[7].textContent = t.last_action;
+}
+
+const resetsBody = document.getElementById("resets");
+let resets = [];
+function renderResets() {
+  resetsBody.textContent = "";
+  const now = Date.now() / 1000;
+  for (const w of resets) {
+    const tr = document.createElement("tr");
+    const left = w.phase_until > now ? Math.ceil(w.phase_until - now) + "s" : "-";
+    const ids = w.tunnels.length > 20 ? w.tunnels.slice(0, 20).join(", ") + " ..." : w.tunnels.join(", ");
+    for (const v of [w.id, w.phase, w.tunnels.length + " (" + ids + ")", w.failed, fmtTime(w.started_at), left]) {
+      const td = document.createElement("td");
+      td.textContent = v;
+      tr.appendChild(td);
+    }
+    resetsBody.appendChild(tr);
+  }
+  if (!resets.length) resetsBody.innerHTML = '<tr><td colspan="6">-</td></tr>';
+}
+setInterval(() => { if (resets.length) renderResets(); }, 1000);
+
+function addEvents(items) {
+  let text = "";
+  for (const e of items) {
+    if (e.seq <= lastSeq) continue;
+    lastSeq = e.seq;
+    text += fmtTime(e.ts) + " [" + e.kind + "] tid=" + (e.tunnel_id ?? "-") + " " + e.msg + "\\n";
+  }
+  if (!text) return;
+  const stick = evbox.scrollTop + evbox.clientHeight >= evbox.scrollHeight - 5;
+  evbox.textContent += text;
+  const lines = evbox.textContent.split("\\n");
+  if (lines.length > MAX_EVENTS + 1) evbox.textContent = lines.slice(-MAX_EVENTS - 1).join("\\n");
+  if (stick) evbox.scrollTop = evbox.scrollHeight;
+}
+
+const live = document.getElementById("live");
+const es = new EventSource("/live");
+es.addEventListener("snapshot", (m) => {
+  const d = JSON.parse(m.data);
+  body.textContent = "";
+  rows.clear();
+  maxId = -1;
+  evbox.textContent = "";
+  lastSeq = -1;
+  d.tunnels.forEach(applyRow);
+  addEvents(d.events);
+  resets = d.resets;
+  renderResets();
+  evbox.scrollTop = evbox.scrollHeight;
+  live.textContent = "(live)";
+});
+es.addEventListener("tunnels", (m) => JSON.parse(m.data).forEach(applyRow));
+es.addEventListener("events", (m) => addEvents(JSON.parse(m.data)));
+es.addEventListener("resets", (m) => { resets = JSON.parse(m.data); renderResets(); });
+es.onerror = () => { live.textContent = "(reconnecting...)"; };
+</script>
+</body>
+</html>
+""")
+
+HISTORY_TEMPLATE = Template("""
+<html>
+<head><meta charset="utf-8"><title>GRE Watchdog - tunnel {{tid}}</title></head>
+<body style="font-family:sans-serif;max-width:1100px;margin:20px auto">
+  <h2>Tunnel {{tid}} history</h2>
+  <p><a href="/">Back</a> |
+    {% for s in ["1h", "6h", "24h", "7d", "30d", "365d"] %}<a href="/history/{{tid}}?since={{s}}">{{s}}</a> {% endfor %}
+  </p>
+  <p>Range: last {{since}} (tier: {{tier}}, {{points|length}} points)</p>
+  <table border="1" cellpadding="4" cellspacing="0" style="width:100%">
+    <tr><th>Time</th><th>Public loss%</th><th>GRE loss%</th><th>GRE loss% max</th><th>Public rtt ms</th><th>GRE rtt ms</th><th>Samples</th></tr>
+    {% for p in points %}
+    <tr>
+      <td>{{p.time}}</td>
+      <td>{{"%.1f"|format(p.public_loss)}}</td>
+      <td>{{"%.1f"|format(p.gre_loss)}}</td>
+      <td>{{"%.1f"|format(p.gre_loss_max)}}</td>
+      <td>{{"-" if p.public_rtt_ms is none else "%.1f"|format(p.public_rtt_ms)}}</td>
+      <td>{{"-" if p.gre_rtt_ms is none else "%.1f"|format(p.gre_rtt_ms)}}</td>
+      <td>{{p.n}}</td>
+    </tr>
+    {% endfor %}
+  </table>
 </body>
 </html>
 """)
@@ -66,17 +200,26 @@ LOGIN_TEMPLATE = Template("""
 </body></html>
 """)
 
-def build_router(state, cfg, logger, do_action, read_log):
+def build_router(state, cfg, logger, do_action, read_log, history=None, timers=None, log_path=None):
     r = APIRouter()
     sessions: dict[str, Session] = {}
+    feed = LiveFeed(state, delay=cfg.get("panel_live_delay_ms", 250) / 1000.0)
+    if timers is None:
+        timers = Timers(logger)
+
+    def end_session(tok: str):
+        # expiry timer or logout: forget the token and close its live streams now
+        sessions.pop(tok, None)
+        timers.cancel(("session", tok))
+        feed.close(tok)
 
     def get_session(req: Request) -> Session | None:
         tok = req.cookies.get("gw_session", "")
         s = sessions.get(tok)
         if not s:
             return None
-        if time.time() > s.expires_at:
-            sessions.pop(tok, None)
+        if time.time() > s.expires_at:  # its timer is about to fire
+            end_session(tok)
             return None
         return s
 
@@ -97,14 +240,14 @@ def build_router(state, cfg, logger, do_action, read_log):
         tok = new_token()
         ttl = cfg["panel_session_ttl_min"] * 60
         sessions[tok] = Session(token=tok, username=username, expires_at=time.time() + ttl)
+        timers.set(("session", tok), sessions[tok].expires_at, lambda: end_session(tok))
         resp = RedirectResponse("/", status_code=303)
         resp.set_cookie("gw_session", tok, httponly=True, secure=False, samesite="lax")
         return resp
 
     @r.post("/logout")
     async def logout(req: Request):
-        tok = req.cookies.get("gw_session", "")
-        sessions.pop(tok, None)
+        end_session(req.cookies.get("gw_session", ""))
         resp = RedirectResponse("/login", status_code=303)
         resp.delete_cookie("gw_session")
         return resp
@@ -114,29 +257,35 @@ def build_router(state, cfg, logger, do_action, read_log):
         s = get_session(req)
         if not s:
             return RedirectResponse("/login", status_code=303)
+        # rows and events arrive over /live
+        return TEMPLATE.render(user=s.username)
 
-        tunnels = []
-        for k, t in sorted(state.tunnels.items(), key=lambda x: int(x[0])):
-            paused = "-" if t.paused_until <= time.time() else time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t.paused_until))
-            tunnels.append(type("T", (), {
-                "id": t.id,
-                "status": t.status,
-                "last_public_loss": t.last_public_loss,
-                "last_gre_loss": t.last_gre_loss,
-                "bad_rounds": t.bad_rounds,
-                "paused_until_h": paused,
-                "last_action": t.last_action
-            })())
-
-        # events
-        lines = []
-        for e in state.events[-200:]:
-            ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e["ts"]))
-            tid = e.get("tunnel_id", "-")
-            lines.append(f"{ts} [{e['kind']}] tid={tid} {e['msg']}")
-        events_txt = "\n".join(lines)
-
-        return TEMPLATE.render(user=s.username, tunnels=tunnels, events=events_txt)
+    @r.get("/live")
+    async def live(req: Request):
+        s = require_login(req)
+        c = feed.connect(owner=s.token)
+        return StreamingResponse(
+            feed.stream(c, lambda: s.token in sessions),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @r.get("/history/{tid}", response_class=HTMLResponse)
+    async def tunnel_history(req: Request, tid: int, since: str = "6h"):
+        require_login(req)
+        if history is None:
+            raise HTTPException(404, "history disabled")
+        now = time.time()
+        try:
+            start = now - parse_duration(since)
+        except ValueError:
+            raise HTTPException(400, "bad since")
+        q = history.query(tid, start, now)
+        points = []
+        for p in reversed(q["points"]):
+            p["time"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(p["ts"]))
+            points.append(p)
+        return HISTORY_TEMPLATE.render(tid=tid, since=since, tier=q["tier"], points=points)
 
     # Actions
     @r.post("/action/reset/{tid}")
@@ -186,4 +335,16 @@ def build_router(state, cfg, logger, do_action, read_log):
         require_login(req)
         return read_log()
 
+    @r.get("/logs/coordinator/stream")
+    async def logs_stream(req: Request, n: int = 50):
+        # tail -f روی HTTP: n خط آخر، بعد هر چه اضافه شود (با inotify)
+        s = require_login(req)
+        if log_path is None:
+            raise HTTPException(404, "no log")
+        return StreamingResponse(
+            afollow(log_path, max(0, min(n, 5000)), lambda: s.token in sessions),
+            media_type="text/plain; charset=utf-8",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
     return r
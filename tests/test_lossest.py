@@ -0,0 +1,44 @@
+import math
+import pytest
+from gre_watchdog.common.lossest import LossEstimator, beta_cdf
+
+@pytest.mark.parametrize("x,a,b,want", [
+    (0.5, 1, 1, 0.5),
+    (0.3, 1, 1, 0.3),
+    (0.2, 3, 1, 0.2 ** 3),                    # I_x(a, 1) = x^a
+    (0.2, 1, 4, 1 - 0.8 ** 4),                # I_x(1, b) = 1 - (1-x)^b
+    (0.3, 2, 3, sum(math.comb(4, j) * 0.3 ** j * 0.7 ** (4 - j) for j in range(2, 5))),
+    (0.05, 1, 59, 1 - 0.95 ** 59),
+    (0.9, 50, 5, 1 - beta_cdf(0.1, 5, 50)),   # symmetry
+])
+def test_beta_cdf_known_values(x, a, b, want):
+    assert beta_cdf(x, a, b) == pytest.approx(want, rel=1e-9, abs=1e-12)
+
+def test_beta_cdf_bounds():
+    assert beta_cdf(0.0, 2, 2) == 0.0
+    assert beta_cdf(1.0, 2, 2) == 1.0
+
+def test_session_ok_needs_enough_clean_replies():
+    # flat prior, 5% threshold: P(p < 0.05) = 1 - 0.95^(n+1) after n replies
+    est = LossEstimator(5.0, confidence=0.95, min_samples=3, decay=0.8)
+    s = est.session("10.0.0.1")
+    assert s.update(57, 0) is None      # 1 - 0.95^58 = 0.949
+    assert s.update(58, 0) is True      # 1 - 0.95^59 = 0.951
+
+def test_session_bad_after_min_samples():
+    est = LossEstimator(5.0, min_samples=3)
+    s = est.session("10.0.0.1")
+    assert s.update(0, 2) is None       # below min_samples
+    assert s.update(0, 3) is False
+
+def test_belief_carries_over_decayed_and_forget_resets_it():
+    est = LossEstimator(5.0, decay=0.5)
+    s = est.session("p")
+    s.update(0, 10)
+    s.finish()
+    assert est.state["p"] == (11.0, 1.0)
+    nxt = est.session("p")
+    assert (nxt.a0, nxt.b0) == (6.0, 1.0)  # halfway back to the (1, 1) prior
+    est.forget("p")
+    fresh = est.session("p")
+    assert (fresh.a0, fresh.b0) == (1.0, 1.0)
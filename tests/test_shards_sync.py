@@ -0,0 +1,117 @@
+"""
+StateSync field ownership between a front and a worker, with the pipe
+replaced by two lists so message order can be chosen by the test.
+"""
+from dataclasses import asdict
+from gre_watchdog.common.state import AppState, TunnelState
+from gre_watchdog.coordinator.shards import FRONT_FIELDS, WORKER_FIELDS, StateSync
+
+def tunnel(tid: int = 1) -> TunnelState:
+    return TunnelState(tid, f"gre{tid}", f"gre-kh-{tid}", "198.51.100.1", "10.0.0.1", "10.0.0.2")
+
+class Pair:
+    def __init__(self):
+        self.to_front, self.to_worker = [], []
+        self.front, self.worker = AppState(), AppState()
+        self.fs = StateSync(self.front, self.to_worker.append, FRONT_FIELDS)
+        self.ws = StateSync(self.worker, self.to_front.append, WORKER_FIELDS)
+
+    @staticmethod
+    def deliver(sync: StateSync, q: list):
+        while q:
+            kind, body = q.pop(0)
+            (sync.apply if kind == "patch" else sync.apply_set)(body)
+
+    def settle(self):
+        # flush both sides and deliver until nothing moves
+        for _ in range(10):
+            self.ws.flush()
+            self.fs.flush()
+            if not self.to_front and not self.to_worker:
+                return
+            self.deliver(self.fs, self.to_front)
+            self.deliver(self.ws, self.to_worker)
+        raise AssertionError("sync did not settle")
+
+    def same(self, key: str = "1") -> bool:
+        return asdict(self.front.tunnels[key]) == asdict(self.worker.tunnels[key])
+
+def discovered(pair: Pair, bad_rounds: int = 0) -> Pair:
+    pair.worker.tunnels["1"] = tunnel()
+    pair.worker.tunnels["1"].bad_rounds = bad_rounds
+    pair.settle()
+    return pair
+
+def test_new_tunnel_reaches_front_intact():
+    p = Pair()
+    p.worker.tunnels["1"] = tunnel()
+    w = p.worker.tunnels["1"]
+    w.status, w.bad_rounds, w.last_gre_loss, w.last_gre_rtt_ms = "PUBLIC_OK_GRE_BAD", 1, 100.0, None
+    p.settle()
+    assert "1" in p.front.tunnels
+    assert p.same()
+    assert p.front.tunnels["1"].iface_remote == "gre-kh-1"
+
+def test_front_clear_races_worker_patch_patch_first():
+    p = discovered(Pair(), bad_rounds=2)
+    # worker's bump is on the wire when the front clears the counter
+    p.worker.tunnels["1"].bad_rounds = 3
+    p.ws.flush()
+    p.front.tunnels["1"].bad_rounds = 0
+    p.deliver(p.fs, p.to_front)          # stale patch must not undo the pending front write
+    assert p.front.tunnels["1"].bad_rounds == 0
+    p.settle()
+    assert p.worker.tunnels["1"].bad_rounds == 0
+    assert p.same()
+
+def test_front_clear_races_worker_patch_set_first():
+    p = discovered(Pair(), bad_rounds=2)
+    p.worker.tunnels["1"].bad_rounds = 3
+    p.ws.flush()
+    p.front.tunnels["1"].bad_rounds = 0
+    p.fs.flush()                         # the set crosses the patch
+    p.deliver(p.ws, p.to_worker)
+    p.deliver(p.fs, p.to_front)
+    p.settle()
+    assert p.front.tunnels["1"].bad_rounds == p.worker.tunnels["1"].bad_rounds == 0
+    assert p.same()
+
+def test_each_side_ignores_patches_to_fields_it_owns():
+    p = discovered(Pair())
+    p.fs.apply([("1", {"reset_phase": "hold", "bad_rounds": 7})])
+    assert p.front.tunnels["1"].reset_phase == ""      # front-owned: dropped
+    assert p.front.tunnels["1"].bad_rounds == 7
+
+def test_front_writes_reach_worker():
+    p = discovered(Pair())
+    f = p.front.tunnels["1"]
+    f.reset_phase, f.reset_deadline, f.status = "hold", 123.0, "RESETTING"
+    p.settle()
+    w = p.worker.tunnels["1"]
+    assert (w.reset_phase, w.reset_deadline, w.status) == ("hold", 123.0, "RESETTING")
+    assert p.same()
+
+def test_reseed_after_worker_restart():
+    p = discovered(Pair(), bad_rounds=2)
+    f = p.front.tunnels["1"]
+    f.reset_phase, f.paused_until = "hold", 99.0
+    p.settle()
+    # the worker dies; the front seeds a fresh one as ShardSupervisor._spawn does
+    p.to_front.clear(), p.to_worker.clear()
+    p.worker = AppState()
+    p.ws = StateSync(p.worker, p.to_front.append, WORKER_FIELDS)
+    seed = [asdict(st) for st in p.front.tunnels.values()]
+    p.front.unsubscribe(p.fs._changed)
+    p.fs = StateSync(p.front, p.to_worker.append, FRONT_FIELDS)
+    for d in seed:
+        p.fs.mark(str(d["id"]), d)
+    p.ws.seed(seed)
+    assert p.same()
+    assert p.worker.tunnels["1"].bad_rounds == 2
+    p.ws.flush()
+    p.fs.flush()
+    assert not p.to_front and not p.to_worker   # nothing to resend after a seed
+    p.worker.tunnels["1"].bad_rounds = 3
+    p.settle()
+    assert p.front.tunnels["1"].bad_rounds == 3
+    assert p.same()
@@ -0,0 +1,19 @@
+import logging
+from bench.bench_sim import build
+from bench.sim import Simulation
+
+def run(tmp_path, **overrides):
+    logging.getLogger().setLevel(logging.ERROR)
+    return Simulation(build("gre_fault", 10, 1), str(tmp_path), overrides).run(1800)
+
+def test_one_fault_one_reset_with_loss_estimator(tmp_path):
+    # the belief built while the link was held down must not trigger a second reset
+    rep = run(tmp_path, loss_estimator=True)
+    assert rep.resets == 1
+    assert rep.false_resets == 0
+    assert rep.unrecovered == 0
+
+def test_one_fault_one_reset_without_loss_estimator(tmp_path):
+    rep = run(tmp_path, loss_estimator=False)
+    assert rep.resets == 1
+    assert rep.false_resets == 0